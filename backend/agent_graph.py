@@ -0,0 +1,238 @@
+"""
+Agent Graph
+-----------
+Small dependency-graph executor used by the AgentService to run agents concurrently.
+Each node declares the nodes whose output it actually consumes; independent nodes run
+in parallel on a shared thread pool, with a per-node timeout and fallback. A node's
+timeout counts from when a worker picks it up, and `max_runs` caps how many run()
+calls share the pool so queued nodes are not starved by other requests.
+arun() executes the same graph on an asyncio event loop: nodes with an async
+implementation are awaited, the others run on the thread pool.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import asyncio
+import contextvars
+import threading
+import time
+import traceback
+
+from metrics import AGENT_SECONDS, AGENT_FALLBACKS
+import tracing
+
+# How often run() rechecks nodes still queued for a worker, whose deadline is not set yet
+QUEUED_POLL_INTERVAL = 0.05
+
+
+class AgentNode:
+    """A single unit of work in the agent graph"""
+
+    def __init__(self, name, func, deps=(), timeout=None, fallback=None, stage=None, afunc=None):
+        self.name = name
+        self.func = func
+        self.afunc = afunc
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+        self.stage = stage
+
+
+class AgentGraph:
+    """Runs a set of AgentNodes as a DAG, starting each node as soon as its inputs are ready"""
+
+    def __init__(self, max_workers=8, default_timeout=60, max_runs=None):
+        self.nodes = {}
+        self.default_timeout = default_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        # Each run() holds a slot until all of its nodes have given their worker back
+        self._runs = threading.BoundedSemaphore(max_runs) if max_runs else None
+
+    def add_node(self, name, func, deps=(), timeout=None, fallback=None, stage=None, afunc=None):
+        """Register a node. `func(inputs, upstream)` receives the graph inputs and the
+        results of its declared dependencies; `afunc` is an optional coroutine
+        function with the same signature, used by arun()."""
+        for dep in deps:
+            if dep not in self.nodes:
+                raise ValueError(f"Unknown dependency '{dep}' for node '{name}'")
+        self.nodes[name] = AgentNode(name, func, deps, timeout, fallback, stage, afunc)
+        return self.nodes[name]
+
+    def _select(self, only):
+        """Return the requested nodes plus everything they transitively depend on"""
+        if only is None:
+            return list(self.nodes)
+        selected = []
+        pending = list(only)
+        while pending:
+            name = pending.pop()
+            if name in selected:
+                continue
+            if name not in self.nodes:
+                raise ValueError(f"Unknown node '{name}'")
+            selected.append(name)
+            pending.extend(self.nodes[name].deps)
+        # Keep registration order so results are deterministic
+        return [name for name in self.nodes if name in selected]
+
+    @staticmethod
+    def _call(node, inputs, upstream, started=None):
+        if started is not None:
+            started[node.name] = time.time()
+        with tracing.span(f"agent.{node.name}", stage=node.stage):
+            return node.func(inputs, upstream)
+
+    @staticmethod
+    async def _acall(node, inputs, upstream):
+        with tracing.span(f"agent.{node.name}", stage=node.stage):
+            return await node.afunc(inputs, upstream)
+
+    def _fallback(self, node, error, reason='error'):
+        print(f"{node.name} agent error: {error}")
+        AGENT_FALLBACKS.inc(agent=node.name, reason=reason)
+        return node.fallback() if node.fallback else {"error": error}
+
+    def _release_after(self, futures):
+        """Free the run's slot once every one of its nodes has finished, including
+        timed-out nodes that are still holding a worker thread"""
+        pending = [future for future in futures if not future.done()]
+        if not pending:
+            self._runs.release()
+            return
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._runs.release()
+
+        for future in pending:
+            future.add_done_callback(done)
+
+    def run(self, inputs, only=None, on_result=None):
+        """Execute the graph and return (results, timings).
+
+        `only` restricts execution to a subset of nodes (and their dependencies).
+        `on_result(name, result)` is called from the calling thread as each node finishes.
+        """
+        names = self._select(only)
+        if self._runs is not None:
+            self._runs.acquire()
+        submitted = []
+        try:
+            return self._run(names, inputs, on_result, submitted)
+        finally:
+            if self._runs is not None:
+                self._release_after(submitted)
+
+    def _run(self, names, inputs, on_result, submitted):
+        results = {}
+        timings = {}
+        running = {}
+        waiting = list(names)
+        # Written by the worker when it picks the node up; deadlines count from then
+        started = {}
+
+        def finish(node, result, submitted_at):
+            elapsed = time.time() - started.get(node.name, submitted_at)
+            results[node.name] = result
+            timings[node.name] = round(elapsed, 4)
+            AGENT_SECONDS.observe(elapsed, agent=node.name)
+            if on_result:
+                on_result(node.name, result)
+
+        while waiting or running:
+            # Start every node whose dependencies have all completed
+            for name in list(waiting):
+                node = self.nodes[name]
+                if all(dep in results for dep in node.deps):
+                    waiting.remove(name)
+                    upstream = {dep: results[dep] for dep in node.deps}
+                    # Run in a copy of the caller's context so the node's spans join the request trace
+                    future = self.executor.submit(contextvars.copy_context().run, self._call, node, inputs,
+                                                  upstream, started)
+                    submitted.append(future)
+                    running[future] = (node, time.time())
+
+            if not running:
+                break
+
+            deadlines = self._deadlines(running, started)
+            timeout = min(deadlines.values(), default=None)
+            if timeout is not None:
+                timeout = max(0, timeout - time.time())
+            if len(deadlines) < len(running):
+                timeout = min(timeout, QUEUED_POLL_INTERVAL) if timeout is not None else QUEUED_POLL_INTERVAL
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                node, submitted_at = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(traceback.format_exc())
+                    result = self._fallback(node, str(e))
+                finish(node, result, submitted_at)
+
+            # Anything past its deadline gets its fallback; the worker thread is left to finish
+            now = time.time()
+            for future, deadline in self._deadlines(running, started).items():
+                if now >= deadline:
+                    node, submitted_at = running.pop(future)
+                    result = self._fallback(node, f"timed out after {node.timeout or self.default_timeout}s", 'timeout')
+                    finish(node, result, submitted_at)
+
+        return results, timings
+
+    def _deadlines(self, running, started):
+        """Deadlines of the running nodes a worker has picked up"""
+        return {future: started[node.name] + (node.timeout or self.default_timeout)
+                for future, (node, _) in running.items() if node.name in started}
+
+    async def arun(self, inputs, only=None):
+        """Execute the graph on the running event loop and return (results, timings)"""
+        loop = asyncio.get_running_loop()
+        results = {}
+        timings = {}
+        tasks = {}
+
+        async def run_node(node):
+            upstream = {dep: await tasks[dep] for dep in node.deps}
+            started = time.time()
+            timeout = node.timeout or self.default_timeout
+            try:
+                if node.afunc is not None:
+                    call = self._acall(node, inputs, upstream)
+                else:
+                    # Time the node from when a worker picks it up, as run() does
+                    picked_up = asyncio.Event()
+
+                    def call_in_worker():
+                        loop.call_soon_threadsafe(picked_up.set)
+                        return self._call(node, inputs, upstream)
+
+                    call = loop.run_in_executor(self.executor, contextvars.copy_context().run, call_in_worker)
+                    await picked_up.wait()
+                    started = time.time()
+                result = await asyncio.wait_for(call, timeout)
+            except asyncio.TimeoutError:
+                result = self._fallback(node, f"timed out after {timeout}s", 'timeout')
+            except Exception as e:
+                print(traceback.format_exc())
+                result = self._fallback(node, str(e))
+            results[node.name] = result
+            timings[node.name] = round(time.time() - started, 4)
+            AGENT_SECONDS.observe(time.time() - started, agent=node.name)
+            return result
+
+        # Dependencies are registered before their dependents, so their tasks already exist
+        for name in self._select(only):
+            tasks[name] = asyncio.ensure_future(run_node(self.nodes[name]))
+        await asyncio.gather(*tasks.values())
+        return results, timings
+
+    def shutdown(self):
+        """Release the worker threads"""
+        self.executor.shutdown(wait=False)
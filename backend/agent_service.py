@@ -11,126 +11,348 @@ from agents.actions_agent import ActionsAgent
 from agents.router_agent import RouterAgent
 from agents.time_estimator_agent import TimeEstimatorAgent
 from agents.recommendations_agent import RecommendationsAgent
+from agents.fused_agent import FusedAnalysisAgent
+from agent_graph import AgentGraph
+from prompt_builder import PromptContext
+from ollama_client import OllamaClient, summarize_timings
+from llm_cache import LLMCache
+from metrics import AGENT_FALLBACKS, FUSED_SECTION_FALLBACKS
+from tracing import traced, set_attributes
+import threading
 import traceback
+import queue
 import time
+import os
+
+# Graph nodes that make up the regular one-call-per-agent analysis
+AGENT_NODES = ['summary', 'sentiment', 'actions', 'routing', 'timeEstimation', 'recommendations']
+
+# Sections of the fused response and the agent whose schema validates each one
+FUSED_SECTION_AGENTS = {
+    'summary': 'summarizer',
+    'actions': 'actions',
+    'routing': 'router',
+    'timeEstimation': 'time_estimator',
+    'recommendations': 'recommendations'
+}
+
+PROCESSING_MODES = ('multi', 'fused')
 
 class AgentService:
-    def __init__(self, ollama_url, model):
+    def __init__(self, ollama_url, model, max_workers=None, agent_timeout=None, mode=None, similar_tickets=None,
+                 local_router=None, resolution_model=None, max_runs=None):
         self.ollama_url = ollama_url
         self.model = model
+        # Optional routing_model.LocalRouter that answers confident routing without the LLM
+        self.local_router = local_router
+        # Optional resolution_model.ResolutionTimeModel used for time estimates before the LLM
+        self.resolution_model = resolution_model
+        # Optional callable returning the IDs of tickets similar to a ticket; when set,
+        # it replaces the summarizer's guessed similarTickets
+        self.similar_tickets = similar_tickets
+        self.mode = mode or os.environ.get("AGENT_MODE", "multi")
+        if self.mode not in PROCESSING_MODES:
+            raise ValueError(f"Unknown agent mode '{self.mode}', expected one of: {', '.join(PROCESSING_MODES)}")
+        self.max_workers = max_workers or int(os.environ.get("AGENT_WORKERS", "16"))
+        self.agent_timeout = agent_timeout or float(os.environ.get("AGENT_TIMEOUT", "60"))
+        # Tickets analysed on the graph at once; each one needs up to six workers
+        self.max_runs = max_runs or int(os.environ.get("AGENT_MAX_RUNS", "0")) or max(1, self.max_workers // 6)
         self.agents = {}
         self.initialize_agents()
+        self.graph = self._build_graph()
+        self.analysis_nodes = AGENT_NODES + (['similarTickets'] if similar_tickets else [])
     
     def initialize_agents(self):
         """Initialize all specialized agents"""
+        # All agents share one pooled client sized to the worker count
+        self.cache = LLMCache.from_env()
+        self.client = OllamaClient(self.ollama_url, self.model, pool_size=self.max_workers, cache=self.cache)
         self.agents = {
-            'summarizer': SummarizerAgent(self.ollama_url, self.model),
+            'summarizer': SummarizerAgent(self.ollama_url, self.model, client=self.client),
             'sentiment': SentimentAnalyzerAgent(),  # This one doesn't use Ollama
-            'actions': ActionsAgent(self.ollama_url, self.model),
-            'router': RouterAgent(self.ollama_url, self.model),
-            'time_estimator': TimeEstimatorAgent(self.ollama_url, self.model),
-            'recommendations': RecommendationsAgent(self.ollama_url, self.model)
+            'actions': ActionsAgent(self.ollama_url, self.model, client=self.client),
+            'router': RouterAgent(self.ollama_url, self.model, client=self.client, local_router=self.local_router),
+            'time_estimator': TimeEstimatorAgent(self.ollama_url, self.model, client=self.client,
+                                                 resolution_model=self.resolution_model),
+            'recommendations': RecommendationsAgent(self.ollama_url, self.model, client=self.client),
+            'fused': FusedAnalysisAgent(self.ollama_url, self.model, client=self.client)
         }
     
-    def process_ticket(self, ticket, historical_context=None):
-        """Process a ticket using the multi-agent framework"""
-        results = {}
+    def _build_graph(self):
+        """Declare each agent's real inputs as a DAG.
+        
+        None of the agents consumes another agent's output, so every node only depends
+        on the graph inputs (ticket and historical context) and all of them run concurrently.
+        """
+        graph = AgentGraph(max_workers=self.max_workers, default_timeout=self.agent_timeout,
+                           max_runs=self.max_runs)
+        graph.add_node('summary',
+                       self._llm_node('summary', lambda inputs, upstream: self.agents['summarizer'].process_ticket(
+                           inputs['ticket'], inputs['historical_context'], on_token=inputs.get('on_token'))),
+                       fallback=self._get_default_summary, stage='initial_analysis',
+                       afunc=self._async_llm_node('summary', lambda inputs, upstream: self.agents[
+                           'summarizer'].aprocess_ticket(inputs['ticket'], inputs['historical_context'])))
+        graph.add_node('sentiment',
+                       lambda inputs, upstream: self.agents['sentiment'].analyze_ticket(inputs['ticket']),
+                       timeout=5, fallback=self._get_default_sentiment, stage='initial_analysis')
+        graph.add_node('actions',
+                       self._llm_node('actions', lambda inputs, upstream: self.agents['actions'].process_ticket(
+                           inputs['ticket'])),
+                       fallback=self._get_default_actions, stage='actions_and_routing',
+                       afunc=self._async_llm_node('actions', lambda inputs, upstream: self.agents[
+                           'actions'].aprocess_ticket(inputs['ticket'])))
+        graph.add_node('routing',
+                       self._llm_node('routing', lambda inputs, upstream: self.agents['router'].process_ticket(
+                           inputs['ticket'])),
+                       fallback=self._get_default_routing, stage='actions_and_routing',
+                       afunc=self._async_llm_node('routing', lambda inputs, upstream: self.agents[
+                           'router'].aprocess_ticket(inputs['ticket'])))
+        graph.add_node('timeEstimation',
+                       self._llm_node('timeEstimation', lambda inputs, upstream: self.agents[
+                           'time_estimator'].process_ticket(inputs['ticket'], inputs['historical_context'])),
+                       fallback=self._get_default_time_estimation, stage='resolution_planning',
+                       afunc=self._async_llm_node('timeEstimation', lambda inputs, upstream: self.agents[
+                           'time_estimator'].aprocess_ticket(inputs['ticket'], inputs['historical_context'])))
+        graph.add_node('recommendations',
+                       self._llm_node('recommendations', lambda inputs, upstream: self.agents[
+                           'recommendations'].process_ticket(inputs['ticket'], inputs['historical_context'])),
+                       fallback=self._get_default_recommendations, stage='resolution_planning',
+                       afunc=self._async_llm_node('recommendations', lambda inputs, upstream: self.agents[
+                           'recommendations'].aprocess_ticket(inputs['ticket'], inputs['historical_context'])))
+        # Only used in fused mode; its sections are validated by the agents above
+        graph.add_node('fused',
+                       self._llm_node('fused', lambda inputs, upstream: self.agents['fused'].process_ticket(
+                           inputs['ticket'], inputs['historical_context'])),
+                       timeout=self.agent_timeout * 2, stage='fused_analysis',
+                       afunc=self._async_llm_node('fused', lambda inputs, upstream: self.agents[
+                           'fused'].aprocess_ticket(inputs['ticket'], inputs['historical_context'])))
+        if self.similar_tickets:
+            graph.add_node('similarTickets',
+                           lambda inputs, upstream: self.similar_tickets(inputs['ticket']),
+                           fallback=list, stage='initial_analysis')
+        return graph
+    
+    def _llm_node(self, name, func):
+        """Wrap an LLM-backed node so Ollama's timings for its calls land in inputs['llm_timings']"""
+        def run(inputs, upstream):
+            with self.client.collect_timings() as calls:
+                result = func(inputs, upstream)
+            llm_timings = inputs.get('llm_timings')
+            if llm_timings is not None and calls:
+                llm_timings[name] = summarize_timings(calls)
+            return result
+        return run
+    
+    def _async_llm_node(self, name, afunc):
+        """Async counterpart of _llm_node"""
+        async def run(inputs, upstream):
+            with self.client.collect_timings() as calls:
+                result = await afunc(inputs, upstream)
+            llm_timings = inputs.get('llm_timings')
+            if llm_timings is not None and calls:
+                llm_timings[name] = summarize_timings(calls)
+            return result
+        return run
+    
+    def _run_nodes(self, ticket, historical_context, only=None, llm_timings=None):
+        """Run the requested graph nodes concurrently and return (results, timings).
+        
+        If `llm_timings` is a dict, each LLM-backed node adds its Ollama timings to it.
+        """
+        inputs = {'ticket': ticket, 'historical_context': PromptContext.build(historical_context),
+                  'llm_timings': llm_timings}
+        return self.graph.run(inputs, only=only)
+    
+    @traced('agent_service.process_ticket')
+    def process_ticket(self, ticket, historical_context=None, mode=None):
+        """Process a ticket using the multi-agent framework.
+        
+        `mode` is 'multi' (one generation per agent) or 'fused' (one combined
+        generation); it defaults to the service-wide AGENT_MODE.
+        """
         start_time = time.time()
+        mode = mode or self.mode
+        set_attributes(mode=mode)
+        llm_timings = {}
         
         try:
-            # Step 1: Initial Analysis (Summary and Sentiment)
-            print("Step 1: Performing initial analysis...")
-            initial_analysis = self._perform_initial_analysis(ticket, historical_context)
-            results.update(initial_analysis)
-            
-            # Step 2: Action Extraction and Routing
-            print("Step 2: Extracting actions and determining routing...")
-            action_routing = self._extract_actions_and_route(ticket, initial_analysis)
-            results.update(action_routing)
-            
-            # Step 3: Resolution Planning
-            print("Step 3: Planning resolution...")
-            resolution_plan = self._plan_resolution(ticket, initial_analysis, action_routing, historical_context)
-            results.update(resolution_plan)
-            
-            # Add processing metadata
-            results['metadata'] = {
-                'processing_time': time.time() - start_time,
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-                'model_used': self.model
-            }
+            # Rendered once per profile and shared by every agent working on this ticket
+            historical_context = PromptContext.build(historical_context)
+            if mode not in PROCESSING_MODES:
+                raise ValueError(f"Unknown processing mode '{mode}'")
             
-            return results
+            fallback_sections = []
+            if mode == 'fused':
+                print("Running fused analysis...")
+                results, timings, fallback_sections = self._run_fused(ticket, historical_context, llm_timings)
+            else:
+                print("Running agent graph...")
+                results, timings = self._run_nodes(ticket, historical_context, only=self.analysis_nodes,
+                                                   llm_timings=llm_timings)
+            return self._finish_results(results, start_time, mode, timings, llm_timings, fallback_sections)
             
         except Exception as e:
             print(f"Error in multi-agent processing: {str(e)}")
             print(traceback.format_exc())
+            AGENT_FALLBACKS.inc(agent='service', reason='error')
             return self._get_fallback_results(str(e))
     
-    def _perform_initial_analysis(self, ticket, historical_context):
-        """Perform initial analysis using summary and sentiment agents"""
-        results = {}
-        
-        # Get summary
-        try:
-            summary_result = self.agents['summarizer'].process_ticket(ticket, historical_context)
-            results['summary'] = summary_result
-        except Exception as e:
-            print(f"Summarizer error: {str(e)}")
-            results['summary'] = self._get_default_summary()
+    @traced('agent_service.process_ticket')
+    async def aprocess_ticket(self, ticket, historical_context=None, mode=None):
+        """Async version of process_ticket: LLM calls are awaited on the running event loop
+        instead of each holding a worker thread."""
+        start_time = time.time()
+        mode = mode or self.mode
+        set_attributes(mode=mode)
+        llm_timings = {}
         
-        # Get sentiment
         try:
-            sentiment_result = self.agents['sentiment'].analyze_ticket(ticket)
-            results['sentiment'] = sentiment_result
+            inputs = {'ticket': ticket, 'historical_context': PromptContext.build(historical_context),
+                      'llm_timings': llm_timings}
+            if mode not in PROCESSING_MODES:
+                raise ValueError(f"Unknown processing mode '{mode}'")
+            
+            fallback_sections = []
+            if mode == 'fused':
+                results, timings = await self.graph.arun(inputs, only=self._fused_nodes())
+                fallback_sections = self._apply_fused(ticket, results)
+                if fallback_sections:
+                    retried, retry_timings = await self.graph.arun(inputs, only=fallback_sections)
+                    results.update(retried)
+                    timings.update(retry_timings)
+            else:
+                results, timings = await self.graph.arun(inputs, only=self.analysis_nodes)
+            return self._finish_results(results, start_time, mode, timings, llm_timings, fallback_sections)
+            
         except Exception as e:
-            print(f"Sentiment analyzer error: {str(e)}")
-            results['sentiment'] = self._get_default_sentiment()
-        
+            print(f"Error in multi-agent processing: {str(e)}")
+            print(traceback.format_exc())
+            AGENT_FALLBACKS.inc(agent='service', reason='error')
+            return self._get_fallback_results(str(e))
+    
+    def _finish_results(self, results, start_time, mode, timings, llm_timings, fallback_sections):
+        """Merge similar tickets into the summary and add processing metadata"""
+        self._merge_similar_tickets(results)
+        results['metadata'] = {
+            'processing_time': time.time() - start_time,
+            'mode': mode,
+            'agent_timings': timings,
+            'llm_timings': llm_timings,
+            'fused_fallbacks': fallback_sections,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'model_used': self.model
+        }
         return results
     
-    def _extract_actions_and_route(self, ticket, initial_analysis):
-        """Extract actions and determine routing based on initial analysis"""
-        results = {}
+    def stream_ticket(self, ticket, historical_context=None, stream_tokens=False):
+        """Process a ticket and yield (event, data) pairs as each agent finishes.
         
-        # Get actions
-        try:
-            actions_result = self.agents['actions'].process_ticket(ticket)
-            results['actions'] = actions_result
-        except Exception as e:
-            print(f"Actions agent error: {str(e)}")
-            results['actions'] = self._get_default_actions()
+        Yields a 'result' event per agent in completion order, optional 'token'
+        events with raw summary output while it is generated, and a final 'done'
+        event carrying the processing metadata (or 'error' if the run failed).
+        """
+        start_time = time.time()
+        events = queue.Queue()
         
-        # Get routing
-        try:
-            routing_result = self.agents['router'].process_ticket(ticket)
-            results['routing'] = routing_result
-        except Exception as e:
-            print(f"Router agent error: {str(e)}")
-            results['routing'] = self._get_default_routing()
+        def on_result(name, result):
+            events.put(('result', {'agent': name, 'result': result}))
         
-        return results
+        def on_token(text):
+            events.put(('token', {'agent': 'summary', 'text': text}))
+        
+        def run():
+            try:
+                inputs = {
+                    'ticket': ticket,
+                    'historical_context': PromptContext.build(historical_context),
+                    'on_token': on_token if stream_tokens else None,
+                    'llm_timings': {}
+                }
+                _, timings = self.graph.run(inputs, only=self.analysis_nodes, on_result=on_result)
+                events.put(('done', {'metadata': {
+                    'processing_time': time.time() - start_time,
+                    'mode': 'multi',
+                    'agent_timings': timings,
+                    'llm_timings': inputs['llm_timings'],
+                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'model_used': self.model
+                }}))
+            except Exception as e:
+                print(f"Error in streaming multi-agent processing: {str(e)}")
+                print(traceback.format_exc())
+                AGENT_FALLBACKS.inc(agent='service', reason='error')
+                events.put(('error', self._get_fallback_results(str(e))))
+            finally:
+                events.put(None)
+        
+        threading.Thread(target=run, name="agent-stream", daemon=True).start()
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield event
     
-    def _plan_resolution(self, ticket, initial_analysis, action_routing, historical_context):
-        """Plan resolution using time estimation and recommendations"""
-        results = {}
+    def _fused_nodes(self):
+        return ['sentiment', 'fused'] + (['similarTickets'] if self.similar_tickets else [])
+    
+    def _run_fused(self, ticket, historical_context, llm_timings=None):
+        """Run the fused prompt and re-run individual agents only for invalid sections"""
+        results, timings = self._run_nodes(ticket, historical_context, only=self._fused_nodes(),
+                                           llm_timings=llm_timings)
+        invalid = self._apply_fused(ticket, results)
+        if invalid:
+            retried, retry_timings = self._run_nodes(ticket, historical_context, only=invalid,
+                                                     llm_timings=llm_timings)
+            results.update(retried)
+            timings.update(retry_timings)
         
-        # Get time estimation
-        try:
-            time_result = self.agents['time_estimator'].process_ticket(ticket, historical_context)
-            results['timeEstimation'] = time_result
-        except Exception as e:
-            print(f"Time estimator error: {str(e)}")
-            results['timeEstimation'] = self._get_default_time_estimation()
+        return results, timings, invalid
+    
+    @traced('fused.validate_sections')
+    def _apply_fused(self, ticket, results):
+        """Replace results['fused'] with its validated sections and return the invalid ones"""
+        fused = results.pop('fused') or {}
         
-        # Get recommendations
-        try:
-            recommendations_result = self.agents['recommendations'].process_ticket(ticket, historical_context)
-            results['recommendations'] = recommendations_result
-        except Exception as e:
-            print(f"Recommendations agent error: {str(e)}")
-            results['recommendations'] = self._get_default_recommendations()
+        invalid = []
+        for section, agent_name in FUSED_SECTION_AGENTS.items():
+            try:
+                results[section] = self.agents[agent_name].validate(fused.get(section))
+            except Exception as e:
+                print(f"Fused {section} section invalid: {str(e)}")
+                invalid.append(section)
         
+        # Historical resolution times beat the model's guess when there are enough of them
+        estimate = self.agents['time_estimator'].local_estimate(ticket)
+        if estimate is not None:
+            results['timeEstimation'] = estimate
+            if 'timeEstimation' in invalid:
+                invalid.remove('timeEstimation')
+        for section in invalid:
+            FUSED_SECTION_FALLBACKS.inc(section=section)
+        return invalid
+    
+    def _merge_similar_tickets(self, results):
+        """Replace the summary's similarTickets with the similarity search results, if any"""
+        similar = results.pop('similarTickets', None)
+        if similar and isinstance(results.get('summary'), dict):
+            results['summary']['similarTickets'] = similar
+    
+    @traced('stage.initial_analysis')
+    def _perform_initial_analysis(self, ticket, historical_context):
+        """Perform initial analysis using summary and sentiment agents"""
+        results, _ = self._run_nodes(ticket, historical_context, only=['summary', 'sentiment'])
+        return results
+    
+    @traced('stage.actions_and_routing')
+    def _extract_actions_and_route(self, ticket, initial_analysis=None):
+        """Extract actions and determine routing for a ticket"""
+        results, _ = self._run_nodes(ticket, None, only=['actions', 'routing'])
+        return results
+    
+    @traced('stage.resolution_planning')
+    def _plan_resolution(self, ticket, initial_analysis=None, action_routing=None, historical_context=None):
+        """Plan resolution using time estimation and recommendations"""
+        results, _ = self._run_nodes(ticket, historical_context, only=['timeEstimation', 'recommendations'])
         return results
     
     def _get_default_summary(self):
@@ -5,15 +5,18 @@ Actions Agent
 This agent analyzes tickets and extracts required actions with priorities.
 """
 
-import json
-import requests
+from ollama_client import OllamaClient, parse_json_response
+from prompt_builder import build_prompt
+from metrics import AGENT_FALLBACKS
+from tracing import traced
 
 class ActionsAgent:
     """Agent that identifies required actions for resolving customer support tickets."""
     
-    def __init__(self, ollama_url, model):
+    def __init__(self, ollama_url, model, client=None):
         self.ollama_url = ollama_url
         self.model = model
+        self.client = client or OllamaClient(ollama_url, model)
         self.system_prompt = """
         You are an expert action identifier for customer support.
         Analyze the ticket and extract 2-4 specific actions needed to resolve it.
@@ -32,29 +35,29 @@ class ActionsAgent:
     
     def process_ticket(self, ticket):
         """Process a ticket and return required actions"""
-        prompt = f"""
-        Ticket #{ticket['id']}
-        Subject: {ticket['subject']}
-        Description: {ticket['description']}
-        From: {ticket['customerName']} ({ticket.get('customerEmail', 'No email')})
-        """
-        
-        response = self._call_ollama(prompt)
-        
+        return self._parse_response(self._call_ollama(self._build_prompt(ticket)))
+    
+    async def aprocess_ticket(self, ticket):
+        """Async version of process_ticket, for the ASGI server"""
+        response = await self.client.agenerate(self._build_prompt(ticket), system=self.system_prompt)
+        return self._parse_response(response)
+    
+    @traced('agent.build_prompt')
+    def _build_prompt(self, ticket):
+        return build_prompt(ticket, ('subject', 'description', 'customer'))
+    
+    @traced('agent.parse_response')
+    def _parse_response(self, response):
+        """Validate the model response, falling back to generic actions"""
         try:
-            # Try to parse the response as JSON
-            if isinstance(response, str):
-                result = json.loads(response)
-            else:
-                result = response
-                
-            # Ensure the response has the expected format
-            if not "actions" in result:
-                raise ValueError("Response missing required 'actions' field")
+            if not response:
+                raise ValueError("No response from Ollama")
                 
-            return result
+            # Try to parse the response as JSON
+            return self.validate(parse_json_response(response))
         except Exception as e:
             # Fallback for parsing errors
+            AGENT_FALLBACKS.inc(agent='actions', reason='parse_error' if response else 'no_response')
             return {
                 "actions": [
                     {
@@ -71,45 +74,16 @@ class ActionsAgent:
                 "error": str(e)
             }
     
+    def validate(self, result):
+        """Check an actions result against the expected schema"""
+        if not isinstance(result, dict):
+            raise ValueError("Actions must be a JSON object")
+        if not "actions" in result:
+            raise ValueError("Response missing required 'actions' field")
+        if not isinstance(result["actions"], list):
+            raise ValueError("'actions' must be a list")
+        return result
+    
     def _call_ollama(self, prompt):
         """Call Ollama API with the given prompt"""
-        try:
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "system": self.system_prompt,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code == 200:
-                result = response.json().get("response", "")
-                # Attempt to parse as JSON if it looks like JSON
-                if result.strip().startswith("{") and result.strip().endswith("}"):
-                    try:
-                        return json.loads(result)
-                    except:
-                        pass
-                return result
-            else:
-                return {
-                    "actions": [
-                        {
-                            "type": "error",
-                            "priority": "high",
-                            "description": f"Ollama API returned status code {response.status_code}"
-                        }
-                    ]
-                }
-        except Exception as e:
-            return {
-                "actions": [
-                    {
-                        "type": "error",
-                        "priority": "high",
-                        "description": f"Error calling Ollama: {str(e)}"
-                    }
-                ]
-            }
+        return self.client.generate(prompt, system=self.system_prompt)
@@ -0,0 +1,93 @@
+"""
+Fused Analysis Agent
+-------------------
+This agent asks the model once for the summary, actions, routing, time estimate
+and recommendations of a ticket, instead of one generation per agent.
+"""
+
+from ollama_client import OllamaClient, parse_json_response
+from prompt_builder import build_prompt
+from tracing import traced
+
+# Response sections produced by the fused prompt, keyed like the AgentService results
+FUSED_SECTIONS = ["summary", "actions", "routing", "timeEstimation", "recommendations"]
+
+class FusedAnalysisAgent:
+    """Agent that produces every LLM-backed analysis section in a single generation."""
+
+    def __init__(self, ollama_url, model, client=None):
+        self.ollama_url = ollama_url
+        self.model = model
+        self.client = client or OllamaClient(ollama_url, model)
+        self.system_prompt = """
+        You are an expert customer support analyst.
+        Analyze the ticket and any historical context, then produce a complete analysis in one JSON document.
+        Route to one of: technical-support, billing, account-management, product-feedback, security, legal
+        Extract 2-4 specific actions and provide 1-3 suggested resolutions with clear steps.
+        Format your response as JSON with exactly this structure:
+        {
+          "summary": {
+            "summary": "A clear, concise summary of the issue",
+            "keyPoints": ["Key point 1", "Key point 2"],
+            "sentiment": "positive|neutral|negative",
+            "similarTickets": ["TICKET_ID1"],
+            "confidence": 0.85
+          },
+          "actions": {
+            "actions": [
+              {"type": "investigation", "priority": "high", "description": "What needs to be done"}
+            ]
+          },
+          "routing": {
+            "recommendedTeam": "technical-support",
+            "confidence": 0.85,
+            "reasoning": "Why this team is appropriate"
+          },
+          "timeEstimation": {
+            "estimatedMinutes": 45,
+            "confidence": 0.7,
+            "factors": [{"name": "Technical complexity", "impact": 0.3}]
+          },
+          "recommendations": {
+            "suggestedResolutions": [
+              {
+                "title": "Title of the resolution approach",
+                "steps": ["Step 1", "Step 2"],
+                "confidence": 0.85,
+                "source": "Based on historical case #TECH_021"
+              }
+            ]
+          }
+        }
+        """
+
+    def process_ticket(self, ticket, historical_context=None):
+        """Process a ticket and return the raw combined analysis.
+
+        Sections are not validated here; the caller checks each one against the
+        schema of the agent that normally produces it. Raises ValueError if the
+        model does not return a JSON object.
+        """
+        return self._parse_response(self._call_ollama(self._build_prompt(ticket, historical_context)))
+
+    async def aprocess_ticket(self, ticket, historical_context=None):
+        """Async version of process_ticket, for the ASGI server"""
+        response = await self.client.agenerate(self._build_prompt(ticket, historical_context),
+                                               system=self.system_prompt)
+        return self._parse_response(response)
+
+    @traced('agent.build_prompt')
+    def _build_prompt(self, ticket, historical_context):
+        return build_prompt(ticket, ('subject', 'description', 'customer', 'category', 'priority', 'status'),
+                            historical_context, 'fused')
+
+    @staticmethod
+    @traced('agent.parse_response')
+    def _parse_response(response):
+        if not response:
+            raise ValueError("No response from Ollama")
+        return parse_json_response(response)
+
+    def _call_ollama(self, prompt):
+        """Call Ollama API with the given prompt"""
+        return self.client.generate(prompt, system=self.system_prompt)
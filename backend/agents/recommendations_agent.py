@@ -4,15 +4,18 @@ Recommendations Agent
 This agent provides suggested solutions for customer support tickets.
 """
 
-import json
-import requests
+from ollama_client import OllamaClient, parse_json_response
+from prompt_builder import build_prompt
+from metrics import AGENT_FALLBACKS
+from tracing import traced
 
 class RecommendationsAgent:
     """Agent that provides resolution recommendations for customer support tickets."""
     
-    def __init__(self, ollama_url, model):
+    def __init__(self, ollama_url, model, client=None):
         self.ollama_url = ollama_url
         self.model = model
+        self.client = client or OllamaClient(ollama_url, model)
         self.system_prompt = """
         You are a support resolution specialist with access to historical cases.
         Analyze the ticket and historical data to recommend potential resolutions.
@@ -33,43 +36,32 @@ class RecommendationsAgent:
     
     def process_ticket(self, ticket, historical_context=None):
         """Process a ticket and return resolution recommendations"""
-        # Extract fields with defaults for missing values
-        ticket_id = ticket.get('id', 'Unknown')
-        subject = ticket.get('subject', 'No Subject').strip()
-        description = ticket.get('description', 'No Description').strip()
-        customer_name = ticket.get('customerName', 'Unknown Customer').strip()
-        customer_email = ticket.get('customerEmail', 'No email').strip()
-        
-        # Extract the most relevant information from the historical context
-        # to keep prompts focused and concise
-        context_summary = self._extract_relevant_context(historical_context)
-        
-        prompt = f"""
-        Ticket #{ticket_id}
-        Subject: {subject}
-        Description: {description}
-        From: {customer_name} ({customer_email})
-        
-        Historical Context:
-        {context_summary}
-        """
-        
-        response = self._call_ollama(prompt)
-        
+        return self._parse_response(self._call_ollama(self._build_prompt(ticket, historical_context)))
+    
+    async def aprocess_ticket(self, ticket, historical_context=None):
+        """Async version of process_ticket, for the ASGI server"""
+        response = await self.client.agenerate(self._build_prompt(ticket, historical_context),
+                                               system=self.system_prompt)
+        return self._parse_response(response)
+    
+    @traced('agent.build_prompt')
+    def _build_prompt(self, ticket, historical_context):
+        # The recommendations profile keeps only past solutions and Customer/Agent
+        # exchanges, which is all this agent needs from the history
+        return build_prompt(ticket, ('subject', 'description', 'customer'), historical_context, 'recommendations')
+    
+    @traced('agent.parse_response')
+    def _parse_response(self, response):
+        """Validate the model response, falling back to a standard procedure"""
         try:
-            # Try to parse the response as JSON
-            if isinstance(response, str):
-                result = json.loads(response)
-            else:
-                result = response
-                
-            # Ensure the response has the expected format
-            if not "suggestedResolutions" in result:
-                raise ValueError("Response missing required 'suggestedResolutions' field")
+            if not response:
+                raise ValueError("No response from Ollama")
                 
-            return result
+            # Try to parse the response as JSON
+            return self.validate(parse_json_response(response))
         except Exception as e:
             # Fallback for parsing errors
+            AGENT_FALLBACKS.inc(agent='recommendations', reason='parse_error' if response else 'no_response')
             return {
                 "suggestedResolutions": [
                     {
@@ -86,96 +78,16 @@ class RecommendationsAgent:
                 "error": str(e)
             }
     
-    def _extract_relevant_context(self, historical_context):
-        """Extract the most relevant parts of the historical context"""
-        if not historical_context:
-            return "No historical context available"
-            
-        # Extract only the most relevant parts to keep prompts concise
-        sections = historical_context.split("---")
-        
-        # Extract solutions from relevant tickets
-        solutions = []
-        conversation_example = ""
-        
-        for section in sections:
-            if "RELEVANT HISTORICAL TICKETS" in section:
-                # Extract solution patterns
-                lines = section.strip().split("\n")
-                current_solution = {}
-                
-                for line in lines:
-                    if line.startswith("Issue:"):
-                        current_solution["issue"] = line.replace("Issue:", "").strip()
-                    elif line.startswith("Solution:"):
-                        current_solution["solution"] = line.replace("Solution:", "").strip()
-                        
-                    # When we find a complete entry, add it to our solutions
-                    if "issue" in current_solution and "solution" in current_solution:
-                        solutions.append(f"For {current_solution['issue']}: {current_solution['solution']}")
-                        current_solution = {}
-                        
-            elif "RELEVANT CONVERSATION EXAMPLE" in section:
-                # Keep only essential parts of the conversation
-                conversation_lines = section.strip().split("\n")
-                for i, line in enumerate(conversation_lines):
-                    if "Customer:" in line:
-                        customer_msg = line
-                    elif "Agent:" in line and i > 0 and "Customer:" in conversation_lines[i-1]:
-                        # Only keep agent responses that directly follow customer messages
-                        conversation_example += f"{customer_msg}\n{line}\n"
-        
-        # Combine the extracted information
-        condensed_context = "Historical Solutions:\n"
-        for i, solution in enumerate(solutions[:3]):  # Limit to top 3
-            condensed_context += f"{i+1}. {solution}\n"
-            
-        if conversation_example:
-            condensed_context += "\nRelevant Conversation:\n" + conversation_example
-            
-        return condensed_context
+    def validate(self, result):
+        """Check a recommendations result against the expected schema"""
+        if not isinstance(result, dict):
+            raise ValueError("Recommendations must be a JSON object")
+        if not "suggestedResolutions" in result:
+            raise ValueError("Response missing required 'suggestedResolutions' field")
+        if not isinstance(result["suggestedResolutions"], list):
+            raise ValueError("'suggestedResolutions' must be a list")
+        return result
     
     def _call_ollama(self, prompt):
         """Call Ollama API with the given prompt"""
-        try:
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "system": self.system_prompt,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code == 200:
-                result = response.json().get("response", "")
-                # Attempt to parse as JSON if it looks like JSON
-                if result.strip().startswith("{") and result.strip().endswith("}"):
-                    try:
-                        return json.loads(result)
-                    except:
-                        pass
-                return result
-            else:
-                return {
-                    "suggestedResolutions": [
-                        {
-                            "title": "API Error",
-                            "steps": [f"Ollama API returned status code {response.status_code}"],
-                            "confidence": 0.1,
-                            "source": "Error handling"
-                        }
-                    ]
-                }
-        except Exception as e:
-            return {
-                "suggestedResolutions": [
-                    {
-                        "title": "Error calling Ollama",
-                        "steps": [str(e)],
-                        "confidence": 0.1,
-                        "source": "Error handling"
-                    }
-                ]
-            }
+        return self.client.generate(prompt, system=self.system_prompt)
@@ -2,17 +2,23 @@
 Router Agent
 -----------
 This agent analyzes tickets and determines which team they should be routed to.
+An optional local routing model answers confident tickets without calling the LLM.
 """
 
-import json
-import requests
+from ollama_client import OllamaClient, parse_json_response
+from prompt_builder import build_prompt
+from metrics import AGENT_FALLBACKS
+from tracing import traced
 
 class RouterAgent:
     """Agent that determines the appropriate team for handling customer support tickets."""
     
-    def __init__(self, ollama_url, model):
+    def __init__(self, ollama_url, model, client=None, local_router=None):
         self.ollama_url = ollama_url
         self.model = model
+        self.client = client or OllamaClient(ollama_url, model)
+        # routing_model.LocalRouter, consulted before the LLM and trained on its answers
+        self.local_router = local_router
         self.system_prompt = """
         You are a ticket routing specialist.
         Analyze the ticket and determine which team it should be routed to.
@@ -25,37 +31,50 @@ class RouterAgent:
         }
         """
     
+    def validate(self, result):
+        """Check a routing result against the expected schema and fill optional fields"""
+        if not isinstance(result, dict):
+            raise ValueError("Routing must be a JSON object")
+        if not "recommendedTeam" in result:
+            raise ValueError("Response missing required 'recommendedTeam' field")
+            
+        # Add default values for optional fields
+        if "confidence" not in result:
+            result["confidence"] = 0.5
+        if "reasoning" not in result:
+            result["reasoning"] = "No reasoning provided"
+        return result
+    
     def _call_ollama(self, prompt):
         """Call Ollama API with error handling"""
-        try:
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": f"{self.system_prompt}\n\n{prompt}",
-                    "stream": False
-                },
-                timeout=30
-            )
-            response.raise_for_status()
-            return response.json().get("response", "")
-        except Exception as e:
-            print(f"Error calling Ollama: {str(e)}")
-            return None
+        return self.client.generate(prompt, system=self.system_prompt)
     
     def process_ticket(self, ticket):
         """Process a ticket and return routing recommendations"""
-        prompt = f"""
-        Ticket #{ticket['id']}
-        Subject: {ticket['subject']}
-        Description: {ticket['description']}
-        From: {ticket['customerName']} ({ticket.get('customerEmail', 'No email')})
-        Status: {ticket.get('status', 'Unknown')}
-        """
-        
-        response = self._call_ollama(prompt)
-        
+        if self.local_router is not None:
+            routing = self.local_router.predict(ticket)
+            if routing is not None:
+                return routing
+        return self._routing_from_response(ticket, self._call_ollama(self._build_prompt(ticket)))
+    
+    async def aprocess_ticket(self, ticket):
+        """Async version of process_ticket, for the ASGI server"""
+        if self.local_router is not None:
+            routing = self.local_router.predict(ticket)
+            if routing is not None:
+                return routing
+        response = await self.client.agenerate(self._build_prompt(ticket), system=self.system_prompt)
+        return self._routing_from_response(ticket, response)
+    
+    @traced('agent.build_prompt')
+    def _build_prompt(self, ticket):
+        return build_prompt(ticket, ('subject', 'description', 'customer', 'status'))
+    
+    @traced('agent.parse_response')
+    def _routing_from_response(self, ticket, response):
+        """Validate the model response and record it for the local router"""
         if not response:
+            AGENT_FALLBACKS.inc(agent='routing', reason='no_response')
             return {
                 "recommendedTeam": "technical-support",
                 "confidence": 0.5,
@@ -64,32 +83,10 @@ class RouterAgent:
         
         try:
             # Try to parse the response as JSON
-            if isinstance(response, str):
-                # Clean up the response string to ensure it's valid JSON
-                response = response.strip()
-                if response.startswith("```json"):
-                    response = response[7:]
-                if response.endswith("```"):
-                    response = response[:-3]
-                response = response.strip()
-                
-                result = json.loads(response)
-            else:
-                result = response
-                
-            # Ensure the response has the expected format
-            if not "recommendedTeam" in result:
-                raise ValueError("Response missing required 'recommendedTeam' field")
-                
-            # Add default values for optional fields
-            if "confidence" not in result:
-                result["confidence"] = 0.5
-            if "reasoning" not in result:
-                result["reasoning"] = "No reasoning provided"
-                
-            return result
+            routing = self.validate(parse_json_response(response))
         except Exception as e:
             print(f"Error parsing router response: {str(e)}")
+            AGENT_FALLBACKS.inc(agent='routing', reason='parse_error')
             # Fallback for parsing errors
             return {
                 "recommendedTeam": "technical-support",
@@ -97,3 +94,8 @@ class RouterAgent:
                 "reasoning": "Default routing due to parsing error",
                 "error": str(e)
             }
+        
+        if self.local_router is not None:
+            # A cached answer was already recorded when the LLM first gave it
+            self.local_router.record(ticket, routing["recommendedTeam"], cached=self.client.last_from_cache())
+        return routing
@@ -8,7 +8,70 @@ a detailed breakdown of customer emotions and overall tone.
 
 import re
 import json
+from collections import defaultdict
 from typing import Dict, Any, List, Tuple
+import numpy as np
+
+# Characters that end a sentence for key phrase extraction
+SENTENCE_DELIMITERS = ('.', '!', '?')
+
+
+def _is_word_char(char: str) -> bool:
+    """Same definition of a word character as the regex \\b assertion uses"""
+    return char.isalnum() or char == '_'
+
+
+def _is_whole_word(text: str, start: int, end: int) -> bool:
+    """Whether text[start:end] is delimited by word boundaries on both sides"""
+    return (start == 0 or not _is_word_char(text[start - 1])) and \
+        (end == len(text) or not _is_word_char(text[end]))
+
+
+class KeywordMatcher:
+    """Finds every occurrence of a set of keywords in one pass over a text.
+    
+    The keywords are compiled into a single lookahead pattern shaped like a trie, so
+    each text position only follows the branches for its next characters, and the
+    greedy pattern reports the longest keyword starting there. Every shorter keyword
+    that is a prefix of it also starts there, so overlapping matches (such as "help"
+    inside "helpful", or "how" inside "show") are all recovered.
+    """
+    
+    def __init__(self, keywords: List[str]):
+        keywords = set(keywords)
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = True
+        self.pattern = re.compile('(?=(' + self._trie_pattern(trie) + '))')
+        # keyword -> every keyword that is a prefix of it, itself included
+        self.prefixes = {keyword: sorted((other for other in keywords if keyword.startswith(other)),
+                                         key=len, reverse=True)
+                         for keyword in keywords}
+    
+    @classmethod
+    def _trie_pattern(cls, node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + cls._trie_pattern(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # A keyword ends here; trying the longer keywords first keeps the match greedy
+            pattern = '(?:' + pattern + ')?'
+        return pattern
+    
+    def find_all(self, text: str) -> List[Tuple[int, str]]:
+        """Return (position, keyword) for every keyword occurrence, in position order"""
+        hits = []
+        for match in self.pattern.finditer(text):
+            start = match.start()
+            for keyword in self.prefixes[match.group(1)]:
+                hits.append((start, keyword))
+        return hits
+
 
 class SentimentAnalyzerAgent:
     """Agent that analyzes sentiment and emotions in customer support tickets."""
@@ -31,23 +94,32 @@ class SentimentAnalyzerAgent:
             "negative": ["bad", "terrible", "awful", "horrible", "useless", "problem", "issue", "error", "bug", "glitch", "doesn't work", "failed", "failure", "poor", "disappointed", "waste", "broken", "crash", "not working"],
             "neutral": ["how", "what", "when", "where", "who", "which", "question", "information", "help", "assist", "details", "instructions", "guidance", "explain", "tell", "show"]
         }
+        
+        # Both lexicons are matched together in a single pass over the text
+        self._emotion_words = {keyword for keywords in self.emotion_keywords.values() for keyword in keywords}
+        self._matcher = KeywordMatcher(
+            list(self._emotion_words) +
+            [keyword for keywords in self.sentiment_indicators.values() for keyword in keywords])
+        # keyword -> column of the term-count matrices built by analyze_batch
+        self._columns = {keyword: column for column, keyword in enumerate(sorted(self._matcher.prefixes))}
     
     def analyze_ticket(self, ticket: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze a ticket's subject and description for sentiment and emotions."""
         text = f"{ticket['subject']} {ticket['description']}".lower()
+        hits = self._matcher.find_all(text)
         
         # Detect emotions
-        emotions = self._detect_emotions(text)
+        emotions = self._detect_emotions(text, hits)
         
         # Determine overall sentiment
-        sentiment_scores = self._calculate_sentiment(text)
+        sentiment_scores = self._calculate_sentiment(text, hits)
         primary_sentiment = max(sentiment_scores.items(), key=lambda x: x[1])[0]
         
         # Generate intensity score (0-1)
         intensity = self._calculate_intensity(emotions, text)
         
         # Analyze key phrases that indicate the sentiment
-        key_phrases = self._extract_sentiment_phrases(text, primary_sentiment)
+        key_phrases = self._extract_sentiment_phrases(text, primary_sentiment, hits)
         
         return {
             "overall_sentiment": primary_sentiment,
@@ -58,18 +130,120 @@ class SentimentAnalyzerAgent:
             "summary": self._generate_summary(primary_sentiment, emotions, intensity)
         }
     
-    def _detect_emotions(self, text: str) -> Dict[str, float]:
+    def analyze_batch(self, tickets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Analyze many tickets at once. Each result matches analyze_ticket for that ticket.
+        
+        Every text is scanned once into term-count matrices over the lexicon keywords,
+        then emotion, sentiment and intensity scores are computed for the whole batch
+        with array operations. Scores are accumulated one keyword column at a time, in
+        lexicon order, so the floating point sums match the per-ticket path exactly.
+        """
+        count = len(tickets)
+        if not count:
+            return []
+        texts = [f"{ticket['subject']} {ticket['description']}".lower() for ticket in tickets]
+        columns = self._columns
+        width = len(columns)
+        
+        # Sparse (flattened row, column) cells for whole-word and substring occurrences
+        word_cells = []
+        present_cells = []
+        batch_hits = []
+        exclamations = np.zeros(count)
+        caps_words = np.zeros(count)
+        for row, text in enumerate(texts):
+            hits = self._matcher.find_all(text)
+            batch_hits.append(hits)
+            base = row * width
+            for start, keyword in hits:
+                cell = base + columns[keyword]
+                present_cells.append(cell)
+                if keyword in self._emotion_words and _is_whole_word(text, start, start + len(keyword)):
+                    word_cells.append(cell)
+            exclamations[row] = text.count('!')
+            caps_words[row] = sum(1 for word in text.split() if word.isupper() and len(word) > 3)
+        word_counts = np.bincount(np.array(word_cells, dtype=np.int64),
+                                  minlength=count * width).reshape(count, width)
+        present = np.bincount(np.array(present_cells, dtype=np.int64),
+                              minlength=count * width).reshape(count, width) > 0
+        
+        # Emotions: 0.2 per whole-word occurrence, capped at 1.0, normalized when they sum past 1
+        emotion_names = list(self.emotion_keywords)
+        emotion_scores = np.zeros((count, len(emotion_names)))
+        for index, keywords in enumerate(self.emotion_keywords.values()):
+            score = np.zeros(count)
+            for keyword in keywords:
+                score = score + word_counts[:, columns[keyword]] * 0.2
+            emotion_scores[:, index] = np.minimum(1.0, score)
+        total = np.zeros(count)
+        for index in range(len(emotion_names)):
+            total = total + emotion_scores[:, index]
+        emotion_scores = np.where((total > 1)[:, None], emotion_scores / np.where(total > 1, total, 1)[:, None],
+                                  emotion_scores)
+        has_emotion = (emotion_scores > 0).any(axis=1)
+        
+        # Sentiment: 0.1 per indicator present, normalized, defaulting to neutral
+        sentiment_names = list(self.sentiment_indicators)
+        sentiment_scores = np.zeros((count, len(sentiment_names)))
+        for index, keywords in enumerate(self.sentiment_indicators.values()):
+            score = np.zeros(count)
+            for keyword in keywords:
+                score = score + np.where(present[:, columns[keyword]], 0.1, 0.0)
+            sentiment_scores[:, index] = score
+        total = np.zeros(count)
+        for index in range(len(sentiment_names)):
+            total = total + sentiment_scores[:, index]
+        sentiment_scores = np.where((total > 0)[:, None], sentiment_scores / np.where(total > 0, total, 1)[:, None],
+                                    sentiment_scores)
+        neutral = sentiment_names.index("neutral")
+        weak = sentiment_scores.max(axis=1) < 0.4
+        sentiment_scores[weak, neutral] = np.maximum(sentiment_scores[weak, neutral], 0.5)
+        primary = sentiment_scores.argmax(axis=1)
+        
+        # Intensity from exclamations, shouting and the strongest emotion
+        intensity = np.zeros(count) + np.minimum(0.3, exclamations * 0.1)
+        intensity = intensity + np.minimum(0.3, caps_words * 0.05)
+        intensity = np.where(has_emotion, intensity + np.minimum(0.4, emotion_scores.max(axis=1) * 0.4), intensity)
+        intensity = np.minimum(1.0, intensity)
+        
+        results = []
+        emotion_rows = emotion_scores.tolist()
+        sentiment_rows = sentiment_scores.tolist()
+        for row, text in enumerate(texts):
+            emotions = {name: value for name, value in zip(emotion_names, emotion_rows[row]) if value > 0}
+            primary_sentiment = sentiment_names[primary[row]]
+            row_intensity = float(intensity[row])
+            results.append({
+                "overall_sentiment": primary_sentiment,
+                "sentiment_scores": dict(zip(sentiment_names, sentiment_rows[row])),
+                "emotions": emotions,
+                "intensity": row_intensity,
+                "key_phrases": self._extract_sentiment_phrases(text, primary_sentiment, batch_hits[row]),
+                "summary": self._generate_summary(primary_sentiment, emotions, row_intensity)
+            })
+        return results
+    
+    def _detect_emotions(self, text: str, hits: List[Tuple[int, str]] = None) -> Dict[str, float]:
         """Detect emotions present in the text with scores."""
         emotions = {}
+        if hits is None:
+            hits = self._matcher.find_all(text)
+        
+        # Count whole-word occurrences of each emotion keyword
+        counts = defaultdict(int)
+        for start, keyword in hits:
+            if keyword not in self._emotion_words:
+                continue
+            if _is_whole_word(text, start, start + len(keyword)):
+                counts[keyword] += 1
         
         for emotion, keywords in self.emotion_keywords.items():
             score = 0
             for keyword in keywords:
-                # Look for whole words only
-                matches = re.findall(r'\b' + keyword + r'\b', text)
+                matches = counts.get(keyword, 0)
                 if matches:
                     # Weight increases with multiple occurrences
-                    score += len(matches) * 0.2
+                    score += matches * 0.2
             
             if score > 0:
                 emotions[emotion] = min(1.0, score)  # Cap at 1.0
@@ -83,13 +257,16 @@ class SentimentAnalyzerAgent:
                 
         return emotions
     
-    def _calculate_sentiment(self, text: str) -> Dict[str, float]:
+    def _calculate_sentiment(self, text: str, hits: List[Tuple[int, str]] = None) -> Dict[str, float]:
         """Calculate sentiment scores (positive, negative, neutral)."""
         scores = {"positive": 0.0, "negative": 0.0, "neutral": 0.0}
+        if hits is None:
+            hits = self._matcher.find_all(text)
+        present = {keyword for _, keyword in hits}
         
         for sentiment, keywords in self.sentiment_indicators.items():
             for keyword in keywords:
-                if keyword in text:
+                if keyword in present:
                     scores[sentiment] += 0.1
         
         # Normalize
@@ -127,33 +304,46 @@ class SentimentAnalyzerAgent:
             
         return min(1.0, intensity)
     
-    def _extract_sentiment_phrases(self, text: str, primary_sentiment: str) -> List[str]:
+    def _extract_sentiment_phrases(self, text: str, primary_sentiment: str,
+                                   hits: List[Tuple[int, str]] = None) -> List[str]:
         """Extract key phrases that express the primary sentiment."""
-        sentences = re.split(r'[.!?]+', text)
         key_phrases = []
         
         keywords = self.sentiment_indicators[primary_sentiment]
+        wanted = set(keywords)
+        if hits is None:
+            hits = self._matcher.find_all(text)
+        hits = [(start, keyword) for start, keyword in hits if keyword in wanted]
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            # Check if sentence contains any sentiment keywords
-            if any(keyword in sentence.lower() for keyword in keywords):
-                if len(sentence) > 100:
-                    # Shorten long sentences
-                    for keyword in keywords:
-                        if keyword in sentence.lower():
-                            start = max(0, sentence.lower().find(keyword) - 40)
-                            end = min(len(sentence), sentence.lower().find(keyword) + 40)
-                            phrase = sentence[start:end]
-                            key_phrases.append(f"...{phrase}...")
-                else:
-                    key_phrases.append(sentence)
-                    
-            if len(key_phrases) >= 3:  # Limit to top 3 phrases
-                break
+        # Only sentences containing a keyword can contribute, so visit those directly,
+        # in text order, instead of splitting the whole text into sentences
+        index = 0
+        while index < len(hits) and len(key_phrases) < 3:  # Limit to top 3 phrases
+            position = hits[index][0]
+            segment_start = max(text.rfind(delimiter, 0, position) for delimiter in SENTENCE_DELIMITERS) + 1
+            ends = [end for end in (text.find(delimiter, position) for delimiter in SENTENCE_DELIMITERS) if end != -1]
+            segment_end = min(ends) if ends else len(text)
+            segment = text[segment_start:segment_end]
+            sentence = segment.strip()
+            offset = segment_start + len(segment) - len(segment.lstrip())
+            
+            # First position of each sentiment keyword within the sentence
+            found = {}
+            while index < len(hits) and hits[index][0] < segment_end:
+                start, keyword = hits[index]
+                found.setdefault(keyword, start - offset)
+                index += 1
+            
+            if len(sentence) > 100:
+                # Shorten long sentences
+                for keyword in keywords:
+                    if keyword in found:
+                        start = max(0, found[keyword] - 40)
+                        end = min(len(sentence), found[keyword] + 40)
+                        phrase = sentence[start:end]
+                        key_phrases.append(f"...{phrase}...")
+            else:
+                key_phrases.append(sentence)
                 
         return key_phrases
     
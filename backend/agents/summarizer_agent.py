@@ -4,13 +4,16 @@ Summarizer Agent
 This agent analyzes support tickets and provides a concise summary, key points, and sentiment.
 """
 
-import json
-import requests
+from ollama_client import OllamaClient, parse_json_response
+from prompt_builder import build_prompt
+from metrics import AGENT_FALLBACKS
+from tracing import traced
 
 class SummarizerAgent:
-    def __init__(self, ollama_url, model):
+    def __init__(self, ollama_url, model, client=None):
         self.ollama_url = ollama_url
         self.model = model
+        self.client = client or OllamaClient(ollama_url, model)
         self.system_prompt = """
         You are an expert customer support summarizer. 
         Analyze the ticket and provide a concise summary, key points, and the sentiment of the customer.
@@ -25,59 +28,57 @@ class SummarizerAgent:
         }
         """
     
-    def _call_ollama(self, prompt):
+    def validate(self, result):
+        """Check a summary result against the expected schema and fill optional fields"""
+        if not isinstance(result, dict):
+            raise ValueError("Summary must be a JSON object")
+        if not all(k in result for k in ["summary", "keyPoints", "sentiment"]):
+            raise ValueError("Response missing required fields")
+        if not isinstance(result["keyPoints"], list):
+            raise ValueError("'keyPoints' must be a list")
+            
+        # Add default values for optional fields
+        if "similarTickets" not in result:
+            result["similarTickets"] = []
+        if "confidence" not in result:
+            result["confidence"] = 0.5
+        return result
+    
+    def _call_ollama(self, prompt, on_token=None):
         """Call Ollama API with error handling"""
-        try:
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": f"{self.system_prompt}\n\n{prompt}",
-                    "stream": False
-                },
-                timeout=30
-            )
-            response.raise_for_status()
-            return response.json().get("response", "")
-        except Exception as e:
-            print(f"Error calling Ollama: {str(e)}")
-            return None
+        return self.client.generate(prompt, system=self.system_prompt, on_token=on_token)
     
-    def process_ticket(self, ticket, historical_context=None):
-        """Process a ticket and return a summary"""
-        # Extract fields with defaults for missing values
-        ticket_id = ticket.get('id', 'Unknown')
-        subject = ticket.get('subject', 'No Subject').strip()
-        description = ticket.get('description', 'No Description').strip()
-        customer_name = ticket.get('customerName', 'Unknown Customer').strip()
-        customer_email = ticket.get('customerEmail', 'No email').strip()
-        category = ticket.get('category', 'unknown').strip()
-        priority = ticket.get('priority', 'medium').strip()
-        status = ticket.get('status', 'open').strip()
-        
-        prompt = f"""
-        Ticket #{ticket_id}
-        Subject: {subject}
-        Description: {description}
-        From: {customer_name} ({customer_email})
-        Category: {category}
-        Priority: {priority}
-        Status: {status}
-        
-        Historical Context:
-        {historical_context or "No historical context available"}
+    def process_ticket(self, ticket, historical_context=None, on_token=None):
+        """Process a ticket and return a summary.
         
+        If `on_token` is given, raw model output is streamed to it while the summary is generated.
+        """
+        prompt = self._build_prompt(ticket, historical_context)
+        return self._parse_response(self._call_ollama(prompt, on_token=on_token))
+    
+    async def aprocess_ticket(self, ticket, historical_context=None):
+        """Async version of process_ticket, for the ASGI server"""
+        response = await self.client.agenerate(self._build_prompt(ticket, historical_context),
+                                               system=self.system_prompt)
+        return self._parse_response(response)
+    
+    @traced('agent.build_prompt')
+    def _build_prompt(self, ticket, historical_context):
+        return build_prompt(ticket, ('subject', 'description', 'customer', 'category', 'priority', 'status'),
+                            historical_context, 'summarizer', """
         Please analyze this ticket and provide:
         1. A clear summary of the issue
         2. Key points that need attention
         3. The customer's sentiment
         4. Similar historical tickets if any
         5. Your confidence in the analysis
-        """
-        
-        response = self._call_ollama(prompt)
-        
+        """)
+    
+    @traced('agent.parse_response')
+    def _parse_response(self, response):
+        """Validate the model response, falling back to an error summary"""
         if not response:
+            AGENT_FALLBACKS.inc(agent='summary', reason='no_response')
             return {
                 "summary": "Error generating summary",
                 "keyPoints": ["Error processing the ticket"],
@@ -88,32 +89,10 @@ class SummarizerAgent:
         
         try:
             # Try to parse the response as JSON
-            if isinstance(response, str):
-                # Clean up the response string to ensure it's valid JSON
-                response = response.strip()
-                if response.startswith("```json"):
-                    response = response[7:]
-                if response.endswith("```"):
-                    response = response[:-3]
-                response = response.strip()
-                
-                result = json.loads(response)
-            else:
-                result = response
-                
-            # Ensure the response has the expected format
-            if not all(k in result for k in ["summary", "keyPoints", "sentiment"]):
-                raise ValueError("Response missing required fields")
-                
-            # Add default values for optional fields
-            if "similarTickets" not in result:
-                result["similarTickets"] = []
-            if "confidence" not in result:
-                result["confidence"] = 0.5
-                
-            return result
+            return self.validate(parse_json_response(response))
         except Exception as e:
             print(f"Error parsing summarizer response: {str(e)}")
+            AGENT_FALLBACKS.inc(agent='summary', reason='parse_error')
             # Fallback for parsing errors
             return {
                 "summary": "Error generating summary",
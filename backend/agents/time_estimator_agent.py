@@ -3,17 +3,24 @@
 Time Estimator Agent
 ------------------
 This agent estimates the time required to resolve support tickets.
+Estimates come from historical resolution times when there are enough of them,
+and from the LLM otherwise.
 """
 
-import json
-import requests
+from ollama_client import OllamaClient, parse_json_response
+from prompt_builder import build_prompt
+from metrics import AGENT_FALLBACKS
+from tracing import traced
 
 class TimeEstimatorAgent:
     """Agent that estimates resolution time for customer support tickets."""
     
-    def __init__(self, ollama_url, model):
+    def __init__(self, ollama_url, model, client=None, resolution_model=None):
         self.ollama_url = ollama_url
         self.model = model
+        self.client = client or OllamaClient(ollama_url, model)
+        # resolution_model.ResolutionTimeModel; the LLM is only asked when it has too little data
+        self.resolution_model = resolution_model
         self.system_prompt = """
         You are a support resolution time estimator.
         Analyze the ticket and estimate how long it will take to resolve.
@@ -29,34 +36,44 @@ class TimeEstimatorAgent:
         }
         """
     
+    def local_estimate(self, ticket):
+        """Estimate from historical resolution times, or None if they are too sparse"""
+        if self.resolution_model is None:
+            return None
+        return self.resolution_model.estimate_ticket(ticket)
+    
     def process_ticket(self, ticket, historical_context=None):
         """Process a ticket and return time estimation"""
-        prompt = f"""
-        Ticket #{ticket['id']}
-        Subject: {ticket['subject']}
-        Description: {ticket['description']}
-        From: {ticket['customerName']} ({ticket.get('customerEmail', 'No email')})
-        
-        Historical Context:
-        {historical_context or "No historical context available"}
-        """
-        
-        response = self._call_ollama(prompt)
-        
+        estimate = self.local_estimate(ticket)
+        if estimate is not None:
+            return estimate
+        return self._parse_response(self._call_ollama(self._build_prompt(ticket, historical_context)))
+    
+    async def aprocess_ticket(self, ticket, historical_context=None):
+        """Async version of process_ticket, for the ASGI server"""
+        estimate = self.local_estimate(ticket)
+        if estimate is not None:
+            return estimate
+        response = await self.client.agenerate(self._build_prompt(ticket, historical_context),
+                                               system=self.system_prompt)
+        return self._parse_response(response)
+    
+    @traced('agent.build_prompt')
+    def _build_prompt(self, ticket, historical_context):
+        return build_prompt(ticket, ('subject', 'description', 'customer'), historical_context, 'time_estimator')
+    
+    @traced('agent.parse_response')
+    def _parse_response(self, response):
+        """Validate the model response, falling back to a default estimate"""
         try:
-            # Try to parse the response as JSON
-            if isinstance(response, str):
-                result = json.loads(response)
-            else:
-                result = response
+            if not response:
+                raise ValueError("No response from Ollama")
                 
-            # Ensure the response has the expected format
-            if not "estimatedMinutes" in result:
-                raise ValueError("Response missing required 'estimatedMinutes' field")
-                
-            return result
+            # Try to parse the response as JSON
+            return self.validate(parse_json_response(response))
         except Exception as e:
             # Fallback for parsing errors
+            AGENT_FALLBACKS.inc(agent='timeEstimation', reason='parse_error' if response else 'no_response')
             return {
                 "estimatedMinutes": 30,
                 "confidence": 0.5,
@@ -66,41 +83,16 @@ class TimeEstimatorAgent:
                 "error": str(e)
             }
     
+    def validate(self, result):
+        """Check a time estimation result against the expected schema"""
+        if not isinstance(result, dict):
+            raise ValueError("Time estimation must be a JSON object")
+        if not "estimatedMinutes" in result:
+            raise ValueError("Response missing required 'estimatedMinutes' field")
+        if isinstance(result["estimatedMinutes"], bool) or not isinstance(result["estimatedMinutes"], (int, float)):
+            raise ValueError("'estimatedMinutes' must be a number")
+        return result
+    
     def _call_ollama(self, prompt):
         """Call Ollama API with the given prompt"""
-        try:
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "system": self.system_prompt,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code == 200:
-                result = response.json().get("response", "")
-                # Attempt to parse as JSON if it looks like JSON
-                if result.strip().startswith("{") and result.strip().endswith("}"):
-                    try:
-                        return json.loads(result)
-                    except:
-                        pass
-                return result
-            else:
-                return {
-                    "estimatedMinutes": 30,
-                    "confidence": 0.5,
-                    "factors": [
-                        {"name": f"API error: {response.status_code}", "impact": 1.0}
-                    ]
-                }
-        except Exception as e:
-            return {
-                "estimatedMinutes": 30,
-                "confidence": 0.5,
-                "factors": [
-                    {"name": f"Error calling Ollama: {str(e)}", "impact": 1.0}
-                ]
-            }
+        return self.client.generate(prompt, system=self.system_prompt)
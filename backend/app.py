@@ -1,6 +1,7 @@
 from flask import Flask
 from flask_cors import CORS
 import os
+import logging
 from data_loader import DataLoader
 from routes import register_routes
 
@@ -10,6 +11,8 @@ app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 # Configuration
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
 DEFAULT_MODEL = os.environ.get("OLLAMA_MODEL", "llama3")
 
@@ -19,8 +22,8 @@ print(f"Default model: {DEFAULT_MODEL}")
 # Initialize data loader
 data_loader = DataLoader()
 
-# Register all routes
-register_routes(app, data_loader, OLLAMA_URL, DEFAULT_MODEL)
+# Register all routes; the agent service is shared with the ASGI entry point (asgi.py)
+agent_service = register_routes(app, data_loader, OLLAMA_URL, DEFAULT_MODEL)
 
 if __name__ == '__main__':
     print("Starting AI Customer Support System Backend...")
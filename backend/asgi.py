@@ -0,0 +1,138 @@
+"""
+ASGI Entry Point
+----------------
+Serves the API from an ASGI server, alongside the WSGI app in app.py:
+
+    uvicorn asgi:app --port 5000
+
+POST /process-ticket runs on the event loop: its agents await the async Ollama
+client, so an analysis waiting on the model holds a coroutine instead of a
+thread and one process can keep hundreds of them in flight, bounded by
+OLLAMA_ASYNC_CONCURRENCY. Every other route is served by the Flask app unchanged,
+on a thread pool of WSGI_THREADS threads.
+"""
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from a2wsgi import WSGIMiddleware
+import metrics
+import tracing
+from agent_service import PROCESSING_MODES
+from prompt_builder import context_error
+from app import app as flask_app, data_loader, agent_service
+
+wsgi_app = WSGIMiddleware(flask_app, workers=int(os.environ.get("WSGI_THREADS", "32")))
+tracer = tracing.Tracer.from_env()
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+        (b'access-control-allow-origin', b'*'),
+    ]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def process_ticket(scope, receive, send):
+    """Async version of POST /process-ticket, with the same request, response and trace headers"""
+    header = dict(scope['headers']).get(tracing.DEBUG_HEADER.lower().encode(), b'')
+    debug = tracing.debug_requested(header.decode('latin-1'))
+    with tracer.trace('POST /process-ticket', force=debug) as root:
+        async def send_with_trace_id(message):
+            if root is not None and message['type'] == 'http.response.start':
+                message = dict(message, headers=list(message['headers']) + [
+                    (b'x-trace-id', root.trace_id.encode()),
+                    (b'access-control-expose-headers', b'X-Trace-Id')])
+            await send(message)
+
+        await _process_ticket(receive, send_with_trace_id, root if debug else None)
+
+
+async def _process_ticket(receive, send, debug_span):
+    try:
+        body = json.loads(await _read_body(receive) or b'{}')
+    except ValueError:
+        return await _send_json(send, 400, {"error": "Request body must be JSON"})
+    ticket = body.get('ticket') if isinstance(body, dict) else None
+    if not ticket:
+        return await _send_json(send, 400, {"error": "No ticket data provided"})
+
+    mode = body.get('mode')
+    if mode and mode not in PROCESSING_MODES:
+        return await _send_json(send, 400, {
+            "error": f"Invalid mode '{mode}', expected one of: {', '.join(PROCESSING_MODES)}"})
+    error = context_error(body.get('historical_context'))
+    if error:
+        return await _send_json(send, 400, {"error": error})
+
+    try:
+        tracing.set_attributes(ticket_id=str(ticket.get('id')))
+        historical_context = body.get('historical_context')
+        if historical_context is None:
+            with tracing.span('retrieval'):
+                historical_context = data_loader.get_context_for_ticket(ticket)
+        results = await agent_service.aprocess_ticket(ticket, historical_context, mode=mode)
+        if "error" in results:
+            print(f"Error from agent service: {results['error']}")
+            return await _send_json(send, 500, results)
+        # Storing the analysis may wait on the SQLite write lock, so keep it off the event loop
+        with tracing.span('save_analysis'):
+            await asyncio.to_thread(data_loader.save_analysis, ticket.get('id'), results)
+        print(f"Successfully processed ticket {ticket.get('id')}")
+        if debug_span is not None:
+            results['metadata']['trace'] = debug_span.tree()
+        await _send_json(send, 200, results)
+    except Exception as e:
+        print(f"Error processing ticket: {str(e)}")
+        print(traceback.format_exc())
+        await _send_json(send, 500, {"error": str(e)})
+
+
+async def _timed(handler, method, route, scope, receive, send):
+    """Run a native route, recording the same request metrics as the Flask routes"""
+    started = time.perf_counter()
+    statuses = []
+
+    async def send_and_record(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=method, route=route)
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_and_record)
+    finally:
+        metrics.HTTP_REQUESTS.inc(method=method, route=route, status=statuses[0] if statuses else 500)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await agent_service.client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'].rstrip('/') == '/process-ticket':
+        return await _timed(process_ticket, 'POST', '/process-ticket', scope, receive, send)
+    return await wsgi_app(scope, receive, send)
@@ -0,0 +1,100 @@
+"""
+Batch Service
+-------------
+Runs the AgentService across many tickets with bounded concurrency.
+Results are yielded as they complete so callers can stream them out as JSONL,
+followed by a summary record with throughput statistics.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+import traceback
+
+# Marks the end of the ticket iterator; None is a ticket value like any other bad input
+_END = object()
+
+
+def default_concurrency(agent_service):
+    """Pick a batch concurrency that keeps every ticket's agents on the shared graph pool.
+
+    Each ticket occupies up to six graph workers, so running more tickets than
+    AGENT_WORKERS / 6 at once only makes nodes queue behind each other.
+    """
+    return max(1, agent_service.max_workers // 6)
+
+
+def _analyze(agent_service, ticket, mode, context_for, save_result):
+    started = time.time()
+    if not isinstance(ticket, dict):
+        return {
+            "type": "result",
+            "ticketId": None,
+            "status": "error",
+            "elapsed": 0.0,
+            "result": {"error": f"Ticket must be a JSON object, got {type(ticket).__name__}"}
+        }
+    try:
+        historical_context = ticket.get('historical_context')
+        if historical_context is None and context_for is not None:
+            historical_context = context_for(ticket)
+        result = agent_service.process_ticket(ticket, historical_context, mode=mode)
+        status = "error" if "error" in result else "ok"
+        if status == "ok" and save_result is not None:
+            save_result(ticket.get('id'), result)
+    except Exception as e:
+        print(f"Error analysing ticket {ticket.get('id')}: {str(e)}")
+        print(traceback.format_exc())
+        result = {"error": str(e)}
+        status = "error"
+    return {
+        "type": "result",
+        "ticketId": ticket.get('id'),
+        "status": status,
+        "elapsed": round(time.time() - started, 3),
+        "result": result
+    }
+
+
+def analyze_tickets(agent_service, tickets, concurrency=None, mode=None, context_for=None, on_progress=None,
+                    save_result=None):
+    """Analyse an iterable of tickets and yield one record per ticket as it completes.
+
+    `tickets` may be a lazy iterator; at most `concurrency` tickets are in flight,
+    so arbitrarily large inputs are processed in bounded memory. `context_for(ticket)`
+    supplies historical context for tickets that do not carry their own, and
+    `save_result(ticket_id, result)` is called with each successful analysis.
+    `on_progress(stats)` is called after each completed ticket. The final record
+    has type 'summary' and carries the totals and throughput.
+    """
+    concurrency = concurrency or default_concurrency(agent_service)
+    stats = {"type": "summary", "total": 0, "succeeded": 0, "failed": 0,
+             "elapsed": 0.0, "ticketsPerSecond": 0.0}
+    started = time.time()
+    ticket_iter = iter(tickets)
+    pending = set()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        def fill():
+            while len(pending) < concurrency:
+                ticket = next(ticket_iter, _END)
+                if ticket is _END:
+                    return
+                pending.add(executor.submit(_analyze, agent_service, ticket, mode, context_for, save_result))
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                record = future.result()
+                stats["total"] += 1
+                stats["succeeded" if record["status"] == "ok" else "failed"] += 1
+                stats["elapsed"] = round(time.time() - started, 3)
+                stats["ticketsPerSecond"] = round(stats["total"] / stats["elapsed"], 3) if stats["elapsed"] else 0.0
+                if on_progress:
+                    on_progress(dict(stats))
+                yield record
+            fill()
+
+    stats["elapsed"] = round(time.time() - started, 3)
+    yield stats
@@ -0,0 +1,266 @@
+"""
+Benchmark
+---------
+Command-line benchmarks for the support desk backend.
+
+    python benchmark.py modes --tickets 5 --repeat 2
+    python benchmark.py sentiment --tickets 20000
+    python benchmark.py stress --readers 8 --writers 2 --seconds 5
+
+`modes` compares the multi-call agent path with the fused single-prompt path
+against the configured Ollama server. The LLM response cache is disabled so
+every run pays for real generations.
+
+`sentiment` compares per-ticket local sentiment analysis with the vectorised
+batch API on a synthetic backlog, and checks that both give the same results.
+
+`stress` runs ticket queries and context lookups from reader threads while
+writer threads create and update tickets, checks every result for consistency
+and reports throughput and read latency. It also checks that building the
+historical retriever over --build-rows rows scales linearly.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+
+def _summarize(latencies):
+    """Return basic latency statistics in seconds"""
+    ordered = sorted(latencies)
+    return {
+        "runs": len(ordered),
+        "mean": round(statistics.mean(ordered), 3),
+        "p50": round(ordered[len(ordered) // 2], 3),
+        "max": round(ordered[-1], 3)
+    }
+
+
+def bench_modes(args):
+    """Compare latency of the 'multi' and 'fused' processing modes"""
+    os.environ["LLM_CACHE_SIZE"] = "0"
+    from data_loader import DataLoader
+    from agent_service import AgentService, PROCESSING_MODES
+
+    ollama_url = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+    model = os.environ.get("OLLAMA_MODEL", "llama3")
+    data_loader = DataLoader()
+    agent_service = AgentService(ollama_url, model)
+    tickets = data_loader.get_tickets()[:args.tickets]
+
+    for mode in PROCESSING_MODES:
+        latencies = []
+        fallbacks = 0
+        for _ in range(args.repeat):
+            for ticket in tickets:
+                context = data_loader.get_context_for_ticket(ticket)
+                start = time.time()
+                results = agent_service.process_ticket(ticket, context, mode=mode)
+                latencies.append(time.time() - start)
+                fallbacks += len(results.get('metadata', {}).get('fused_fallbacks', []))
+        stats = _summarize(latencies)
+        print(f"{mode:>6}: {stats} section fallbacks={fallbacks}")
+
+
+def bench_sentiment(args):
+    """Compare SentimentAnalyzerAgent.analyze_ticket in a loop with analyze_batch"""
+    import random
+    from data_loader import DataLoader
+    from agents.sentiment_analyzer import SentimentAnalyzerAgent
+
+    # Build a backlog by recombining sentences from the known tickets
+    rng = random.Random(args.seed)
+    sentences = []
+    for ticket in DataLoader().get_tickets():
+        sentences.extend(part.strip() for part in f"{ticket['subject']}. {ticket['description']}".split('.') if part.strip())
+    backlog = [{
+        "subject": rng.choice(sentences),
+        "description": ". ".join(rng.choice(sentences) for _ in range(rng.randint(1, args.sentences))) + rng.choice(["", "!", "!!"])
+    } for _ in range(args.tickets)]
+
+    analyzer = SentimentAnalyzerAgent()
+    start = time.perf_counter()
+    looped = [analyzer.analyze_ticket(ticket) for ticket in backlog]
+    loop_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = []
+    for offset in range(0, len(backlog), args.batch_size):
+        batched.extend(analyzer.analyze_batch(backlog[offset:offset + args.batch_size]))
+    batch_elapsed = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(looped, batched) if a != b)
+    print(f" loop: {len(backlog) / loop_elapsed:,.0f} tickets/s ({loop_elapsed:.3f}s)")
+    print(f"batch: {len(backlog) / batch_elapsed:,.0f} tickets/s ({batch_elapsed:.3f}s, batch size {args.batch_size})")
+    print(f"speedup: {loop_elapsed / batch_elapsed:.2f}x, mismatched results: {mismatches}")
+
+
+def _check_retriever_build(rows, fail):
+    """Time HistoricalRetriever.add_tickets on a synthetic export of `rows` rows and a
+    quarter of it; indexing must scale linearly, so the ratio should stay near 4"""
+    import random
+    from retrieval import HistoricalRetriever
+
+    rng = random.Random(0)
+    words = [f"term{i}" for i in range(2000)]
+    categories = [f"category {i} issue" for i in range(40)]
+    records = [{'Ticket ID': f"BENCH{i}", 'Issue Category': rng.choice(categories),
+                'Solution': " ".join(rng.choice(words) for _ in range(12))} for i in range(rows)]
+    timings = []
+    for size in (rows // 4, rows):
+        start = time.perf_counter()
+        HistoricalRetriever().add_tickets(records[:size])
+        timings.append(time.perf_counter() - start)
+    ratio = timings[1] / max(timings[0], 1e-9)
+    print(f"retriever build: {rows // 4:,} rows in {timings[0]:.2f}s, {rows:,} rows in {timings[1]:.2f}s "
+          f"({ratio:.1f}x)")
+    if ratio > 8:
+        fail(f"retriever build grows {ratio:.1f}x for 4x the rows")
+
+
+def bench_stress(args):
+    """Hammer DataLoader with concurrent reads, creates and updates"""
+    import random
+    from ticket_store import index_value
+    if args.store == "sqlite":
+        os.environ["TICKET_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "tickets.db")
+    os.environ["TICKET_STORE"] = args.store
+    from data_loader import DataLoader
+
+    data_loader = DataLoader()
+    initial = len(data_loader.ticket_store)
+    templates = data_loader.get_tickets()
+    statuses = ['open', 'in-progress', 'resolved']
+    priorities = ['low', 'medium', 'high', 'critical']
+    sorts = [None, 'id', '-createdAt', 'priority', '-status']
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies, errors = [], []
+    counts = {"reads": 0, "creates": 0, "updates": 0}
+
+    def fail(message):
+        with lock:
+            errors.append(message)
+
+    def reader(seed):
+        rng = random.Random(seed)
+        local, reads = [], 0
+        while not stop.is_set():
+            filters = {"status": rng.choice(statuses + [None]), "priority": rng.choice(priorities + [None])}
+            limit = rng.choice([None, 5, 20])
+            start = time.perf_counter()
+            try:
+                tickets, total = data_loader.query_tickets(filters, sort=rng.choice(sorts), limit=limit)
+                ticket = data_loader.get_ticket(rng.choice(tickets)['id']) if tickets else None
+                if ticket:
+                    data_loader.get_context_for_ticket(ticket)
+            except Exception as e:
+                fail(f"read failed: {e!r}")
+                continue
+            local.append(time.perf_counter() - start)
+            reads += 1
+            if len(tickets) != (total if limit is None else min(limit, total)):
+                fail(f"page of {len(tickets)} for total {total} and limit {limit}")
+            for item in tickets:
+                for field, wanted in filters.items():
+                    if wanted is not None and index_value(item.get(field)) != wanted:
+                        fail(f"{item['id']} has {field}={item.get(field)!r}, filtered on {wanted!r}")
+        with lock:
+            latencies.extend(local)
+            counts["reads"] += reads
+
+    def writer(seed):
+        rng = random.Random(seed)
+        created, updates, ids = 0, 0, []
+        while not stop.is_set():
+            try:
+                if not ids or rng.random() < 0.5:
+                    template = rng.choice(templates)
+                    ticket = data_loader.create_ticket(dict(template, status='open', priority=rng.choice(priorities)))
+                    ids.append(ticket['id'])
+                    created += 1
+                else:
+                    data_loader.update_ticket(rng.choice(ids), {"status": rng.choice(statuses),
+                                                                "priority": rng.choice(priorities)})
+                    updates += 1
+            except Exception as e:
+                fail(f"write failed: {e!r}")
+        with lock:
+            counts["creates"] += created
+            counts["updates"] += updates
+
+    threads = ([threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+               + [threading.Thread(target=writer, args=(1000 + i,)) for i in range(args.writers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    # The indexes must agree with the tickets once the writers are done
+    store = data_loader.ticket_store
+    if len(store) != initial + counts["creates"]:
+        fail(f"store has {len(store)} tickets, expected {initial + counts['creates']}")
+    for field in ('status', 'priority'):
+        by_value = store.count_by(field)
+        if sum(by_value.values()) != len(store):
+            fail(f"{field} index counts {sum(by_value.values())} tickets, store has {len(store)}")
+        for value, count in by_value.items():
+            if len(store.find_ids(**{field: value})) != count:
+                fail(f"{field}={value!r} index disagrees with count_by")
+
+    if args.build_rows:
+        _check_retriever_build(args.build_rows, fail)
+
+    print(f"store: {args.store}, {args.readers} readers, {args.writers} writers, {args.seconds}s")
+    print(f"reads: {counts['reads'] / args.seconds:,.0f}/s, "
+          f"writes: {(counts['creates'] + counts['updates']) / args.seconds:,.0f}/s "
+          f"({counts['creates']} creates, {counts['updates']} updates)")
+    if latencies:
+        ordered = sorted(latencies)
+        print(f"read latency: p50={ordered[len(ordered) // 2] * 1000:.2f}ms "
+              f"p99={ordered[int(len(ordered) * 0.99)] * 1000:.2f}ms max={ordered[-1] * 1000:.2f}ms")
+    print(f"errors: {len(errors)}")
+    for message in errors[:10]:
+        print(f"  {message}")
+    # Non-zero exit so a CI run fails on inconsistent reads or a slow retriever build
+    return 1 if errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Support desk backend benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    modes = subparsers.add_parser("modes", help="Compare multi-call and fused analysis latency")
+    modes.add_argument("--tickets", type=int, default=5, help="Number of tickets to analyse")
+    modes.add_argument("--repeat", type=int, default=1, help="Runs per ticket and mode")
+    modes.set_defaults(func=bench_modes)
+
+    sentiment = subparsers.add_parser("sentiment", help="Compare per-ticket and batch sentiment analysis")
+    sentiment.add_argument("--tickets", type=int, default=20000, help="Size of the synthetic backlog")
+    sentiment.add_argument("--batch-size", type=int, default=5000, help="Tickets per analyze_batch call")
+    sentiment.add_argument("--sentences", type=int, default=6, help="Maximum sentences per description")
+    sentiment.add_argument("--seed", type=int, default=0, help="Random seed for the backlog")
+    sentiment.set_defaults(func=bench_sentiment)
+
+    stress = subparsers.add_parser("stress", help="Concurrent ticket reads and writes against DataLoader")
+    stress.add_argument("--readers", type=int, default=8, help="Reader threads")
+    stress.add_argument("--writers", type=int, default=2, help="Writer threads")
+    stress.add_argument("--seconds", type=float, default=5, help="How long to run")
+    stress.add_argument("--store", choices=["memory", "sqlite"], default="memory",
+                        help="Ticket store to use (sqlite uses a temporary database)")
+    stress.add_argument("--build-rows", type=int, default=40000,
+                        help="Historical rows for the retriever build-time check, 0 to skip")
+    stress.set_defaults(func=bench_stress)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
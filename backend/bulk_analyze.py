@@ -0,0 +1,100 @@
+"""
+Bulk Analyze
+------------
+Offline bulk analysis of support tickets.
+
+    python bulk_analyze.py --all --output results.jsonl
+    python bulk_analyze.py --input tickets.jsonl --concurrency 4
+    python bulk_analyze.py --ids T006 T008 --mode fused
+
+Writes one JSON record per ticket (JSONL) followed by a summary record, and
+reports progress and throughput on stderr.
+"""
+
+import argparse
+import json
+import os
+import sys
+from agent_service import AgentService, PROCESSING_MODES
+from batch_service import analyze_tickets
+from routing_model import LocalRouter
+
+
+def read_jsonl(path):
+    """Lazily yield tickets from a JSONL file ('-' for stdin)"""
+    handle = sys.stdin if path == '-' else open(path, mode='r', encoding='utf-8')
+    try:
+        for line_number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping invalid JSON on line {line_number}: {e}", file=sys.stderr)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse many support tickets with the agent framework")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="JSONL file of tickets ('-' for stdin)")
+    source.add_argument("--all", action="store_true", help="Analyse every ticket known to the DataLoader")
+    source.add_argument("--ids", nargs="+", help="Analyse the DataLoader tickets with these IDs")
+    parser.add_argument("--output", default="-", help="JSONL output file (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=None, help="Tickets analysed at once")
+    parser.add_argument("--mode", choices=PROCESSING_MODES, default=None, help="Agent processing mode")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many tickets")
+    parser.add_argument("--no-context", action="store_true", help="Do not add historical context")
+    args = parser.parse_args()
+
+    # The backend logs with print(); keep stdout clean for JSONL output
+    results_stream = sys.stdout
+    sys.stdout = sys.stderr
+
+    ollama_url = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+    model = os.environ.get("OLLAMA_MODEL", "llama3")
+
+    data_loader = None
+    if args.all or args.ids or not args.no_context:
+        from data_loader import DataLoader
+        data_loader = DataLoader()
+
+    if args.input:
+        tickets = read_jsonl(args.input)
+    elif args.all:
+        tickets = iter(data_loader.get_tickets())
+    else:
+        tickets = (ticket for ticket in map(data_loader.get_ticket, args.ids) if ticket)
+
+    if args.limit:
+        tickets = (ticket for _, ticket in zip(range(args.limit), tickets))
+
+    context_for = None if args.no_context else data_loader.get_context_for_ticket
+    local_router = LocalRouter.from_env(data_loader.data_dir, data_loader.historical_tickets) if data_loader else None
+    agent_service = AgentService(ollama_url, model, local_router=local_router,
+                                 resolution_model=data_loader.resolution_model if data_loader else None)
+
+    def report(stats):
+        print(f"\r[{stats['total']} done, {stats['failed']} failed] "
+              f"{stats['ticketsPerSecond']:.2f} tickets/s", end="", file=sys.stderr, flush=True)
+
+    output = results_stream if args.output == '-' else open(args.output, mode='w', encoding='utf-8')
+    try:
+        for record in analyze_tickets(agent_service, tickets, args.concurrency, args.mode,
+                                      context_for=context_for, on_progress=report,
+                                      save_result=data_loader.save_analysis if data_loader else None):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+    finally:
+        print(file=sys.stderr)
+        if local_router:
+            print(f"Routing model: {json.dumps(local_router.stats())}", file=sys.stderr)
+        if output is not results_stream:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
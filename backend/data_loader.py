@@ -2,9 +2,78 @@ import os
 import csv
 import json
 from pathlib import Path
-from ticket_service import get_all_tickets, map_issue_category, map_priority
+from ticket_service import get_all_tickets, enrich_tickets, sentiment_fields, map_issue_category, map_priority
+from agents.sentiment_analyzer import SentimentAnalyzerAgent
+from ticket_store import TicketStore, PRIORITY_RANKS
+from ticket_db import SQLiteTicketStore
+from retrieval import HistoricalRetriever
+from historical_context import HistoricalContext, Conversation
+from resolution_model import ResolutionTimeModel, historical_resolution_minutes, RESOLVED_STATUSES
 from datetime import datetime
 import uuid
+import logging
+import time
+import threading
+import traceback
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+# Historical CSV columns and the defaults used when a value is empty
+HISTORICAL_COLUMNS = {
+    'Ticket ID': 'Unknown',
+    'Issue Category': 'General',
+    'Sentiment': 'neutral',
+    'Priority': 'medium',
+    'Solution': 'No solution recorded',
+    'Resolution Status': 'open',
+    'Date of Resolution': ''
+}
+
+# Columns kept when an export has them; resolution times are derived from them
+OPTIONAL_HISTORICAL_COLUMNS = ('Date of Creation', 'Resolution Minutes')
+
+def iter_historical_tickets(csv_path):
+    """Stream historical tickets from an RFC 4180 CSV file, one row at a time.
+    
+    Quoted fields may contain commas, quotes and newlines. The header is validated
+    once; rows without a Ticket ID or with missing columns are skipped.
+    """
+    with open(csv_path, mode='r', encoding='utf-8-sig', errors='replace', newline='') as file:
+        reader = csv.DictReader(file, skipinitialspace=True)
+        headers = [h.strip() for h in (reader.fieldnames or [])]
+        if not headers:
+            logger.warning("No headers found in %s", csv_path)
+            return
+        reader.fieldnames = headers
+        if 'Ticket ID' not in headers:
+            raise ValueError(f"{csv_path} has no 'Ticket ID' column (found: {headers})")
+        missing = [column for column in HISTORICAL_COLUMNS if column not in headers]
+        if missing:
+            logger.warning("%s is missing columns %s; defaults will be used", csv_path, missing)
+        
+        for row in reader:
+            if None in row.values():
+                logger.debug("Skipping line %d: expected %d values", reader.line_num, len(headers))
+                continue
+            ticket = {}
+            for column, default in HISTORICAL_COLUMNS.items():
+                value = (row.get(column) or '').strip()
+                ticket[column] = value or default
+            for column in OPTIONAL_HISTORICAL_COLUMNS:
+                if row.get(column):
+                    ticket[column] = row[column].strip()
+            if ticket['Ticket ID'] == 'Unknown':
+                logger.debug("Skipping line %d: no ticket ID", reader.line_num)
+                continue
+            yield ticket
+
+# Ticket fields that may be changed after creation
+UPDATABLE_FIELDS = ('subject', 'description', 'customerName', 'customerEmail', 'category',
+                    'priority', 'status', 'assignedTo', 'resolution', 'sentiment')
+
+# Updatable fields that may be cleared with null; every other one must be a string
+NULLABLE_FIELDS = ('assignedTo',)
 
 class DataLoader:
     def __init__(self):
@@ -12,94 +81,57 @@ class DataLoader:
         self.data_dir = Path(__file__).parent / "data"
         self.historical_tickets = self._load_historical_tickets()
         self.conversations = self._load_conversations()
+        # Conversations split into header fields and Customer/Agent turns once, at load time
+        self.conversation_examples = {category: Conversation.parse(category, content)
+                                      for category, content in self.conversations.items()}
+        
+        # Indexed view of the historical tickets for filtered/paginated queries
+        self.historical_store = self._create_historical_store()
         
         # Create mappings for faster lookups
         self.category_to_tickets = self._create_category_mapping()
         self.category_to_conversation = self._create_conversation_mapping()
         
-        # Load tickets
-        self.tickets = get_all_tickets(self)
+        # Lexical index used to find relevant history for a ticket
+        self.retriever = self._create_retriever()
+        
+        # Load tickets into the indexed store, with local sentiment computed once at ingest
+        self.sentiment_analyzer = SentimentAnalyzerAgent()
+        # Single writer path: creates and updates touch the store, retriever and similarity
+        # index together. Readers never wait on it; each store keeps its reads consistent itself.
+        self._write_lock = threading.Lock()
+        self.ticket_store = self._create_ticket_store()
+        # Tickets created or edited in earlier runs are retrievable as they were last written
+        self.retriever.add_tickets([self._as_historical_record(ticket) for ticket in self.ticket_store.all()
+                                    if ticket.get('updatedAt')])
+        
+        # Resolution times by category and priority, used for local time estimates
+        self.resolution_model = self._create_resolution_model()
+        
+        # Optional semantic index, attached by the API once an embedder is configured
+        self.similarity_index = None
         
         print(f"Loaded {len(self.historical_tickets)} historical tickets and {len(self.conversations)} conversations")
         print(f"Available categories: {list(self.category_to_conversation.keys())}")
 
     def _load_historical_tickets(self):
         """Load historical ticket data from CSV file"""
-        tickets = []
         csv_path = self.data_dir / "Historical_ticket_data.csv"
         
+        if not csv_path.exists():
+            print(f"CSV file not found at: {csv_path}")
+            return []
+        
         try:
-            print(f"Loading historical tickets from: {csv_path}")
-            if not csv_path.exists():
-                print(f"CSV file not found at: {csv_path}")
-                return []
-                
-            print("Reading file contents...")
-            # Read the file content first to check for issues
-            with open(csv_path, mode='r', encoding='utf-8-sig', errors='replace') as file:
-                content = file.read()
-                print(f"File size: {len(content)} bytes")
-                
-            # Check if the file is empty or has formatting issues
-            if not content.strip():
-                print("CSV file is empty")
-                return []
-                
-            # Split content into lines and process manually
-            lines = [line.strip() for line in content.split('\n') if line.strip()]
-            print(f"Found {len(lines)} non-empty lines")
-            
-            if not lines:
-                print("No valid lines found in CSV file")
-                return []
-                
-            # Get headers from first line
-            headers = [h.strip() for h in lines[0].split(',')]
-            print(f"Found headers: {headers}")
-            
-            if not headers:
-                print("No headers found in CSV file")
-                return []
-                
-            # Process each data line
-            print("Processing data lines...")
-            for i, line in enumerate(lines[1:], 1):
-                try:
-                    print(f"\nProcessing line {i}: {line}")
-                    values = [v.strip() for v in line.split(',')]
-                    print(f"Split into {len(values)} values: {values}")
-                    
-                    if len(values) >= len(headers):
-                        row = dict(zip(headers, values))
-                        print(f"Created row dictionary: {row}")
-                        
-                        ticket = {
-                            'Ticket ID': row.get('Ticket ID', 'Unknown'),
-                            'Issue Category': row.get('Issue Category', 'General'),
-                            'Sentiment': row.get('Sentiment', 'neutral'),
-                            'Priority': row.get('Priority', 'medium'),
-                            'Solution': row.get('Solution', 'No solution recorded'),
-                            'Resolution Status': row.get('Resolution Status', 'open'),
-                            'Date of Resolution': row.get('Date of Resolution', '')
-                        }
-                        
-                        if ticket['Ticket ID'] != 'Unknown':
-                            tickets.append(ticket)
-                            print(f"Successfully loaded ticket: {ticket['Ticket ID']}")
-                        else:
-                            print(f"Skipping ticket with unknown ID")
-                    else:
-                        print(f"Line {i} has insufficient values ({len(values)} < {len(headers)})")
-                except Exception as e:
-                    print(f"Error processing line {i}: {line}")
-                    print(f"Error details: {str(e)}")
-                    continue
-                    
-            print(f"\nSuccessfully loaded {len(tickets)} historical tickets")
+            started = time.perf_counter()
+            tickets = list(iter_historical_tickets(csv_path))
+            elapsed = time.perf_counter() - started
+            rate = len(tickets) / elapsed if elapsed > 0 else float('inf')
+            logger.info("Loaded %d historical tickets from %s in %.3fs (%.0f rows/sec)",
+                        len(tickets), csv_path, elapsed, rate)
             return tickets
         except Exception as e:
             print(f"Error loading historical tickets: {e}")
-            import traceback
             print(traceback.format_exc())
             return []
 
@@ -123,6 +155,46 @@ class DataLoader:
             print(f"Error loading conversations: {e}")
             return {}
     
+    def _create_historical_store(self):
+        """Index historical tickets by ID, category, priority, status, sentiment and resolution date"""
+        store = TicketStore(
+            key='Ticket ID',
+            indexed_fields=('Issue Category', 'Priority', 'Resolution Status', 'Sentiment'),
+            date_field='Date of Resolution',
+            sort_ranks={'Priority': PRIORITY_RANKS}
+        )
+        for ticket in self.historical_tickets:
+            # Keep the first row for duplicate IDs, like get_all_tickets does
+            if ticket['Ticket ID'] not in store:
+                store.add(ticket)
+        return store
+
+    def _ingest_tickets(self):
+        """Build the ticket list from the source data, with local sentiment computed once"""
+        started = time.perf_counter()
+        tickets = enrich_tickets(get_all_tickets(self), self.sentiment_analyzer)
+        logger.info("Computed ingest fields for %d tickets in %.3fs", len(tickets), time.perf_counter() - started)
+        return tickets
+
+    def _create_ticket_store(self):
+        """Open the ticket store selected by TICKET_STORE (sqlite or memory).
+        
+        A SQLite database that already holds tickets is used as is, so restarts keep
+        created and updated tickets and skip re-ingesting the source data.
+        """
+        backend = os.environ.get("TICKET_STORE", "sqlite").strip().lower()
+        if backend != "sqlite":
+            return TicketStore(self._ingest_tickets())
+        path = os.environ.get("TICKET_DB_PATH") or self.data_dir / "tickets.db"
+        store = SQLiteTicketStore(path)
+        if len(store):
+            logger.info("Opened %d tickets from %s", len(store), path)
+            return store
+        started = time.perf_counter()
+        tickets = store.add_many(self._ingest_tickets())
+        logger.info("Imported %d tickets into %s in %.3fs", len(tickets), path, time.perf_counter() - started)
+        return store
+
     def _create_category_mapping(self):
         """Create mapping from categories to relevant tickets"""
         mapping = {}
@@ -132,7 +204,8 @@ class DataLoader:
                 if category not in mapping:
                     mapping[category] = []
                 mapping[category].append(ticket)
-        return mapping
+        # Read-only after load, so request threads can share it without locking
+        return MappingProxyType({category: tuple(tickets) for category, tickets in mapping.items()})
 
     def _create_conversation_mapping(self):
         """Create mapping from categories to conversations"""
@@ -141,107 +214,140 @@ class DataLoader:
             # Normalize category name to match ticket categories
             norm_category = category.strip()
             mapping[norm_category] = content
-        return mapping
+        return MappingProxyType(mapping)
 
-    def get_combined_data_for_ticket(self, ticket):
-        """Get relevant historical data and conversations for a ticket"""
-        combined_data = ""
-        
-        # First, try exact category matching
-        ticket_subject = ticket.get('subject', '').strip()
-        
-        # Find relevant historical tickets based on subject
-        relevant_tickets = []
-        
-        # Try direct category match first
-        if ticket_subject in self.category_to_tickets:
-            relevant_tickets = self.category_to_tickets[ticket_subject][:3]  # Top 3 matches
-        
-        # If no direct match, try partial matching
-        if not relevant_tickets:
-            for category, tickets in self.category_to_tickets.items():
-                if (ticket_subject.lower() in category.lower() or 
-                    category.lower() in ticket_subject.lower()):
-                    relevant_tickets.extend(tickets[:2])  # Add top 2 from each partial match
-            
-            # Sort by priority to get most relevant
-            relevant_tickets = sorted(
-                relevant_tickets, 
-                key=lambda t: t.get('Priority', 'Low').lower() == 'high', 
-                reverse=True
-            )[:3]
+    def _create_retriever(self):
+        """Build the BM25 retrieval indexes over historical tickets and conversations"""
+        started = time.perf_counter()
+        retriever = HistoricalRetriever()
+        retriever.add_tickets(self.historical_store.all())
+        for category, content in self.conversations.items():
+            retriever.add_conversation(category, content)
+        logger.info("Built retrieval index over %d historical tickets and %d conversations in %.3fs",
+                    len(self.historical_store), len(self.conversations), time.perf_counter() - started)
+        return retriever
+
+    def _create_resolution_model(self):
+        """Collect resolution times from historical rows that record them and from resolved tickets"""
+        model = ResolutionTimeModel()
+        for record in self.historical_store.all():
+            model.add(map_issue_category(record['Issue Category']), map_priority(record['Priority']),
+                      historical_resolution_minutes(record))
+        for ticket in self.ticket_store.all():
+            model.add_ticket(ticket)
+        return model
+
+    @staticmethod
+    def _as_historical_record(ticket):
+        """Describe a live ticket in the historical ticket format used for retrieval"""
+        return {
+            'Ticket ID': ticket.get('id'),
+            'Issue Category': ticket.get('subject') or 'General',
+            'Sentiment': ticket.get('sentiment') or 'neutral',
+            'Priority': ticket.get('priority') or 'medium',
+            'Solution': ticket.get('resolution') or 'No solution recorded',
+            'Resolution Status': ticket.get('status') or 'open',
+            'Date of Resolution': ticket.get('updatedAt', '') if ticket.get('status') == 'resolved' else ''
+        }
+
+    @staticmethod
+    def _ticket_text(ticket):
+        return f"{ticket.get('subject', '')}\n{ticket.get('category', '')}\n{ticket.get('description', '')}"
+
+    def attach_similarity_index(self, index):
+        """Register historical tickets, conversations and tickets with a SimilarityIndex.
         
-        # Find relevant conversation based on the subject
-        relevant_conversation = None
+        Documents are embedded by the index's background thread, so searches return
+        matches from the documents embedded so far; created or updated tickets are kept
+        in sync from then on.
+        """
+        for record in self.historical_store.all():
+            index.add_document('historical', record['Ticket ID'],
+                               f"{record['Issue Category']}\n{record['Solution']}", record)
+        for category, content in self.conversations.items():
+            index.add_document('conversation', category, f"{category}\n{content}", {"category": category})
+        with self._write_lock:
+            for ticket in self.ticket_store.all():
+                index.add_document('ticket', ticket['id'], self._ticket_text(ticket), ticket)
+            self.similarity_index = index
+        index.start()
+
+    def find_similar_tickets(self, ticket, k=5, kinds=None):
+        """Return the k documents most similar to a ticket by embedding similarity.
         
-        # Try direct match first
-        if ticket_subject in self.category_to_conversation:
-            relevant_conversation = self.category_to_conversation[ticket_subject]
+        Each match is {"id", "type", "score", "record"}, one per ID. The ticket itself
+        is excluded, including its historical row when it was imported from the CSV.
+        Returns an empty list when no similarity index is attached.
+        """
+        if self.similarity_index is None:
+            return []
+        exclude = [('ticket', ticket['id']), ('historical', ticket['id'])] if ticket.get('id') else []
+        return self.similarity_index.search(self._ticket_text(ticket), k=k, kinds=kinds, exclude=exclude,
+                                            unique_ids=True)
+
+    def get_context_for_ticket(self, ticket):
+        """Get the historical tickets and conversation example most relevant to a ticket.
         
-        # If no direct match, try partial matching
-        if not relevant_conversation:
-            best_match = None
-            longest_match = 0
-            
-            for category, conversation in self.category_to_conversation.items():
-                if (ticket_subject.lower() in category.lower() or 
-                    category.lower() in ticket_subject.lower()):
-                    # Choose the closest match by length
-                    match_length = max(
-                        len(category) if category.lower() in ticket_subject.lower() else 0,
-                        len(ticket_subject) if ticket_subject.lower() in category.lower() else 0
-                    )
-                    if match_length > longest_match:
-                        longest_match = match_length
-                        best_match = conversation
-            
-            relevant_conversation = best_match
+        Returns a HistoricalContext whose conversations are already split into turns;
+        agents render the parts they need with prompt_builder.
+        """
+        # Rank history against the ticket's subject and description
+        query = f"{ticket.get('subject', '')} {ticket.get('description', '')}"
+        exclude = [ticket['id']] if ticket.get('id') else []
+        match = self.retriever.best_conversation(query)
+        return HistoricalContext(
+            self.retriever.search_tickets(query, k=3, exclude_ids=exclude),
+            [self.conversation_examples[match[0]]] if match else []
+        )
         
-        # Format relevant tickets
-        if relevant_tickets:
-            combined_data += "--- RELEVANT HISTORICAL TICKETS ---\n"
-            for i, ticket in enumerate(relevant_tickets, 1):
-                combined_data += f"Case #{i}: {ticket.get('Ticket ID', 'Unknown')}\n"
-                combined_data += f"Issue: {ticket.get('Issue Category', 'Unknown')}\n"
-                combined_data += f"Customer Sentiment: {ticket.get('Sentiment', 'Unknown')}\n"
-                combined_data += f"Priority: {ticket.get('Priority', 'Unknown')}\n"
-                combined_data += f"Solution: {ticket.get('Solution', 'No solution recorded')}\n"
-                combined_data += f"Status: {ticket.get('Resolution Status', 'Unknown')}\n\n"
+    @property
+    def tickets(self):
+        """All tickets as a list, in creation order"""
+        return self.ticket_store.all()
         
-        # Format relevant conversation
-        if relevant_conversation:
-            combined_data += "--- RELEVANT CONVERSATION EXAMPLE ---\n"
-            combined_data += relevant_conversation + "\n"
+    def get_tickets(self, **filters):
+        """Get all tickets, optionally filtered by indexed fields (status, priority, category)"""
+        if any(value is not None for value in filters.values()):
+            return self.ticket_store.find(**filters)
+        return self.ticket_store.all()
         
-        return combined_data
+    def query_tickets(self, filters=None, date_from=None, date_to=None, sort=None, offset=0, limit=None):
+        """Filter, sort and page tickets using the store indexes. Returns (tickets, total)."""
+        return self.ticket_store.query(filters, date_from, date_to, sort, offset, limit)
         
-    def get_tickets(self):
-        """Get all tickets"""
-        return self.tickets
+    def query_historical_tickets(self, filters=None, date_from=None, date_to=None, sort=None, offset=0, limit=None):
+        """Filter, sort and page historical tickets using the store indexes. Returns (tickets, total)."""
+        return self.historical_store.query(filters, date_from, date_to, sort, offset, limit)
         
     def get_ticket(self, ticket_id):
         """Get a specific ticket by ID"""
-        for ticket in self.tickets:
-            if ticket.get('id') == ticket_id:
-                return ticket
-        return None
+        return self.ticket_store.get(ticket_id)
         
     def get_ticket_history(self, ticket_id):
-        """Get history for a specific ticket"""
-        # For now, just return the ticket itself as history
+        """Get the recorded history and stored analyses of a ticket"""
         ticket = self.get_ticket(ticket_id)
         if ticket:
+            history = self.ticket_store.events(ticket_id)
+            if not history:
+                # Imported tickets have no recorded creation entry
+                history = [{
+                    "timestamp": ticket.get('createdAt', ''),
+                    "action": "Ticket created",
+                    "details": f"Ticket {ticket_id} was created with subject: {ticket.get('subject', '')}"
+                }]
             return {
                 "ticket": ticket,
-                "history": [
-                    {
-                        "timestamp": ticket.get('createdAt', ''),
-                        "action": "Ticket created",
-                        "details": f"Ticket {ticket_id} was created with subject: {ticket.get('subject', '')}"
-                    }
-                ]
+                "history": history,
+                "analyses": self.ticket_store.analyses(ticket_id)
             }
         return None
+
+    def save_analysis(self, ticket_id, result):
+        """Keep an analysis result with a stored ticket. Returns False if the ticket is unknown."""
+        if ticket_id not in self.ticket_store:
+            return False
+        self.ticket_store.add_analysis(ticket_id, result)
+        return True
         
     def get_knowledge_base(self):
         """Get all knowledge base articles"""
@@ -294,12 +400,57 @@ class DataLoader:
             "priority": ticket_data.get('priority'),
             "status": ticket_data.get('status', 'open'),
             "createdAt": current_time,
+            # When the ticket was really opened; imported tickets carry only a createdAt
+            "openedAt": current_time,
             "updatedAt": current_time,
             "assignedTo": ticket_data.get('assignedTo', None)
         }
+        new_ticket.update(sentiment_fields(self.sentiment_analyzer.analyze_ticket(new_ticket)))
         
-        # Add the ticket to our list
-        self.tickets.append(new_ticket)
+        # Add the ticket to the store, which also updates its indexes
+        with self._write_lock:
+            self.ticket_store.add(new_ticket)
+            self.ticket_store.record_event(ticket_id, "Ticket created",
+                                           f"Ticket {ticket_id} was created with subject: {new_ticket.get('subject') or ''}",
+                                           timestamp=current_time)
+            self.retriever.add_ticket(self._as_historical_record(new_ticket))
+            if self.similarity_index is not None:
+                self.similarity_index.add_document('ticket', ticket_id, self._ticket_text(new_ticket), new_ticket)
         
         print(f"Created new ticket: {ticket_id}")
         return new_ticket
+
+    def update_ticket(self, ticket_id, changes):
+        """Update fields of an existing ticket. Returns the updated ticket or None if not found.
+        Raises ValueError if an updatable field is given a value that is not a string."""
+        allowed = {key: value for key, value in changes.items() if key in UPDATABLE_FIELDS}
+        for key, value in allowed.items():
+            if not isinstance(value, str) and not (value is None and key in NULLABLE_FIELDS):
+                raise ValueError(f"'{key}' must be a string" + (" or null" if key in NULLABLE_FIELDS else ""))
+        if not allowed:
+            return self.ticket_store.get(ticket_id)
+        with self._write_lock:
+            current = self.ticket_store.get(ticket_id)
+            if current is None:
+                return None
+            allowed['updatedAt'] = datetime.now().isoformat()
+            if 'subject' in allowed or 'description' in allowed:
+                allowed.update(sentiment_fields(self.sentiment_analyzer.analyze_ticket(dict(current, **allowed))))
+            resolving = allowed.get('status') in RESOLVED_STATUSES and current.get('status') not in RESOLVED_STATUSES
+            if resolving:
+                allowed['resolvedAt'] = allowed['updatedAt']
+            ticket = self.ticket_store.update(ticket_id, allowed)
+            if ticket:
+                changed = [key for key in UPDATABLE_FIELDS if key in allowed and current.get(key) != ticket.get(key)]
+                if changed:
+                    self.ticket_store.record_event(ticket_id, "Ticket updated",
+                                                   ", ".join(f"{key}: {current.get(key)!r} -> {ticket.get(key)!r}"
+                                                             for key in changed),
+                                                   timestamp=allowed['updatedAt'])
+                if resolving:
+                    self.resolution_model.add_ticket(ticket)
+                self.retriever.add_ticket(self._as_historical_record(ticket))
+                if self.similarity_index is not None:
+                    self.similarity_index.add_document('ticket', ticket_id, self._ticket_text(ticket), ticket)
+                print(f"Updated ticket {ticket_id}: {', '.join(sorted(allowed))}")
+            return ticket
@@ -0,0 +1,525 @@
+"""
+Embedding Index
+---------------
+Semantic similarity search over historical tickets, conversations and tickets.
+Documents are embedded once, through Ollama's embedding API or a local hashing
+embedder, and their vectors are appended to a memory-mapped float32 matrix on disk,
+so a restart only embeds documents that are new or have changed. Queries pick
+candidates from an inverted-file (IVF) index and rank them by exact cosine
+similarity; small collections are simply scanned in full.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+import numpy as np
+from retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+
+# Longer documents are truncated before embedding; the start of a ticket or
+# conversation carries most of its meaning and embedding models have small contexts
+MAX_DOCUMENT_CHARS = 2000
+
+
+class EmbeddingError(Exception):
+    """Raised when documents or queries cannot be embedded"""
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def fingerprint(text):
+    """Identify a document's text so unchanged documents are not embedded again"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class HashingEmbedder:
+    """Local CPU embedder using signed feature hashing of words and word pairs.
+
+    Needs no model download and is deterministic across processes, but only captures
+    shared vocabulary rather than meaning; use it when no embedding model is available.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            features = terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+            for feature in features:
+                digest = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        # Sublinear term frequency so repeated words do not dominate
+        return _normalize(np.sign(vectors) * np.log1p(np.abs(vectors)))
+
+
+class OllamaEmbedder:
+    """Embeds text with an Ollama embedding model"""
+
+    def __init__(self, client, model=DEFAULT_EMBED_MODEL, batch_size=32):
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+        self.name = f"ollama:{model}"
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            try:
+                embedded = self.client.embed(batch, model=self.model)
+            except Exception as e:
+                raise EmbeddingError(f"Ollama embedding with '{self.model}' failed: {str(e)}")
+            if len(embedded) != len(batch):
+                raise EmbeddingError(f"Ollama returned {len(embedded)} embeddings for {len(batch)} texts")
+            vectors.extend(embedded)
+        return _normalize(vectors)
+
+
+class VectorStore:
+    """Append-only matrix of unit vectors, persisted as a raw float32 file.
+
+    `vectors.f32` holds the rows, `documents.jsonl` one {"key", "fingerprint"} line per
+    row and `meta.json` the embedder name and dimension. Rows are only ever appended;
+    a re-embedded document simply supersedes its earlier row. Without a path the
+    vectors are kept in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self.embedder_name = None
+        self.dim = None
+        self.keys = []          # row -> document key
+        self.fingerprints = []  # row -> text fingerprint
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self._buffer = None
+
+    def open(self, embedder_name):
+        """Load persisted vectors made by the same embedder, discarding any others"""
+        self.embedder_name = embedder_name
+        if not self.path:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta_path = self.path / "meta.json"
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        if meta.get("embedder") != embedder_name or not meta.get("dim"):
+            if meta:
+                logger.info("Discarding embeddings made by %s", meta.get("embedder"))
+            for name in ("vectors.f32", "documents.jsonl", "meta.json"):
+                (self.path / name).unlink(missing_ok=True)
+            return
+
+        self.dim = meta["dim"]
+        documents_path = self.path / "documents.jsonl"
+        rows = []
+        if documents_path.exists():
+            with open(documents_path, mode="r", encoding="utf-8") as handle:
+                for line in handle:
+                    try:
+                        rows.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break  # a torn final line from an interrupted write
+        # Only trust rows that are fully present in both files
+        vectors_path = self.path / "vectors.f32"
+        stored = vectors_path.stat().st_size // (4 * self.dim) if vectors_path.exists() else 0
+        rows = rows[:stored]
+        self.keys = [row["key"] for row in rows]
+        self.fingerprints = [row["fingerprint"] for row in rows]
+        self._map()
+
+    def _map(self):
+        if self.keys:
+            self.matrix = np.memmap(self.path / "vectors.f32", dtype=np.float32, mode="r",
+                                    shape=(len(self.keys), self.dim))
+        else:
+            self.matrix = np.zeros((0, self.dim or 0), dtype=np.float32)
+
+    def append(self, keys, fingerprints, vectors):
+        """Append rows and return the row number of the first one"""
+        start = len(self.keys)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise EmbeddingError(f"Embedding dimension changed from {self.dim} to {vectors.shape[1]}")
+
+        if not self.path:
+            # Grow an in-memory buffer geometrically so appends stay amortised O(1)
+            needed = start + len(vectors)
+            if self._buffer is None or len(self._buffer) < needed:
+                buffer = np.zeros((max(needed, 2 * start, 1024), self.dim), dtype=np.float32)
+                if start:
+                    buffer[:start] = self.matrix
+                self._buffer = buffer
+            self._buffer[start:needed] = vectors
+            self.matrix = self._buffer[:needed]
+        else:
+            if start == 0:
+                (self.path / "vectors.f32").unlink(missing_ok=True)
+                (self.path / "documents.jsonl").unlink(missing_ok=True)
+                (self.path / "meta.json").write_text(json.dumps({"embedder": self.embedder_name, "dim": self.dim}))
+            # Vectors first, so a crash never leaves a document line without its row
+            with open(self.path / "vectors.f32", mode="ab") as handle:
+                handle.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self.path / "documents.jsonl", mode="a", encoding="utf-8") as handle:
+                for key, digest in zip(keys, fingerprints):
+                    handle.write(json.dumps({"key": key, "fingerprint": digest}) + "\n")
+        self.keys.extend(keys)
+        self.fingerprints.extend(fingerprints)
+        if self.path:
+            self._map()
+        return start
+
+
+class IVFIndex:
+    """Inverted-file index for approximate cosine search.
+
+    A sample of the vectors is clustered with spherical k-means; every row is filed
+    under its nearest centroid, and a query only scores the rows filed under its
+    `probes` nearest centroids instead of the whole matrix.
+    """
+
+    def __init__(self, vectors, lists=None, probes=32, iterations=8, sample_size=20000, seed=13):
+        rng = np.random.default_rng(seed)
+        count = len(vectors)
+        lists = lists or max(1, min(4096, int(4 * np.sqrt(count))))
+        sample = np.asarray(vectors[np.sort(rng.choice(count, min(count, sample_size), replace=False))])
+        centroids = sample[rng.choice(len(sample), min(lists, len(sample)), replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            # Keep the previous centroid for clusters that lost all their points
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self.probes = probes
+        self.trained_size = count
+        self._lists = [[] for _ in range(len(centroids))]
+        self._arrays = {}  # centroid -> cached np.array of its rows
+        self.add(0, vectors)
+
+    def add(self, start, vectors):
+        """File rows start .. start + len(vectors) under their nearest centroids"""
+        for offset in range(0, len(vectors), 10000):
+            chunk = np.asarray(vectors[offset:offset + 10000])
+            for row, centroid in enumerate(np.argmax(chunk @ self.centroids.T, axis=1).tolist(),
+                                           start + offset):
+                self._lists[centroid].append(row)
+                self._arrays.pop(centroid, None)
+
+    def candidates(self, vector):
+        """Return the rows filed under the centroids nearest to the query"""
+        probes = min(self.probes, len(self.centroids))
+        nearest = np.argpartition(-(self.centroids @ vector), probes - 1)[:probes]
+        arrays = []
+        for centroid in nearest.tolist():
+            rows = self._arrays.get(centroid)
+            if rows is None:
+                rows = self._arrays[centroid] = np.array(self._lists[centroid], dtype=np.int64)
+            arrays.append(rows)
+        return np.sort(np.concatenate(arrays))
+
+
+class SimilarityIndex:
+    """Top-k semantic search over registered documents.
+
+    Documents are registered cheaply with add_document() and embedded in batches
+    by a background thread once start() has been called; searches only see
+    documents that are already embedded and never wait for the rest. Each document
+    has a kind ('historical', 'conversation' or 'ticket') and an ID unique within
+    that kind. After an embedding failure the index backs off exponentially, and
+    searches fail fast with EmbeddingError until the retry time.
+    """
+
+    def __init__(self, embedder, path=None, brute_force_limit=20000, probes=32,
+                 query_cache_size=256, batch_size=256, retry_backoff=5.0, max_backoff=300.0):
+        self.embedder = embedder
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.brute_force_limit = brute_force_limit
+        self.probes = probes
+        self.batch_size = batch_size
+        self.store = VectorStore(path)
+        self.store.open(embedder.name)
+        self.documents = {}   # key -> {"kind", "id", "text", "fingerprint", "record"}
+        self.rows = {}        # key -> current row in the store
+        self.ann = None
+        self._pending = {}    # keys registered but not yet embedded
+        self._query_cache = OrderedDict()
+        self.query_cache_size = query_cache_size
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self.last_error = None
+
+        # Rows restored from disk are matched to documents as they are registered
+        self._stored = {}
+        for row, (key, digest) in enumerate(zip(self.store.keys, self.store.fingerprints)):
+            self._stored[key] = (row, digest)
+        self._row_keys = list(self.store.keys)
+        self._build_ann(0)
+
+    @classmethod
+    def from_env(cls, client, data_dir):
+        """Create an index configured by EMBEDDING_BACKEND, OLLAMA_EMBED_MODEL and
+        EMBEDDING_INDEX_PATH, or return None if EMBEDDING_BACKEND is 'off'"""
+        backend = os.environ.get("EMBEDDING_BACKEND", "ollama").lower()
+        if backend == "off":
+            return None
+        if backend == "hashing":
+            embedder = HashingEmbedder()
+        else:
+            embedder = OllamaEmbedder(client, os.environ.get("OLLAMA_EMBED_MODEL", DEFAULT_EMBED_MODEL))
+        path = os.environ.get("EMBEDDING_INDEX_PATH", str(Path(data_dir) / "embeddings"))
+        return cls(embedder, path=path or None)
+
+    def __len__(self):
+        return len(self.documents)
+
+    @staticmethod
+    def _key(kind, doc_id):
+        return f"{kind}:{doc_id}"
+
+    def add_document(self, kind, doc_id, text, record=None):
+        """Register (or replace) a document; the background thread embeds it"""
+        text = (text or "")[:MAX_DOCUMENT_CHARS]
+        key = self._key(kind, doc_id)
+        digest = fingerprint(text)
+        with self._lock:
+            self.documents[key] = {"kind": kind, "id": doc_id, "fingerprint": digest, "text": text,
+                                   "record": record}
+            stored = self._stored.get(key)
+            if stored and stored[1] == digest:
+                self.rows[key] = stored[0]
+                self._pending.pop(key, None)
+            else:
+                self.rows.pop(key, None)
+                self._pending[key] = None
+                self._wake.set()
+
+    def remove_document(self, kind, doc_id):
+        key = self._key(kind, doc_id)
+        with self._lock:
+            self.documents.pop(key, None)
+            self.rows.pop(key, None)
+            self._pending.pop(key, None)
+
+    def _build_ann(self, start):
+        """Index rows from `start` on, (re)training the IVF index whenever the matrix has doubled"""
+        matrix = self.store.matrix
+        if len(matrix) <= self.brute_force_limit:
+            return
+        if self.ann is None or len(matrix) >= 2 * self.ann.trained_size:
+            started = time.perf_counter()
+            self.ann = IVFIndex(matrix, probes=self.probes)
+            logger.info("Trained IVF index with %d lists over %d vectors in %.3fs",
+                        len(self.ann.centroids), len(matrix), time.perf_counter() - started)
+        else:
+            self.ann.add(start, matrix[start:])
+
+    def start(self):
+        """Embed pending documents on a background thread from now on"""
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._embed_loop, name="embedding", daemon=True)
+                self._worker.start()
+        self._wake.set()
+
+    def _embed_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            started, embedded = time.perf_counter(), 0
+            while True:
+                delay = self._retry_at - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    count = self._embed_batch()
+                except Exception as e:
+                    self._record_failure(e)
+                    continue
+                if not count:
+                    break
+                embedded += count
+            if embedded:
+                logger.info("Embedded %d documents with %s in %.3fs",
+                            embedded, self.embedder.name, time.perf_counter() - started)
+
+    def _record_failure(self, error):
+        with self._lock:
+            self._failures += 1
+            delay = min(self.max_backoff, self.retry_backoff * 2 ** (self._failures - 1))
+            self._retry_at = time.time() + delay
+            self.last_error = str(error)
+        logger.warning("Embedding with %s failed (%d in a row), retrying in %.0fs: %s",
+                       self.embedder.name, self._failures, delay, error)
+
+    def _embed_batch(self):
+        """Embed up to batch_size pending documents and append them to the store.
+        Returns how many were taken, 0 when nothing is pending."""
+        with self._lock:
+            batch = []
+            for key in self._pending:
+                document = self.documents[key]
+                batch.append((key, document["fingerprint"], document["text"]))
+                if len(batch) >= self.batch_size:
+                    break
+        if not batch:
+            return 0
+
+        # Historical exports repeat the same text many times; embed each text once.
+        # The model call runs without the lock so searches carry on meanwhile.
+        unique = {}
+        for _, digest, text in batch:
+            unique.setdefault(digest, text)
+        embedded = dict(zip(unique, self.embedder.embed(list(unique.values()))))
+
+        with self._lock:
+            # Documents removed or replaced while embedding are skipped (replacements stay pending)
+            current = [(key, digest) for key, digest, _ in batch
+                       if key in self._pending and self.documents[key]["fingerprint"] == digest]
+            if current:
+                keys = [key for key, _ in current]
+                digests = [digest for _, digest in current]
+                start = self.store.append(keys, digests, np.stack([embedded[digest] for digest in digests]))
+                for offset, key in enumerate(keys):
+                    self.rows[key] = start + offset
+                    self._stored[key] = (start + offset, digests[offset])
+                    self._pending.pop(key, None)
+                self._row_keys.extend(keys)
+                self._build_ann(start)
+            self._failures = 0
+            self._retry_at = 0.0
+            self.last_error = None
+        return len(batch)
+
+    def sync(self):
+        """Embed every pending document now, in the calling thread. Raises EmbeddingError on failure."""
+        total = 0
+        while True:
+            count = self._embed_batch()
+            if not count:
+                return total
+            total += count
+
+    def _embed_query(self, text):
+        text = (text or "")[:MAX_DOCUMENT_CHARS]
+        key = fingerprint(text)
+        with self._lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                return vector
+        vector = self.embedder.embed([text])[0]
+        with self._lock:
+            self._query_cache[key] = vector
+            if len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def search(self, text, k=5, kinds=None, exclude=(), unique_ids=False):
+        """Return up to k {"id", "type", "score", "record"} matches for a text, best first.
+        Only documents embedded so far are searched.
+
+        `kinds` limits results to some document kinds and `exclude` is a list of
+        (kind, id) pairs to leave out, such as the query ticket itself. With
+        `unique_ids` only the best match per ID is kept, for documents indexed
+        under several kinds (a bundled ticket is also a historical row).
+        """
+        retry_in = self._retry_at - time.time()
+        if retry_in > 0:
+            raise EmbeddingError(f"Embedding is unavailable, retrying in {retry_in:.0f}s: {self.last_error}")
+        try:
+            vector = self._embed_query(text)
+        except EmbeddingError as e:
+            self._record_failure(e)
+            raise
+        excluded = {self._key(kind, doc_id) for kind, doc_id in exclude}
+        with self._lock:
+            matrix = self.store.matrix
+            if not len(matrix):
+                return []
+            rows = None
+            if self.ann is not None:
+                rows = self.ann.candidates(vector)
+                # Too few candidates to trust; fall back to an exact scan
+                if len(rows) < 4 * (k + len(excluded)):
+                    rows = None
+            if rows is None:
+                scores = np.asarray(matrix) @ vector
+                rows = np.arange(len(scores))
+            else:
+                scores = np.asarray(matrix[rows]) @ vector
+
+            results = []
+            seen_ids = set()
+            for position in self._ranked(scores, 8 * (k + len(excluded)) + 64):
+                row = int(rows[position])
+                key = self._row_keys[row]
+                # Skip rows superseded by a newer embedding and removed documents
+                if self.rows.get(key) != row or key in excluded:
+                    continue
+                document = self.documents[key]
+                if kinds and document["kind"] not in kinds:
+                    continue
+                if unique_ids:
+                    if document["id"] in seen_ids:
+                        continue
+                    seen_ids.add(document["id"])
+                results.append({
+                    "id": document["id"],
+                    "type": document["kind"],
+                    "score": round(float(scores[position]), 4),
+                    "record": document["record"]
+                })
+                if len(results) >= k:
+                    break
+            return results
+
+    @staticmethod
+    def _ranked(scores, head):
+        """Yield positions by descending score, partially sorting only the first `head`"""
+        if head >= len(scores):
+            yield from np.argsort(-scores)
+            return
+        top = np.argpartition(-scores, head)[:head]
+        yield from top[np.argsort(-scores[top])]
+        # Rarely needed: filters or superseded rows consumed the whole head
+        rest = np.ones(len(scores), dtype=bool)
+        rest[top] = False
+        remaining = np.flatnonzero(rest)
+        yield from remaining[np.argsort(-scores[remaining])]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "embedder": self.embedder.name,
+                "documents": len(self.documents),
+                "pending": len(self._pending),
+                "last_error": self.last_error,
+                "retry_in": round(max(0.0, self._retry_at - time.time()), 1),
+                "stored_rows": len(self.store.keys),
+                "dim": self.store.dim,
+                "ann": self.ann is not None,
+                "persistent": self.store.path is not None
+            }
@@ -0,0 +1,98 @@
+"""
+Historical Context
+------------------
+Typed historical context handed from the DataLoader to the API and the agents.
+Conversation examples are parsed once at load time into their header fields and
+Customer/Agent turns, and a ticket's context is the ranked historical ticket
+records plus the parsed conversations, so agents render what they need straight
+from the structure instead of re-parsing formatted text.
+"""
+
+SPEAKERS = ('Customer', 'Agent')
+
+
+class Conversation:
+    """A support conversation example split into header fields and speaker turns"""
+
+    def __init__(self, category, fields=None, turns=()):
+        self.category = category
+        self.fields = dict(fields or {})  # e.g. {'Conversation ID': 'TECH_001', 'Priority': 'High'}
+        self.turns = [tuple(turn) for turn in turns]  # [(speaker, text)]
+        # Each Agent turn that answers the Customer turn right before it
+        self.exchanges = [(previous[1], turn[1]) for previous, turn in zip(self.turns, self.turns[1:])
+                          if previous[0] == 'Customer' and turn[0] == 'Agent']
+
+    @classmethod
+    def parse(cls, category, content):
+        """Parse a conversation file: 'Key: value' header lines, then 'Customer:'/'Agent:' turns.
+
+        Header lines may hold several fields separated by '|'. Lines without a
+        speaker prefix after the first turn continue the previous turn.
+        """
+        fields = {}
+        turns = []
+        for line in content.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            speaker, separator, text = line.partition(':')
+            if separator and speaker in SPEAKERS:
+                turns.append([speaker, text.strip()])
+            elif turns:
+                turns[-1][1] = f"{turns[-1][1]} {line}"
+            else:
+                for part in line.split('|'):
+                    key, separator, value = part.partition(':')
+                    if separator:
+                        fields[key.strip()] = value.strip()
+        return cls(category, fields, turns)
+
+    def to_dict(self):
+        return {"category": self.category, "fields": self.fields,
+                "turns": [{"speaker": speaker, "text": text} for speaker, text in self.turns]}
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError("Each conversation must be an object")
+        if not isinstance(data.get('fields') or {}, dict):
+            raise ValueError("Conversation 'fields' must be an object")
+        turns = [(turn.get('speaker', ''), turn.get('text', '')) for turn in _objects(data.get('turns'), 'turns')]
+        if not turns and data.get('content'):
+            return cls.parse(data.get('category', ''), data['content'])
+        return cls(data.get('category', ''), data.get('fields'), turns)
+
+
+class HistoricalContext:
+    """Historical tickets (best match first) and conversation examples relevant to a ticket"""
+
+    def __init__(self, tickets=(), conversations=()):
+        self.tickets = list(tickets)
+        self.conversations = list(conversations)
+
+    def __bool__(self):
+        return bool(self.tickets or self.conversations)
+
+    def solutions(self):
+        """Return (ticket ID, issue category, solution) for each historical ticket"""
+        return [(record.get('Ticket ID', 'Unknown'), record.get('Issue Category', 'Unknown'),
+                 record.get('Solution', 'No solution recorded')) for record in self.tickets]
+
+    def to_dict(self):
+        return {"tickets": self.tickets,
+                "conversations": [conversation.to_dict() for conversation in self.conversations]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a context from its JSON form, as sent by API callers.
+        Raises ValueError if it is not shaped like to_dict() output."""
+        conversations = _objects(data.get('conversations'), 'conversations')
+        return cls(_objects(data.get('tickets'), 'tickets'), [Conversation.from_dict(item) for item in conversations])
+
+
+def _objects(value, name):
+    """Return a JSON list of objects, or [] if it is missing"""
+    value = value or []
+    if not isinstance(value, list) or not all(isinstance(item, dict) for item in value):
+        raise ValueError(f"'{name}' must be a list of objects")
+    return value
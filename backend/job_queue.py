@@ -0,0 +1,149 @@
+"""
+Job Queue
+---------
+Bounded background queue for ticket analysis.
+Requests are enqueued onto a fixed worker pool and return a job ID straight away;
+results are kept for a retention window so clients can poll for them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds the maximum number of waiting jobs"""
+
+
+class Job:
+    """A single ticket analysis request and its outcome"""
+
+    def __init__(self, key, ticket, historical_context=None, mode=None):
+        self.id = str(uuid.uuid4())
+        self.key = key
+        self.ticket = ticket
+        self.historical_context = historical_context
+        self.mode = mode
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "failed")
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "ticketId": self.ticket.get('id'),
+            "status": self.status,
+            "mode": self.mode,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+def make_job_key(ticket, historical_context=None, mode=None):
+    """Identify identical analysis requests so they can share one job"""
+    if hasattr(historical_context, 'to_dict'):
+        historical_context = historical_context.to_dict()
+    payload = json.dumps({"ticket": ticket, "context": historical_context, "mode": mode},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    """Runs AgentService.process_ticket on a bounded worker pool"""
+
+    def __init__(self, agent_service, workers=None, max_depth=None, retention=None, save_result=None):
+        self.agent_service = agent_service
+        # Optional save_result(ticket_id, result), called for each successful analysis
+        self.save_result = save_result
+        self.workers = workers or int(os.environ.get("JOB_WORKERS", "4"))
+        self.max_depth = max_depth or int(os.environ.get("JOB_QUEUE_SIZE", "100"))
+        self.retention = retention or float(os.environ.get("JOB_RETENTION", "3600"))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._inflight = {}  # job key -> job for queued/running jobs
+        self._lock = threading.Lock()
+
+    def submit(self, ticket, historical_context=None, mode=None):
+        """Enqueue a ticket for analysis.
+
+        Returns (job, created). If the same request is already queued or running
+        the existing job is returned with created=False. Raises QueueFullError when
+        the number of waiting jobs has reached max_depth.
+        """
+        key = make_job_key(ticket, historical_context, mode)
+        with self._lock:
+            self._prune()
+            existing = self._inflight.get(key)
+            if existing is not None:
+                return existing, False
+
+            queued = sum(1 for job in self._inflight.values() if job.status == "queued")
+            if queued >= self.max_depth:
+                raise QueueFullError(f"Job queue is full ({queued} jobs waiting)")
+
+            job = Job(key, ticket, historical_context, mode)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+
+        self.executor.submit(self._run, job)
+        return job, True
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        result, error, failed = None, None, False
+        try:
+            result = self.agent_service.process_ticket(job.ticket, job.historical_context, mode=job.mode)
+            if "error" in result:
+                failed, error = True, result["error"]
+            elif self.save_result is not None:
+                self.save_result(job.ticket.get('id'), result)
+        except Exception as e:
+            print(f"Error running job {job.id}: {str(e)}")
+            print(traceback.format_exc())
+            failed, error = True, str(e)
+        # Publish the outcome together so _prune never sees a finished job without finished_at
+        with self._lock:
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            job.status = "failed" if failed else "completed"
+            self._inflight.pop(job.key, None)
+
+    def _prune(self):
+        """Drop finished jobs older than the retention window. Caller holds the lock."""
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Return the job with the given ID, or None if unknown or expired"""
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """Return queue depth and job counts"""
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            counts.update({"workers": self.workers, "max_depth": self.max_depth})
+            return counts
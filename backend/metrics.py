@@ -0,0 +1,216 @@
+"""
+Metrics
+-------
+In-process counters, gauges and histograms, served at /metrics in the Prometheus
+text exposition format. Recording a value is a tuple lookup and an addition under
+the metric's lock, so the request, agent and Ollama paths can record on every
+call. Figures other components already keep (LLM cache hits, job queue depth) are
+read through callbacks when /metrics is scraped rather than mirrored on every update.
+"""
+
+from bisect import bisect_left
+import math
+import threading
+
+# Histogram bucket upper bounds in seconds, from fast local agents to slow generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with a fixed set of label names"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        try:
+            return tuple(str(labels[name]) for name in self.labelnames)
+        except KeyError as e:
+            raise ValueError(f"Metric {self.name} needs label {e}")
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for rendering"""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels(self.labelnames, key, extra)} {_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield '_bucket', key, (('le', _number(float(bound))),), cumulative
+            yield '_sum', key, (), round(total, 6)
+            yield '_count', key, (), count
+
+
+class CallbackMetric(Metric):
+    """A metric whose values are read from `func` at scrape time.
+
+    `func` returns a number, or {label value tuple: number} when the metric has labels.
+    """
+
+    def __init__(self, name, documentation, kind, func, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.func = func
+
+    def samples(self):
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            if value is not None:
+                yield '', tuple(key), (), value
+
+
+class Registry:
+    """The metrics served by one process"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, or return the one already registered under its name.
+        Callback metrics replace an earlier registration, so the latest component wins."""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, CallbackMetric):
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                # A failing callback must not take the other metrics down with it
+                parts.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(parts) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def callback(name, documentation, kind, func, labelnames=()):
+    return REGISTRY.register(CallbackMetric(name, documentation, kind, func, labelnames))
+
+
+HTTP_REQUESTS = counter('http_requests_total', 'HTTP requests by method, route and status code',
+                        ('method', 'route', 'status'))
+HTTP_SECONDS = histogram('http_request_duration_seconds', 'Time until the response starts, by method and route',
+                         ('method', 'route'))
+
+AGENT_SECONDS = histogram('agent_duration_seconds', 'Run time of each agent graph node', ('agent',))
+AGENT_FALLBACKS = counter('agent_fallbacks_total',
+                          'Agent results replaced by default values, by agent and reason', ('agent', 'reason'))
+FUSED_SECTION_FALLBACKS = counter('fused_section_fallbacks_total',
+                                  'Fused response sections that failed validation and were re-run', ('section',))
+
+OLLAMA_REQUESTS = counter('ollama_requests_total', 'Ollama generations by outcome (ok, error or cached)',
+                          ('outcome',))
+OLLAMA_RETRIES = counter('ollama_retries_total', 'Ollama requests retried after a connection or gateway error')
+OLLAMA_IN_FLIGHT = gauge('ollama_in_flight', 'Generations queued for a slot or waiting on an Ollama response')
+OLLAMA_TOKENS = counter('ollama_tokens_total', 'Tokens reported by Ollama, by phase (prompt or eval)', ('phase',))
+OLLAMA_SECONDS = histogram('ollama_duration_seconds',
+                           'Per-call durations reported by Ollama, by phase (prompt_eval, eval, load, total)',
+                           ('phase',))
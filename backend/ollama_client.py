@@ -0,0 +1,507 @@
+"""
+Ollama Client
+-------------
+Shared HTTP client for the Ollama API used by every agent.
+Keeps a pool of keep-alive connections, applies consistent connect/read timeouts,
+retries transient failures with exponential backoff, and owns the single
+JSON extraction path for model responses.
+The model is kept loaded between calls (keep_alive) and system prompts always go
+in the request's system slot, ahead of the prompt, so the server can reuse the
+evaluated prefix; Ollama's prompt-eval and generation timings are recorded per call.
+agenerate() is the non-blocking counterpart of generate() for the ASGI server: it
+uses an httpx.AsyncClient and an asyncio semaphore, and shares the cache, payloads,
+timing collection and the OLLAMA_MAX_CONCURRENCY slots with the blocking path.
+"""
+
+import asyncio
+from collections import deque
+import json
+import os
+import textwrap
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import lru_cache
+import requests
+from requests.adapters import HTTPAdapter
+from llm_cache import make_cache_key
+import tracing
+from metrics import OLLAMA_REQUESTS, OLLAMA_RETRIES, OLLAMA_IN_FLIGHT, OLLAMA_TOKENS, OLLAMA_SECONDS
+
+# Status codes that indicate the server is temporarily unable to answer
+RETRY_STATUS_CODES = {502, 503, 504}
+
+OLLAMA_APIS = ('generate', 'chat')
+
+# Ollama reports these durations in nanoseconds on the final response of a call
+TIMING_FIELDS = {
+    'prompt_eval_duration': 'prompt_eval_ms',
+    'eval_duration': 'eval_ms',
+    'load_duration': 'load_ms',
+    'total_duration': 'total_ms',
+}
+COUNT_FIELDS = {'prompt_eval_count': 'prompt_tokens', 'eval_count': 'eval_tokens'}
+
+
+@lru_cache(maxsize=64)
+def clean_system_prompt(system):
+    """Strip the source indentation of a system prompt so every call sends the same prefix"""
+    return textwrap.dedent(system).strip()
+
+
+def call_timings(data):
+    """Extract token counts and millisecond timings from a final Ollama response"""
+    timings = {name: data[field] for field, name in COUNT_FIELDS.items() if field in data}
+    timings.update({name: round(data[field] / 1e6, 2) for field, name in TIMING_FIELDS.items() if field in data})
+    return timings
+
+
+def summarize_timings(calls):
+    """Sum the per-call timings of several generations"""
+    summary = {"calls": len(calls)}
+    for call in calls:
+        for name, value in call.items():
+            summary[name] = round(summary.get(name, 0) + value, 2)
+    return summary
+
+
+class _GenerationSlots:
+    """Counting semaphore shared by threads and asyncio tasks.
+
+    Caps generations in flight across the blocking and async paths together.
+    Waiters of either kind are served in arrival order; async waiters never block
+    their event loop.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._free = limit
+        self._lock = threading.Lock()
+        self._waiters = deque()  # threading.Event, or (loop, future) for async waiters
+
+    def acquire(self):
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        # release() hands its slot straight to the waiter it wakes
+        event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                handed_over = waiter not in self._waiters
+                if not handed_over:
+                    self._waiters.remove(waiter)
+            # A slot handed over as the task was cancelled goes to the next waiter
+            if handed_over:
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(_wake, future)
+                    return
+                except RuntimeError:
+                    continue  # its event loop has closed
+            self._free += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class OllamaClient:
+    """Pooled, retrying client for the Ollama generate and embedding APIs"""
+
+    def __init__(self, ollama_url, model, pool_size=None, connect_timeout=None,
+                 read_timeout=None, max_retries=None, backoff=None, cache=None, max_concurrency=None,
+                 keep_alive=None, api=None, async_concurrency=None):
+        self.ollama_url = ollama_url.rstrip('/')
+        self.model = model
+        self.cache = cache
+        # How long the server keeps the model loaded after a call; empty leaves the server default
+        self.keep_alive = keep_alive if keep_alive is not None else os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+        self.api = api or os.environ.get("OLLAMA_API", "generate")
+        if self.api not in OLLAMA_APIS:
+            raise ValueError(f"Unknown Ollama API '{self.api}', expected one of: {', '.join(OLLAMA_APIS)}")
+        self.pool_size = pool_size or int(os.environ.get("OLLAMA_POOL_SIZE", "16"))
+        self.connect_timeout = connect_timeout or float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = read_timeout or float(os.environ.get("OLLAMA_READ_TIMEOUT", "120"))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get("OLLAMA_MAX_RETRIES", "2"))
+        self.backoff = backoff if backoff is not None else float(os.environ.get("OLLAMA_RETRY_BACKOFF", "0.5"))
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(
+            os.environ.get("OLLAMA_MAX_CONCURRENCY", "0"))
+
+        # In-flight cap for agenerate() on its event loop; OLLAMA_MAX_CONCURRENCY still bounds
+        # blocking and async generations together
+        self.async_concurrency = async_concurrency or int(os.environ.get("OLLAMA_ASYNC_CONCURRENCY", "256"))
+        if self.max_concurrency > 0:
+            self.async_concurrency = min(self.async_concurrency, self.max_concurrency)
+
+        # Caps the number of generations in flight against the server, from threads and
+        # asyncio tasks alike; 0 means unlimited
+        self._slots = _GenerationSlots(self.max_concurrency) if self.max_concurrency > 0 else None
+
+        # Call timings collected by the current thread or asyncio task, plus running totals
+        self._calls = ContextVar(f"ollama_calls_{id(self)}", default=None)
+        self._timings_lock = threading.Lock()
+        self._totals = {}
+        # Whether the latest generation of the current thread or asyncio task came from the cache
+        self._from_cache = ContextVar(f"ollama_from_cache_{id(self)}", default=False)
+
+        # One session shared by all agents; the adapter keeps up to pool_size
+        # connections open and blocks instead of opening extra ones
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Created on first use inside the serving event loop (see agenerate)
+        self._async_client = None
+        self._async_slots = None
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def _post(self, path, payload, stream=False):
+        """POST to the Ollama API, retrying connection errors and 5xx gateway errors"""
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(f"{self.ollama_url}{path}", json=payload,
+                                             timeout=self.timeout, stream=stream)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    try:
+                        response.raise_for_status()
+                    except requests.HTTPError:
+                        response.close()
+                        raise
+                    return response
+                # Streamed responses hold their pooled connection until closed
+                response.close()
+                last_error = requests.HTTPError(f"Ollama API returned status code {response.status_code}")
+            except (requests.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                last_error = e
+            if attempt < self.max_retries:
+                OLLAMA_RETRIES.inc()
+                time.sleep(self.backoff * (2 ** attempt))
+        raise last_error
+
+    def _prepare(self, prompt, system, model, options, use_cache, stream):
+        """Return (cache key, cached text, request payload) for a generation"""
+        model = model or self.model
+        system = clean_system_prompt(system) if system else None
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = make_cache_key(model, system, prompt, options)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cache_key, cached, None
+
+        payload = {"model": model, "stream": stream}
+        if self.api == 'chat':
+            messages = [{"role": "system", "content": system}] if system else []
+            payload["messages"] = messages + [{"role": "user", "content": prompt}]
+        else:
+            payload["prompt"] = prompt
+            if system:
+                payload["system"] = system
+        if options:
+            payload["options"] = options
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        return cache_key, None, payload
+
+    @tracing.traced('ollama.generate')
+    def generate(self, prompt, system=None, model=None, options=None, use_cache=True, on_token=None):
+        """Run a generation and return the full response text, or None on failure.
+
+        If `on_token` is given the generation is streamed from Ollama and each
+        chunk of text is passed to it as soon as it arrives.
+        """
+        cache_key, cached, payload = self._prepare(prompt, system, model, options, use_cache, on_token is not None)
+        self._from_cache.set(cached is not None)
+        if cached is not None:
+            OLLAMA_REQUESTS.inc(outcome='cached')
+            tracing.set_attributes(cached=True)
+            if on_token:
+                on_token(cached)
+            return cached
+
+        complete = True
+        OLLAMA_IN_FLIGHT.inc()
+        try:
+            with self._slots or nullcontext():
+                if on_token:
+                    text, complete = self._read_stream(self._post(f"/api/{self.api}", payload, stream=True),
+                                                       on_token)
+                else:
+                    data = self._post(f"/api/{self.api}", payload).json()
+                    text = self._response_text(data)
+                    self._record_timings(data)
+        except Exception as e:
+            print(f"Error calling Ollama: {str(e)}")
+            OLLAMA_REQUESTS.inc(outcome='error')
+            return None
+        finally:
+            OLLAMA_IN_FLIGHT.dec()
+        OLLAMA_REQUESTS.inc(outcome='ok')
+
+        # Only successful, non-empty generations are worth caching; a stream cut off
+        # before its done chunk is a truncated answer
+        if cache_key and text and complete:
+            self.cache.set(cache_key, text)
+        return text
+
+    def _async_session(self):
+        if self._async_client is None:
+            import httpx
+            timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+            # One connection per in-flight generation; waiting on the server costs no thread
+            limits = httpx.Limits(max_connections=self.async_concurrency,
+                                  max_keepalive_connections=self.pool_size)
+            self._async_client = httpx.AsyncClient(timeout=timeout, limits=limits)
+            self._async_slots = asyncio.BoundedSemaphore(self.async_concurrency)
+        return self._async_client
+
+    async def _apost(self, path, payload):
+        """Async POST with the same retry policy as _post"""
+        import httpx
+        client = self._async_session()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.post(f"{self.ollama_url}{path}", json=payload)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+                last_error = httpx.HTTPStatusError(f"Ollama API returned status code {response.status_code}",
+                                                   request=response.request, response=response)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                last_error = e
+            if attempt < self.max_retries:
+                OLLAMA_RETRIES.inc()
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+        raise last_error
+
+    @tracing.traced('ollama.generate')
+    async def agenerate(self, prompt, system=None, model=None, options=None, use_cache=True):
+        """Run a generation without blocking the event loop. Returns the text, or None on failure."""
+        cache_key, cached, payload = self._prepare(prompt, system, model, options, use_cache, False)
+        self._from_cache.set(cached is not None)
+        if cached is not None:
+            OLLAMA_REQUESTS.inc(outcome='cached')
+            tracing.set_attributes(cached=True)
+            return cached
+
+        OLLAMA_IN_FLIGHT.inc()
+        try:
+            self._async_session()
+            async with self._async_slots, self._slots or nullcontext():
+                data = (await self._apost(f"/api/{self.api}", payload)).json()
+            text = self._response_text(data)
+            self._record_timings(data)
+        except Exception as e:
+            print(f"Error calling Ollama: {str(e)}")
+            OLLAMA_REQUESTS.inc(outcome='error')
+            return None
+        finally:
+            OLLAMA_IN_FLIGHT.dec()
+        OLLAMA_REQUESTS.inc(outcome='ok')
+
+        if cache_key and text:
+            self.cache.set(cache_key, text)
+        return text
+
+    @staticmethod
+    def _response_text(data):
+        """Text of a generate response or chunk, or of a chat message"""
+        if "message" in data:
+            return (data["message"] or {}).get("content", "")
+        return data.get("response", "")
+
+    def _read_stream(self, response, on_token):
+        """Consume a streamed generation, forwarding chunks. Returns the joined text and
+        whether the stream reached its done chunk."""
+        chunks = []
+        complete = False
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                chunk = self._response_text(data)
+                if chunk:
+                    chunks.append(chunk)
+                    on_token(chunk)
+                if data.get("done"):
+                    self._record_timings(data)
+                    complete = True
+                    break
+        return "".join(chunks), complete
+
+    def _record_timings(self, data):
+        timings = call_timings(data)
+        if not timings:
+            return
+        for field, phase in (('prompt_eval_count', 'prompt'), ('eval_count', 'eval')):
+            if field in data:
+                OLLAMA_TOKENS.inc(data[field], phase=phase)
+        for field in TIMING_FIELDS:
+            if field in data:
+                OLLAMA_SECONDS.observe(data[field] / 1e9, phase=field[:-len('_duration')])
+        if tracing.current_span() is not None:
+            tracing.set_attributes(**timings)
+            self._trace_phases(data)
+        calls = self._calls.get()
+        if calls is not None:
+            calls.append(timings)
+        with self._timings_lock:
+            for name, value in dict(timings, calls=1).items():
+                self._totals[name] = round(self._totals.get(name, 0) + value, 2)
+
+    @staticmethod
+    def _trace_phases(data):
+        """Add Ollama's reported phases to the current span, back to back and ending now.
+        The rest of the span is time spent queueing, on the network or in this process."""
+        current = tracing.current_span()
+        end = time.time_ns()
+        for field in ('eval_duration', 'prompt_eval_duration', 'load_duration'):
+            if field in data:
+                current.child('ollama.' + field[:-len('_duration')], start_ns=end - data[field], end_ns=end)
+                end -= data[field]
+        if 'total_duration' in data:
+            outside = time.time_ns() - current.start_ns - data['total_duration']
+            tracing.set_attributes(outside_ollama_ms=round(max(0, outside) / 1e6, 2))
+
+    @contextmanager
+    def collect_timings(self):
+        """Collect the timings of the generations made inside the block by this thread or task.
+
+        Yields a list that receives one dict per generation (token counts and
+        millisecond durations as reported by Ollama); cached answers add nothing.
+        """
+        previous = self._calls.get()
+        calls = []
+        token = self._calls.set(calls)
+        try:
+            yield calls
+        finally:
+            self._calls.reset(token)
+            if previous is not None:
+                previous.extend(calls)
+
+    def last_from_cache(self):
+        """Whether the latest generate()/agenerate() in this thread or task was answered from the cache"""
+        return self._from_cache.get()
+
+    def timing_stats(self):
+        """Return totals of the timings reported by Ollama since startup"""
+        with self._timings_lock:
+            return dict(self._totals)
+
+    def generate_json(self, prompt, system=None, model=None, options=None):
+        """Run a generation and parse the response as JSON. Raises ValueError on failure."""
+        response = self.generate(prompt, system=system, model=model, options=options)
+        if not response:
+            raise ValueError("No response from Ollama")
+        return parse_json_response(response)
+
+    def embed(self, texts, model=None):
+        """Return one embedding vector per text. Raises on failure."""
+        model = model or self.model
+        with self._slots or nullcontext():
+            try:
+                payload = {"model": model, "input": list(texts)}
+                if self.keep_alive:
+                    payload["keep_alive"] = self.keep_alive
+                response = self._post("/api/embed", payload)
+                return response.json()["embeddings"]
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+            # Older Ollama versions only have the one-prompt-per-call endpoint
+            return [self._post("/api/embeddings", {"model": model, "prompt": text}).json()["embedding"]
+                    for text in texts]
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+def parse_json_response(response):
+    """Extract a JSON object from a model response.
+
+    Handles markdown code fences and leading/trailing chatter around the object.
+    Raises ValueError if no JSON object can be recovered.
+    """
+    if isinstance(response, dict):
+        return response
+    if not isinstance(response, str):
+        raise ValueError(f"Unexpected response type: {type(response).__name__}")
+
+    text = response.strip()
+    if text.startswith("```"):
+        text = text[3:]
+        if text.lower().startswith("json"):
+            text = text[4:]
+    if text.endswith("```"):
+        text = text[:-3]
+    text = text.strip()
+
+    try:
+        result = json.loads(text)
+    except json.JSONDecodeError:
+        # Fall back to the outermost {...} block in the text
+        start = text.find("{")
+        end = text.rfind("}")
+        if start == -1 or end <= start:
+            raise ValueError("Response does not contain a JSON object")
+        try:
+            result = json.loads(text[start:end + 1])
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in response: {e}")
+
+    if not isinstance(result, dict):
+        raise ValueError("Response JSON is not an object")
+    return result
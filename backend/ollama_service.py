@@ -3,7 +3,7 @@ import requests
 from flask import jsonify
 import traceback
 
-def check_ollama_connection(ollama_url, data_loader):
+def check_ollama_connection(ollama_url, data_loader, cache_stats=None, routing_stats=None, llm_timings=None):
     """Check if Ollama is accessible and return status information"""
     try:
         print(f"Checking Ollama connection at {ollama_url}")
@@ -18,14 +18,20 @@ def check_ollama_connection(ollama_url, data_loader):
                 "ollama_connected": True,
                 "models": models,
                 "historical_tickets": len(data_loader.historical_tickets),
-                "conversations": len(data_loader.conversations)
+                "conversations": len(data_loader.conversations),
+                "llm_cache": cache_stats,
+                "routing_model": routing_stats,
+                "llm_timings": llm_timings
             })
         else:
             print(f"Ollama API returned status code {response.status_code}")
             return jsonify({
                 "status": "warning",
                 "ollama_connected": False,
-                "message": f"Ollama API returned status code {response.status_code}"
+                "message": f"Ollama API returned status code {response.status_code}",
+                "llm_cache": cache_stats,
+                "routing_model": routing_stats,
+                "llm_timings": llm_timings
             })
     except Exception as e:
         print(f"Error connecting to Ollama: {str(e)}")
@@ -33,5 +39,8 @@ def check_ollama_connection(ollama_url, data_loader):
         return jsonify({
             "status": "error",
             "ollama_connected": False,
-            "message": str(e)
+            "message": str(e),
+            "llm_cache": cache_stats,
+                "routing_model": routing_stats,
+                "llm_timings": llm_timings
         }), 500
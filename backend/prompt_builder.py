@@ -0,0 +1,197 @@
+"""
+Prompt Builder
+--------------
+Shared prompt assembly for the LLM-backed agents.
+Historical context arrives as a HistoricalContext (ranked historical ticket
+records and parsed conversation examples) and is rendered once per ticket into
+blocks with estimated token counts. Each agent then takes the best-ranked blocks that fit its
+own token budget, so long histories no longer inflate prompt evaluation time, and
+the rendered context is reused by every agent working on the same ticket.
+"""
+
+from collections import namedtuple
+import math
+import textwrap
+import threading
+from historical_context import HistoricalContext
+
+# Rough characters per token for English text with Llama-style tokenizers
+CHARS_PER_TOKEN = 4
+
+NO_CONTEXT = "No historical context available"
+
+# budget: context tokens; ticket_style: 'full' blocks or one-line 'solution' entries;
+# conversation: include the example; exchanges_only: keep only Customer/Agent pairs
+ContextProfile = namedtuple('ContextProfile', 'budget ticket_style conversation exchanges_only')
+
+CONTEXT_PROFILES = {
+    'summarizer': ContextProfile(700, 'full', True, False),
+    'time_estimator': ContextProfile(250, 'full', False, False),
+    'recommendations': ContextProfile(500, 'solution', True, True),
+    'fused': ContextProfile(900, 'full', True, False),
+}
+
+# Ticket fields shown in prompts, as (key, label, default)
+TICKET_FIELDS = {
+    'subject': ('subject', 'Subject', 'No Subject'),
+    'description': ('description', 'Description', 'No Description'),
+    'category': ('category', 'Category', 'unknown'),
+    'priority': ('priority', 'Priority', 'medium'),
+    'status': ('status', 'Status', 'open'),
+}
+
+
+def estimate_tokens(text):
+    """Approximate the number of model tokens in a text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def render_ticket(ticket, fields=('subject', 'description')):
+    """Render the ticket header shared by every agent prompt"""
+    lines = [f"Ticket #{ticket.get('id', 'Unknown')}"]
+    for field in fields:
+        if field == 'customer':
+            lines.append(f"From: {_text(ticket.get('customerName'), 'Unknown Customer')} "
+                         f"({_text(ticket.get('customerEmail'), 'No email')})")
+            continue
+        key, label, default = TICKET_FIELDS[field]
+        lines.append(f"{label}: {_text(ticket.get(key), default)}")
+    return "\n".join(lines)
+
+
+def _text(value, default):
+    return str(value).strip() if value else default
+
+
+def _ticket_block(index, record):
+    return (f"Case #{index}: {record.get('Ticket ID', 'Unknown')}\n"
+            f"Issue: {record.get('Issue Category', 'Unknown')}\n"
+            f"Customer Sentiment: {record.get('Sentiment', 'Unknown')}\n"
+            f"Priority: {record.get('Priority', 'Unknown')}\n"
+            f"Solution: {record.get('Solution', 'No solution recorded')}\n"
+            f"Status: {record.get('Resolution Status', 'Unknown')}\n")
+
+
+def _solution_line(index, solution):
+    ticket_id, issue, text = solution
+    return f"{index}. For {issue}: {text} (case {ticket_id})\n"
+
+
+def _conversation_chunks(conversation, exchanges_only):
+    """Render a conversation as a list of chunks that can be cut at chunk boundaries"""
+    if exchanges_only:
+        return [f"Customer: {customer}\nAgent: {agent}\n" for customer, agent in conversation.exchanges]
+    fields = " | ".join(f"{key}: {value}" for key, value in conversation.fields.items())
+    chunks = [f"{fields}\n"] if fields else []
+    return chunks + [f"{speaker}: {text}\n" for speaker, text in conversation.turns]
+
+
+class PromptContext:
+    """Historical context for one ticket, rendered lazily per agent profile.
+
+    `data` is None, a HistoricalContext as returned by DataLoader.get_context_for_ticket,
+    its JSON form, or a preformatted string (as sent by some API callers). Anything
+    else raises ValueError.
+    """
+
+    def __init__(self, data=None):
+        if isinstance(data, dict):
+            data = HistoricalContext.from_dict(data)
+        elif data is not None and not isinstance(data, (str, HistoricalContext)):
+            raise ValueError("historical_context must be an object or a string")
+        self.data = data
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, context):
+        """Wrap raw context, passing through an existing PromptContext unchanged"""
+        return context if isinstance(context, cls) else cls(context)
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def render(self, profile_name, budget=None):
+        """Return the context text for an agent profile, within its token budget"""
+        profile = CONTEXT_PROFILES[profile_name]
+        budget = profile.budget if budget is None else budget
+        key = (profile_name, budget)
+        with self._lock:
+            text = self._rendered.get(key)
+        if text is None:
+            text = self._render(profile, budget) or NO_CONTEXT
+            with self._lock:
+                self._rendered[key] = text
+        return text
+
+    def _render(self, profile, budget):
+        if not self.data:
+            return ""
+        if isinstance(self.data, str):
+            return self._truncate_lines(self.data.strip().split("\n"), budget)
+
+        parts = []
+        remaining = budget
+        if self.data.tickets:
+            solution_style = profile.ticket_style == 'solution'
+            header = "Historical Solutions:\n" if solution_style else "--- RELEVANT HISTORICAL TICKETS ---\n"
+            items = self.data.solutions() if solution_style else self.data.tickets
+            blocks = []
+            cost = estimate_tokens(header)
+            for index, item in enumerate(items, 1):
+                block = _solution_line(index, item) if solution_style else _ticket_block(index, item) + "\n"
+                tokens = estimate_tokens(block)
+                if cost + tokens > remaining:
+                    break
+                blocks.append(block)
+                cost += tokens
+            if blocks:
+                parts.append((header + "".join(blocks)).rstrip())
+                remaining -= cost
+
+        if profile.conversation:
+            header = ("Relevant Conversation:\n" if profile.exchanges_only
+                      else "--- RELEVANT CONVERSATION EXAMPLE ---\n")
+            for conversation in self.data.conversations:
+                text = self._take(_conversation_chunks(conversation, profile.exchanges_only),
+                                  remaining - estimate_tokens(header))
+                if not text:
+                    break
+                parts.append((header + text).rstrip())
+                remaining -= estimate_tokens(header + text)
+
+        return "\n\n".join(parts)
+
+    @staticmethod
+    def _take(chunks, budget):
+        """Join leading chunks while they fit the budget"""
+        taken = []
+        for chunk in chunks:
+            tokens = estimate_tokens(chunk)
+            if tokens > budget:
+                break
+            taken.append(chunk)
+            budget -= tokens
+        return "".join(taken)
+
+    def _truncate_lines(self, lines, budget):
+        return self._take([line + "\n" for line in lines], budget).rstrip("\n")
+
+
+def context_error(data):
+    """Return why caller-supplied historical context cannot be used, or None if it can"""
+    try:
+        PromptContext(data)
+    except ValueError as e:
+        return f"Invalid historical_context: {e}"
+    return None
+
+
+def build_prompt(ticket, fields, context=None, profile=None, instructions=None):
+    """Assemble an agent prompt: ticket header, budgeted historical context, instructions"""
+    sections = [render_ticket(ticket, fields)]
+    if profile is not None:
+        sections.append("Historical Context:\n" + PromptContext.build(context).render(profile))
+    if instructions:
+        sections.append(textwrap.dedent(instructions).strip())
+    return "\n\n".join(sections)
@@ -0,0 +1,160 @@
+"""
+Resolution Model
+----------------
+Local resolution-time estimates from resolved tickets.
+Resolution times are kept per (category, priority) group in sorted windows, so an
+estimate is the group's median with a 10th-90th percentile interval and costs a
+couple of list lookups. Groups with too few samples back off to the whole category;
+when the category is too sparse as well the caller falls back to the LLM, since
+other categories say little about this one. Tickets opened through the API that
+resolve while the server runs are added as they close.
+"""
+
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime
+import threading
+
+RESOLVED_STATUSES = ('resolved', 'closed')
+
+# Backoff levels from most to least specific, with how much each is trusted
+LEVELS = (
+    ('category_priority', 1.0),
+    ('category', 0.85),
+)
+
+
+def minutes_between(start, end):
+    """Minutes from one ISO timestamp to another, or None if either is missing or invalid"""
+    try:
+        minutes = (datetime.fromisoformat(str(end)) - datetime.fromisoformat(str(start))).total_seconds() / 60
+    except (TypeError, ValueError):
+        return None
+    return minutes if minutes >= 0 else None
+
+
+def historical_resolution_minutes(record):
+    """Resolution time of a historical CSV row, when the export records one.
+
+    Uses a 'Resolution Minutes' column, or the gap between 'Date of Creation' and
+    'Date of Resolution'. Exports with only a resolution date give None.
+    """
+    value = record.get('Resolution Minutes')
+    if value:
+        try:
+            minutes = float(value)
+            return minutes if minutes >= 0 else None
+        except ValueError:
+            return None
+    if record.get('Date of Creation'):
+        return minutes_between(record['Date of Creation'], record.get('Date of Resolution'))
+    return None
+
+
+def _quantile(values, q):
+    """Linear-interpolated quantile of a sorted list"""
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class ResolutionGroup:
+    """The most recent resolution times of one group, kept sorted"""
+
+    def __init__(self, window):
+        self.recent = deque()
+        self.sorted = []
+        self.window = window
+
+    def add(self, minutes):
+        self.recent.append(minutes)
+        insort(self.sorted, minutes)
+        if len(self.recent) > self.window:
+            oldest = self.recent.popleft()
+            del self.sorted[bisect_left(self.sorted, oldest)]
+
+    def __len__(self):
+        return len(self.sorted)
+
+
+class ResolutionTimeModel:
+    """Per-category/priority resolution-time quantiles with hierarchical backoff"""
+
+    def __init__(self, min_samples=5, window=1000):
+        self.min_samples = min_samples
+        self.window = window
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(category, priority):
+        category = (category or 'general').strip().lower()
+        priority = (priority or 'medium').strip().lower()
+        return {
+            'category_priority': ('category_priority', category, priority),
+            'category': ('category', category),
+        }
+
+    def add(self, category, priority, minutes):
+        """Record the resolution time of a ticket"""
+        if minutes is None or minutes < 0:
+            return
+        with self._lock:
+            for key in self._keys(category, priority).values():
+                group = self._groups.get(key)
+                if group is None:
+                    group = self._groups[key] = ResolutionGroup(self.window)
+                group.add(minutes)
+
+    def add_ticket(self, ticket):
+        """Record a resolved ticket that carries openedAt and resolvedAt.
+
+        Only tickets created through the API have openedAt; the createdAt of imported
+        tickets is their CSV resolution date, not when they were opened.
+        """
+        if ticket.get('status') in RESOLVED_STATUSES:
+            self.add(ticket.get('category'), ticket.get('priority'),
+                     minutes_between(ticket.get('openedAt'), ticket.get('resolvedAt')))
+
+    def estimate(self, category, priority):
+        """Return a time estimation result, or None if there are too few samples"""
+        keys = self._keys(category, priority)
+        with self._lock:
+            for level, weight in LEVELS:
+                group = self._groups.get(keys[level])
+                if group is None or len(group) < self.min_samples:
+                    continue
+                values = group.sorted
+                median = _quantile(values, 0.5)
+                low, high = _quantile(values, 0.1), _quantile(values, 0.9)
+                samples = len(values)
+                break
+            else:
+                return None
+
+        # More samples and a tighter spread give a more confident estimate
+        spread = (high - low) / (2 * median) if median > 0 else 1.0
+        confidence = weight * samples / (samples + 10) * (1 - min(spread, 1.0) / 2)
+        category, priority = keys['category_priority'][1:]
+        basis = {'category_priority': f"{category} tickets with {priority} priority",
+                 'category': f"{category} tickets"}[level]
+        return {
+            "estimatedMinutes": round(median),
+            "confidence": round(confidence, 2),
+            "interval": {"low": round(low), "high": round(high)},
+            "factors": [
+                {"name": f"Median resolution time of {samples} resolved {basis}", "impact": 1.0}
+            ],
+            "basis": level,
+            "samples": samples,
+            "source": "historical-model"
+        }
+
+    def estimate_ticket(self, ticket):
+        return self.estimate(ticket.get('category'), ticket.get('priority'))
+
+    def stats(self):
+        """Return {group: sample count} for the groups that have data"""
+        with self._lock:
+            return {"/".join(key): len(group) for key, group in self._groups.items()}
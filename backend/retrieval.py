@@ -0,0 +1,275 @@
+"""
+Retrieval
+---------
+Lexical retrieval of historical context for tickets.
+BM25Index is a small inverted index with incremental add/remove. HistoricalRetriever
+scores historical tickets by their category and solution fields and picks the best
+conversation example, so relevant history is found without scanning every category.
+
+Updates never modify a dict that a search may be iterating: posting lists and
+ticket groups are replaced with updated copies. Searches therefore run without a
+lock while live tickets are indexed; updates are serialised by the retriever.
+"""
+
+from collections import defaultdict
+import heapq
+import math
+import re
+import threading
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do for from has have i if in is it its me my no not of on or
+our so that the their them then there this to was we were what when with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercase text and split it into indexable terms"""
+    return [term for term in TOKEN_PATTERN.findall((text or '').lower()) if term not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index that can be updated incrementally"""
+
+    def __init__(self, k1=1.5, b=0.75, max_df_ratio=0.5):
+        self.k1 = k1
+        self.b = b
+        # Terms found in more than this share of documents carry almost no weight and
+        # are skipped when the query also has rarer terms
+        self.max_df_ratio = max_df_ratio
+        self.postings = {}  # term -> {doc_id: term frequency}, replaced rather than modified
+        self.doc_terms = {}  # doc_id -> distinct terms, so removal only touches its postings
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_lengths
+
+    def add(self, doc_id, text):
+        """Index a document, replacing any previous version with the same ID"""
+        self.add_many([(doc_id, text)])
+
+    def add_many(self, documents):
+        """Index (doc_id, text) pairs, publishing each affected posting list once per batch"""
+        new_postings = {}  # term -> {doc_id: term frequency} for this batch only
+        for doc_id, text in documents:
+            if doc_id in self.doc_lengths:
+                # A document repeated within the batch only has unpublished postings to drop
+                for term in self.doc_terms[doc_id]:
+                    if doc_id in new_postings.get(term, ()):
+                        del new_postings[term][doc_id]
+                self.remove(doc_id)
+            terms = tokenize(text)
+            frequencies = defaultdict(int)
+            for term in terms:
+                frequencies[term] += 1
+            self.doc_terms[doc_id] = tuple(frequencies)
+            self.doc_lengths[doc_id] = len(terms)
+            self.total_length += len(terms)
+            for term, frequency in frequencies.items():
+                new_postings.setdefault(term, {})[doc_id] = frequency
+        for term, postings in new_postings.items():
+            if postings:
+                self.postings[term] = {**self.postings.get(term, {}), **postings}
+
+    def remove(self, doc_id):
+        """Drop a document from the index"""
+        if doc_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(doc_id):
+            postings = {other: frequency for other, frequency in self.postings.get(term, {}).items()
+                        if other != doc_id}
+            if postings:
+                self.postings[term] = postings
+            else:
+                self.postings.pop(term, None)
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def scores(self, query):
+        """Return {doc_id: BM25 score} for every document matching the query"""
+        doc_count = len(self.doc_lengths)
+        if not doc_count:
+            return {}
+        # Take each posting list once, so a concurrent update cannot change it mid-score
+        matched = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings:
+                matched[term] = postings
+        rare = [term for term, postings in matched.items() if len(postings) <= doc_count * self.max_df_ratio]
+        terms = rare or list(matched)
+
+        average_length = self.total_length / doc_count or 1.0
+        k1 = self.k1
+        length_norm = k1 * (1 - self.b)
+        length_scale = k1 * self.b / average_length
+        doc_lengths = self.doc_lengths
+
+        scores = defaultdict(float)
+        for term in terms:
+            postings = matched[term]
+            df = len(postings)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for doc_id, frequency in postings.items():
+                scores[doc_id] += idf * frequency * (k1 + 1) / (
+                    frequency + length_norm + length_scale * doc_lengths.get(doc_id, average_length))
+
+        return scores
+
+    def search(self, query, k=10, exclude=()):
+        """Return up to k (doc_id, score) pairs, best first"""
+        scores = self.scores(query)
+        for doc_id in exclude:
+            scores.pop(doc_id, None)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class HistoricalRetriever:
+    """Finds the historical tickets and conversation example most relevant to a ticket.
+
+    Historical exports repeat a handful of categories and canned solutions across many
+    rows, so each field is indexed over its distinct values and a ticket's score is the
+    weighted sum of its category and solution scores (a BM25F-style combination). A
+    query then only touches the distinct values containing its terms, rather than
+    every row of a popular category.
+    """
+
+    def __init__(self, category_weight=2.0, solution_weight=1.0):
+        self.category_weight = category_weight
+        self.solution_weight = solution_weight
+        self.category_index = BM25Index()
+        self.solution_index = BM25Index()
+        self.conversation_index = BM25Index()
+        self._pairs = {}              # (category key, solution key) -> {ticket ID: record}
+        self._solution_categories = {}  # solution key -> {category key: None}
+        self._category_solutions = {}  # category key -> {solution key: None}
+        self._ticket_pair = {}        # ticket ID -> (category key, solution key)
+        self._conversations = {}
+        self._write_lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._ticket_pair)
+
+    @staticmethod
+    def _key(text):
+        return " ".join(tokenize(text))
+
+    def add_ticket(self, record):
+        """Index a historical ticket record (or replace it if its ID is already indexed)"""
+        self.add_tickets([record])
+
+    def add_tickets(self, records):
+        """Index many records, copying each affected ticket group and posting list once"""
+        with self._write_lock:
+            groups = {}
+            categories = {}
+            solutions = {}
+            for ticket_id, record in {record.get('Ticket ID'): record for record in records}.items():
+                if ticket_id in self._ticket_pair:
+                    self.remove_ticket(ticket_id)
+                category = record.get('Issue Category', '')
+                solution = record.get('Solution', '')
+                pair = (self._key(category), self._key(solution))
+                categories.setdefault(pair[0], category)
+                solutions.setdefault(pair[1], solution)
+                groups.setdefault(pair, {})[ticket_id] = record
+                self._ticket_pair[ticket_id] = pair
+            # Checked after the removals above, which may have dropped a value this batch still uses
+            self.category_index.add_many((key, text) for key, text in categories.items()
+                                         if key not in self.category_index)
+            self.solution_index.add_many((key, text) for key, text in solutions.items()
+                                         if key not in self.solution_index)
+            for pair, group in groups.items():
+                category_key, solution_key = pair
+                self._pairs[pair] = {**self._pairs.get(pair, {}), **group}
+                self._solution_categories[solution_key] = {**self._solution_categories.get(solution_key, {}),
+                                                           category_key: None}
+                self._category_solutions[category_key] = {**self._category_solutions.get(category_key, {}),
+                                                          solution_key: None}
+
+    def remove_ticket(self, ticket_id):
+        with self._write_lock:
+            pair = self._ticket_pair.pop(ticket_id, None)
+            if pair is None:
+                return
+            group = {other: record for other, record in self._pairs.get(pair, {}).items() if other != ticket_id}
+            if group:
+                self._pairs[pair] = group
+                return
+            self._pairs.pop(pair, None)
+            category_key, solution_key = pair
+            categories = {key: None for key in self._solution_categories.get(solution_key, ()) if key != category_key}
+            solutions = {key: None for key in self._category_solutions.get(category_key, ()) if key != solution_key}
+            if categories:
+                self._solution_categories[solution_key] = categories
+            else:
+                self._solution_categories.pop(solution_key, None)
+                self.solution_index.remove(solution_key)
+            if solutions:
+                self._category_solutions[category_key] = solutions
+            else:
+                self._category_solutions.pop(category_key, None)
+                self.category_index.remove(category_key)
+
+    def add_conversation(self, category, content):
+        """Index a conversation example under its category name"""
+        with self._write_lock:
+            self._conversations[category] = content
+            self.conversation_index.add(category, f"{category} {category} {content}")
+
+    def search_tickets(self, query, k=3, exclude_ids=()):
+        """Return up to k historical ticket records, most relevant first"""
+        excluded = set(exclude_ids)
+        category_scores = self.category_index.scores(query)
+        solution_scores = self.solution_index.scores(query)
+
+        wanted = k + len(excluded)
+        best_category = self.category_weight * max(category_scores.values(), default=0.0)
+        candidates = {}
+        kth_best = []  # min-heap of the best `wanted` candidate scores seen so far
+        # Walk solutions from best to worst and stop once no remaining solution can beat
+        # the current k-th best pair even with the best category score added
+        for solution_key, solution_score in sorted(solution_scores.items(), key=lambda item: -item[1]):
+            if len(kth_best) >= wanted and self.solution_weight * solution_score + best_category <= kth_best[0]:
+                break
+            for category_key in self._solution_categories.get(solution_key, ()):
+                score = (self.solution_weight * solution_score
+                         + self.category_weight * category_scores.get(category_key, 0.0))
+                candidates[(category_key, solution_key)] = score
+                if len(kth_best) < wanted:
+                    heapq.heappush(kth_best, score)
+                elif score > kth_best[0]:
+                    heapq.heapreplace(kth_best, score)
+        # Tickets that only match on category; a few per category is enough to fill k
+        for category_key, category_score in category_scores.items():
+            taken = 0
+            for solution_key in self._category_solutions.get(category_key, ()):
+                if taken >= wanted:
+                    break
+                pair = (category_key, solution_key)
+                if pair not in candidates:
+                    candidates[pair] = self.category_weight * category_score
+                    taken += 1
+
+        results = []
+        for pair, _ in heapq.nlargest(wanted, candidates.items(), key=lambda item: item[1]):
+            for ticket_id, record in self._pairs.get(pair, {}).items():
+                if ticket_id in excluded:
+                    continue
+                results.append(record)
+                if len(results) >= k:
+                    return results
+        return results
+
+    def best_conversation(self, query):
+        """Return (category, conversation) for the best matching conversation, or None"""
+        matches = self.conversation_index.search(query, k=1)
+        if not matches:
+            return None
+        category = matches[0][0]
+        return category, self._conversations[category]
@@ -4,19 +4,179 @@ Routes
 API routes for the Agile AI Support Desk application.
 """
 
-from flask import jsonify, request
+from flask import jsonify, request, Response, stream_with_context
 from flask_cors import CORS
-from agent_service import AgentService
+from agent_service import AgentService, PROCESSING_MODES
+from job_queue import JobQueue, QueueFullError
+from batch_service import analyze_tickets
+from embedding_index import SimilarityIndex, EmbeddingError
+from routing_model import LocalRouter
+from prompt_builder import context_error
+import metrics
+import tracing
 import traceback
+import base64
+import json
+import time
+
+# Largest page a client may request from the list endpoints
+MAX_PAGE_SIZE = 500
+
+# Query parameter -> store field, per list endpoint
+TICKET_FIELDS = {
+    'status': 'status',
+    'priority': 'priority',
+    'category': 'category',
+    'sentiment': 'localSentiment',
+    'id': 'id',
+    'date': 'createdAt',
+    'createdAt': 'createdAt'
+}
+HISTORICAL_FIELDS = {
+    'status': 'Resolution Status',
+    'priority': 'Priority',
+    'category': 'Issue Category',
+    'sentiment': 'Sentiment',
+    'id': 'Ticket ID',
+    'date': 'Date of Resolution'
+}
+FILTER_PARAMS = ('status', 'priority', 'category', 'sentiment')
+
+def _encode_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded.encode()))["offset"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _parse_list_query(args, fields):
+    """Translate list query parameters into keyword arguments for a store query.
+    
+    Supports comma-separated equality filters (status, priority, category, sentiment),
+    a from/to date range, sort (prefix '-' for descending), limit, and cursor or offset.
+    Raises ValueError for invalid parameters.
+    """
+    filters = {}
+    for param in FILTER_PARAMS:
+        if param in fields and args.get(param):
+            filters[fields[param]] = [value for value in args[param].split(',') if value]
+    
+    sort = args.get('sort')
+    if sort:
+        descending = sort.startswith('-')
+        field = fields.get(sort.lstrip('-'))
+        if not field:
+            raise ValueError(f"Invalid sort field '{sort.lstrip('-')}'")
+        sort = f"-{field}" if descending else field
+    
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("'limit' must be an integer")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+    
+    if args.get('cursor'):
+        offset = _decode_cursor(args['cursor'])
+    else:
+        try:
+            offset = int(args.get('offset', 0))
+        except ValueError:
+            raise ValueError("'offset' must be an integer")
+    
+    return {
+        "filters": filters,
+        "date_from": args.get('from'),
+        "date_to": args.get('to'),
+        "sort": sort,
+        "offset": max(0, offset),
+        "limit": limit
+    }
+
+def _paginated_response(items, total, offset, limit):
+    """JSON list response with X-Total-Count and, when more results exist, X-Next-Cursor"""
+    response = jsonify(items)
+    response.headers['X-Total-Count'] = str(total)
+    if limit is not None and offset + len(items) < total:
+        response.headers['X-Next-Cursor'] = _encode_cursor(offset + len(items))
+    return response
+
+def _register_metrics(agent_service, job_queue, local_router, similarity_index):
+    """Expose the counters other components already keep; they are read when /metrics is scraped"""
+    cache = agent_service.cache
+    if cache is not None:
+        metrics.callback('llm_cache_lookups_total', 'LLM cache lookups by result (memory_hit, disk_hit, miss)',
+                         'counter', lambda: {(result,): cache.stats()[field] for result, field in
+                                             (('memory_hit', 'memory_hits'), ('disk_hit', 'disk_hits'),
+                                              ('miss', 'misses'))}, ('result',))
+        metrics.callback('llm_cache_hit_ratio', 'Share of LLM cache lookups answered from the cache',
+                         'gauge', lambda: cache.stats()['hit_ratio'])
+        metrics.callback('llm_cache_entries', 'Entries held in the in-memory LLM cache',
+                         'gauge', lambda: cache.stats()['size'])
+    metrics.callback('job_queue_jobs', 'Analysis jobs by status; queued is the queue depth', 'gauge',
+                     lambda: {(status,): count for status, count in job_queue.stats().items()
+                              if status in ('queued', 'running', 'completed', 'failed')}, ('status',))
+    metrics.callback('job_queue_max_depth', 'Queued jobs accepted before new ones are rejected',
+                     'gauge', lambda: job_queue.max_depth)
+    if local_router is not None:
+        metrics.callback('routing_fast_path_ratio', 'Share of tickets routed by the local model without the LLM',
+                         'gauge', lambda: local_router.stats()['fast_path_ratio'])
+    if similarity_index is not None:
+        metrics.callback('similarity_index_pending', 'Documents waiting to be embedded',
+                         'gauge', lambda: similarity_index.stats()['pending'])
+
 
 def register_routes(app, data_loader, OLLAMA_URL, DEFAULT_MODEL):
-    """Register all routes for the application"""
+    """Register all routes for the application. Returns the AgentService they use."""
+    
+    def _similar_ticket_ids(ticket):
+        try:
+            matches = data_loader.find_similar_tickets(ticket, k=3, kinds=('historical', 'ticket'))
+        except EmbeddingError:
+            # The index is backing off after a failure; the summary keeps the model's own list
+            return []
+        return [match['id'] for match in matches]
     
     # Enable CORS for all routes
-    CORS(app, resources={r"/*": {"origins": "*"}})
+    CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['X-Total-Count', 'X-Next-Cursor', 'X-Trace-Id'])
+    
+    # Local classifier that routes confident tickets without an LLM call
+    local_router = LocalRouter.from_env(data_loader.data_dir, data_loader.historical_tickets)
+    
+    # Initialize the agent service; similar tickets come from the embedding index when one is configured
+    agent_service = AgentService(OLLAMA_URL, DEFAULT_MODEL, similar_tickets=_similar_ticket_ids,
+                                 local_router=local_router, resolution_model=data_loader.resolution_model)
+    
+    # Semantic similarity index over historical tickets, conversations and tickets
+    similarity_index = SimilarityIndex.from_env(agent_service.client, data_loader.data_dir)
+    if similarity_index is not None:
+        data_loader.attach_similarity_index(similarity_index)
     
-    # Initialize the agent service
-    agent_service = AgentService(OLLAMA_URL, DEFAULT_MODEL)
+    # Per-request spans, exported to TRACE_EXPORT_PATH when it is set
+    tracer = tracing.Tracer.from_env()
+    
+    # Background queue for asynchronous ticket analysis
+    job_queue = JobQueue(agent_service, save_result=data_loader.save_analysis)
+    _register_metrics(agent_service, job_queue, local_router, similarity_index)
+    
+    @app.before_request
+    def start_request_timer():
+        request.environ['metrics.started'] = time.perf_counter()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        started = request.environ.get('metrics.started')
+        if started is not None:
+            # The rule rather than the path, so ticket IDs do not each become a series
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route)
+            metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+        return response
     
     @app.route('/', methods=['GET'])
     def index():
@@ -24,19 +184,34 @@ def register_routes(app, data_loader, OLLAMA_URL, DEFAULT_MODEL):
         return jsonify({
             "status": "ok",
             "message": "AI Customer Support System Backend API is running",
-            "endpoints": ["/status", "/historical-data", "/conversations", "/process-ticket", "/tickets"]
+            "endpoints": ["/status", "/historical-data", "/conversations", "/process-ticket",
+                          "/process-ticket/stream", "/process-tickets/batch", "/jobs/process-ticket", "/tickets",
+                          "/metrics"]
         })
 
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """Latency, fallback, token and cache metrics in the Prometheus text format"""
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
     @app.route('/status', methods=['GET'])
     def status():
         """Check if the backend server is running and can connect to Ollama"""
         from ollama_service import check_ollama_connection
-        return check_ollama_connection(OLLAMA_URL, data_loader)
+        cache_stats = agent_service.cache.stats() if agent_service.cache else None
+        routing_stats = local_router.stats() if local_router else None
+        return check_ollama_connection(OLLAMA_URL, data_loader, cache_stats, routing_stats,
+                                       agent_service.client.timing_stats())
 
     @app.route('/historical-data', methods=['GET'])
     def get_historical_data():
-        """Return all historical ticket data"""
-        return jsonify(data_loader.historical_tickets)
+        """Return historical ticket data, optionally filtered, sorted and paginated"""
+        try:
+            query = _parse_list_query(request.args, HISTORICAL_FIELDS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        tickets, total = data_loader.query_historical_tickets(**query)
+        return _paginated_response(tickets, total, query['offset'], query['limit'])
 
     @app.route('/conversations', methods=['GET'])
     def get_conversations():
@@ -50,26 +225,51 @@ def register_routes(app, data_loader, OLLAMA_URL, DEFAULT_MODEL):
 
     @app.route('/process-ticket', methods=['POST'])
     def process_ticket():
-        """Process a ticket using the multi-agent framework"""
+        """Process a ticket using the multi-agent framework.
+
+        With an X-Debug-Trace header the response metadata includes the request's span tree.
+        """
+        debug = tracing.debug_requested(request.headers.get(tracing.DEBUG_HEADER))
+        with tracer.trace('POST /process-ticket', force=debug) as root:
+            response = _process_ticket(root if debug else None)
+        return tracing.tag_response(response, root)
+
+    def _process_ticket(debug_span):
         try:
             # Get ticket data from request
             ticket = request.json.get('ticket')
             if not ticket:
                 return jsonify({"error": "No ticket data provided"}), 400
-            
-            # Get historical context if available
+            tracing.set_attributes(ticket_id=str(ticket.get('id')))
+
+            # Use the caller's historical context, or retrieve it from the historical data
             historical_context = request.json.get('historical_context')
+            error = context_error(historical_context)
+            if error:
+                return jsonify({"error": error}), 400
+            if historical_context is None:
+                with tracing.span('retrieval'):
+                    historical_context = data_loader.get_context_for_ticket(ticket)
+            
+            # Optional per-request processing mode ('multi' or 'fused')
+            mode = request.json.get('mode')
+            if mode and mode not in PROCESSING_MODES:
+                return jsonify({"error": f"Invalid mode '{mode}', expected one of: {', '.join(PROCESSING_MODES)}"}), 400
             
             # Process the ticket using the agent service
-            results = agent_service.process_ticket(ticket, historical_context)
+            results = agent_service.process_ticket(ticket, historical_context, mode=mode)
             
             # Check if there was an error
             if "error" in results:
                 print(f"Error from agent service: {results['error']}")
                 return jsonify(results), 500
             else:
-                # Print success
+                # Keep the analysis with the stored ticket, if it is one
+                with tracing.span('save_analysis'):
+                    data_loader.save_analysis(ticket.get('id'), results)
                 print(f"Successfully processed ticket {ticket['id']}")
+                if debug_span is not None:
+                    results['metadata']['trace'] = debug_span.tree()
                 return jsonify(results)
             
         except Exception as e:
@@ -85,12 +285,155 @@ def register_routes(app, data_loader, OLLAMA_URL, DEFAULT_MODEL):
                 "recommendations": {"suggestedResolutions": [{"steps": ["Please try again later"], "confidence": 0.5}]}
             }), 500
 
+    @app.route('/process-ticket/stream', methods=['POST'])
+    def process_ticket_stream():
+        """Process a ticket and stream each agent's result as Server-Sent Events"""
+        ticket = (request.json or {}).get('ticket')
+        if not ticket:
+            return jsonify({"error": "No ticket data provided"}), 400
+        
+        historical_context = request.json.get('historical_context')
+        error = context_error(historical_context)
+        if error:
+            return jsonify({"error": error}), 400
+        if historical_context is None:
+            historical_context = data_loader.get_context_for_ticket(ticket)
+        stream_tokens = bool(request.json.get('stream_tokens', False))
+        
+        def generate():
+            results = {}
+            for event, data in agent_service.stream_ticket(ticket, historical_context, stream_tokens):
+                if event == 'result':
+                    results[data['agent']] = data['result']
+                elif event == 'done':
+                    # Keep the analysis with the stored ticket, as /process-ticket does
+                    results['metadata'] = data['metadata']
+                    data_loader.save_analysis(ticket.get('id'), results)
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+
+    @app.route('/process-tickets/batch', methods=['POST'])
+    def process_tickets_batch():
+        """Analyse many tickets and stream one JSON line per ticket, then a summary line.
+        
+        The body selects tickets with one of: "tickets" (a list of ticket objects),
+        "ticketIds" (IDs of stored tickets) or "all": true.
+        """
+        body = request.json or {}
+        if body.get('tickets'):
+            tickets = body['tickets']
+            # Checked up front: a bad entry would otherwise end the stream halfway through
+            if not isinstance(tickets, list) or not all(isinstance(ticket, dict) for ticket in tickets):
+                return jsonify({"error": "'tickets' must be a list of ticket objects"}), 400
+            for index, ticket in enumerate(tickets):
+                error = context_error(ticket.get('historical_context'))
+                if error:
+                    return jsonify({"error": f"tickets[{index}]: {error}"}), 400
+        elif body.get('ticketIds'):
+            ticket_ids = body['ticketIds']
+            if not isinstance(ticket_ids, list) or not all(isinstance(i, (str, int)) for i in ticket_ids):
+                return jsonify({"error": "'ticketIds' must be a list of ticket IDs"}), 400
+            tickets = [ticket for ticket in map(data_loader.get_ticket, ticket_ids) if ticket]
+        elif body.get('all'):
+            tickets = list(data_loader.get_tickets())
+        else:
+            return jsonify({"error": "Provide 'tickets', 'ticketIds' or 'all'"}), 400
+        
+        mode = body.get('mode')
+        if mode and mode not in PROCESSING_MODES:
+            return jsonify({"error": f"Invalid mode '{mode}', expected one of: {', '.join(PROCESSING_MODES)}"}), 400
+        
+        concurrency = body.get('concurrency')
+        if concurrency is not None:
+            try:
+                concurrency = max(1, min(int(concurrency), agent_service.max_workers))
+            except (TypeError, ValueError):
+                return jsonify({"error": "'concurrency' must be an integer"}), 400
+        
+        def generate():
+            for record in analyze_tickets(agent_service, tickets, concurrency, mode,
+                                          context_for=data_loader.get_context_for_ticket,
+                                          save_result=data_loader.save_analysis):
+                yield json.dumps(record) + "\n"
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    @app.route('/sentiment/batch', methods=['POST'])
+    def analyze_sentiment_batch():
+        """Run local sentiment analysis over many tickets in one vectorised pass.
+        
+        The body selects tickets like /process-tickets/batch: "tickets", "ticketIds" or "all": true.
+        """
+        body = request.json or {}
+        if body.get('tickets'):
+            tickets = body['tickets']
+        elif body.get('ticketIds'):
+            tickets = [ticket for ticket in map(data_loader.get_ticket, body['ticketIds']) if ticket]
+        elif body.get('all'):
+            tickets = data_loader.get_tickets()
+        else:
+            return jsonify({"error": "Provide 'tickets', 'ticketIds' or 'all'"}), 400
+        
+        if any(not isinstance(ticket, dict) or 'subject' not in ticket or 'description' not in ticket
+               for ticket in tickets):
+            return jsonify({"error": "Every ticket needs a 'subject' and a 'description'"}), 400
+        
+        results = agent_service.agents['sentiment'].analyze_batch(tickets)
+        return jsonify([dict(result, ticketId=ticket.get('id')) for ticket, result in zip(tickets, results)])
+
+    @app.route('/jobs/process-ticket', methods=['POST'])
+    def enqueue_process_ticket():
+        """Queue a ticket for analysis and return a job ID immediately"""
+        try:
+            ticket = (request.json or {}).get('ticket')
+            if not ticket:
+                return jsonify({"error": "No ticket data provided"}), 400
+            
+            mode = request.json.get('mode')
+            if mode and mode not in PROCESSING_MODES:
+                return jsonify({"error": f"Invalid mode '{mode}', expected one of: {', '.join(PROCESSING_MODES)}"}), 400
+            
+            historical_context = request.json.get('historical_context')
+            error = context_error(historical_context)
+            if error:
+                return jsonify({"error": error}), 400
+            if historical_context is None:
+                historical_context = data_loader.get_context_for_ticket(ticket)
+            
+            job, created = job_queue.submit(ticket, historical_context, mode)
+            response = job.to_dict()
+            response["deduplicated"] = not created
+            return jsonify(response), 202, {"Location": f"/jobs/{job.id}"}
+        except QueueFullError as e:
+            return jsonify({"error": str(e)}), 429, {"Retry-After": "5"}
+        except Exception as e:
+            print(f"Error queueing ticket: {str(e)}")
+            print(traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        """Get the status and, once finished, the result of an analysis job"""
+        job = job_queue.get(job_id)
+        if job:
+            return jsonify(job.to_dict())
+        else:
+            return jsonify({"error": f"Job {job_id} not found"}), 404
+
     @app.route('/tickets', methods=['GET'])
     def get_tickets():
-        """Get all tickets"""
+        """Get tickets, optionally filtered, sorted and paginated"""
         try:
-            tickets = data_loader.get_tickets()
-            return jsonify(tickets)
+            try:
+                query = _parse_list_query(request.args, TICKET_FIELDS)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            tickets, total = data_loader.query_tickets(**query)
+            return _paginated_response(tickets, total, query['offset'], query['limit'])
         except Exception as e:
             print(f"Error getting tickets: {str(e)}")
             return jsonify({"error": str(e)}), 500
@@ -133,6 +476,55 @@ def register_routes(app, data_loader, OLLAMA_URL, DEFAULT_MODEL):
             print(f"Error getting ticket {ticket_id}: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+    @app.route('/tickets/<ticket_id>', methods=['PATCH', 'PUT'])
+    def update_ticket(ticket_id):
+        """Update fields of an existing ticket"""
+        try:
+            changes = request.json
+            if not changes:
+                return jsonify({"error": "No ticket data provided"}), 400
+            if not isinstance(changes, dict):
+                return jsonify({"error": "Ticket data must be a JSON object"}), 400
+                
+            ticket = data_loader.update_ticket(ticket_id, changes)
+            if ticket:
+                return jsonify(ticket)
+            else:
+                return jsonify({"error": f"Ticket {ticket_id} not found"}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            print(f"Error updating ticket {ticket_id}: {str(e)}")
+            print(traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/tickets/<ticket_id>/similar', methods=['GET'])
+    def get_similar_tickets(ticket_id):
+        """Get the historical tickets, conversations and tickets most similar to a ticket"""
+        if similarity_index is None:
+            return jsonify({"error": "Similarity search is disabled (EMBEDDING_BACKEND=off)"}), 503
+        ticket = data_loader.get_ticket(ticket_id)
+        if not ticket:
+            return jsonify({"error": f"Ticket {ticket_id} not found"}), 404
+        try:
+            k = max(1, min(int(request.args.get('k', 5)), 50))
+        except ValueError:
+            return jsonify({"error": "'k' must be an integer"}), 400
+        kinds = [kind for kind in request.args.get('type', '').split(',') if kind] or None
+        try:
+            return jsonify(data_loader.find_similar_tickets(ticket, k=k, kinds=kinds))
+        except EmbeddingError as e:
+            print(f"Error finding tickets similar to {ticket_id}: {str(e)}")
+            return jsonify({"error": str(e)}), 503
+
+    @app.route('/tickets/<ticket_id>/context', methods=['GET'])
+    def get_ticket_context(ticket_id):
+        """Get the historical tickets and parsed conversation the agents would use for a ticket"""
+        ticket = data_loader.get_ticket(ticket_id)
+        if not ticket:
+            return jsonify({"error": f"Ticket {ticket_id} not found"}), 404
+        return jsonify(data_loader.get_context_for_ticket(ticket).to_dict())
+
     @app.route('/tickets/<ticket_id>/history', methods=['GET'])
     def get_ticket_history(ticket_id):
         """Get ticket history"""
@@ -168,3 +560,5 @@ def register_routes(app, data_loader, OLLAMA_URL, DEFAULT_MODEL):
         except Exception as e:
             print(f"Error getting article {article_id}: {str(e)}")
             return jsonify({"error": str(e)}), 500
+
+    return agent_service
@@ -0,0 +1,425 @@
+"""
+Routing Model
+-------------
+Local team classifier that answers routing for confident tickets without an LLM call.
+Tickets are turned into hashed TF-IDF features over words and word pairs and scored
+by a multinomial logistic regression trained with numpy. The model is seeded from the
+historical tickets and retrained on the teams the LLM picks for the tickets it does
+see, so the fast path covers more traffic over time. The seed labels only come from a
+keyword mapping of issue categories, so the fast path stays closed until the model has
+agreed with the LLM often enough on live tickets. Only the weights of features seen
+in training are kept, in a few arrays saved to a single .npz file.
+"""
+
+from collections import OrderedDict, deque
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from pathlib import Path
+import numpy as np
+from retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+TEAMS = ('technical-support', 'billing', 'account-management', 'product-feedback', 'security', 'legal')
+
+# Historical exports record an issue category rather than a team; a category that
+# mentions one of these words is credited to that team, anything else to technical support
+CATEGORY_TEAM_KEYWORDS = (
+    ('security', ('security', 'breach', 'fraud', 'phishing', 'hacked', 'unauthorized')),
+    ('legal', ('legal', 'gdpr', 'compliance', 'privacy', 'contract')),
+    ('billing', ('billing', 'payment', 'invoice', 'refund', 'subscription', 'charge')),
+    ('account-management', ('account', 'login', 'password', 'profile')),
+    ('product-feedback', ('feedback', 'feature', 'suggestion')),
+)
+
+# Longer tickets are truncated; the subject and opening lines decide the team
+MAX_TEXT_CHARS = 2000
+
+# Number of recent confident predictions checked against the LLM that the agreement rate covers
+AGREEMENT_WINDOW = 200
+
+
+def team_for_category(category):
+    """Map a historical issue category to the team that would have handled it"""
+    terms = set(tokenize(category))
+    for team, keywords in CATEGORY_TEAM_KEYWORDS:
+        if terms.intersection(keywords):
+            return team
+    return 'technical-support'
+
+
+def routing_text(ticket):
+    """Text of a ticket as seen by the routing model"""
+    parts = (ticket.get('subject'), ticket.get('description'), ticket.get('category'))
+    return " ".join(str(part) for part in parts if part)[:MAX_TEXT_CHARS]
+
+
+def hashed_features(text, dim):
+    """Return {feature index: term frequency} for the words and word pairs of a text"""
+    terms = tokenize(text)
+    counts = {}
+    for feature in terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]:
+        index = zlib.crc32(feature.encode("utf-8")) % dim
+        counts[index] = counts.get(index, 0) + 1
+    return counts
+
+
+class RoutingClassifier:
+    """Hashed TF-IDF + softmax regression over the support teams"""
+
+    def __init__(self, features, idf, weights, bias, classes, dim, examples=0):
+        self.features = features   # sorted hashed feature indexes seen in training
+        self.idf = idf             # idf of each kept feature
+        self.weights = weights     # (len(features), len(classes)) float32
+        self.bias = bias
+        self.classes = tuple(classes)
+        self.dim = dim
+        self.examples = examples
+
+    @classmethod
+    def fit(cls, texts, labels, dim=1 << 18, epochs=300, learning_rate=16.0, l2=1e-4):
+        """Train on parallel lists of ticket texts and team labels"""
+        classes = sorted(set(labels))
+        class_ids = {team: i for i, team in enumerate(classes)}
+        rows, cols, counts = [], [], []
+        for row, text in enumerate(texts):
+            for index, count in hashed_features(text, dim).items():
+                rows.append(row)
+                cols.append(index)
+                counts.append(count)
+        n = len(texts)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.float32)
+
+        # Re-number the hashed features that occur so the arrays stay small
+        features, cols = np.unique(cols, return_inverse=True)
+        df = np.bincount(cols, minlength=len(features))
+        idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+        values = _tfidf(counts, idf[cols], rows, n)
+
+        targets = np.zeros((n, len(classes)), dtype=np.float32)
+        targets[np.arange(n), [class_ids[label] for label in labels]] = 1.0
+        weights = np.zeros((len(features), len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        # Full-batch gradient descent; the data is small and the problem is convex
+        for _ in range(epochs):
+            logits = np.stack([np.bincount(rows, weights=values * weights[cols, c], minlength=n)
+                               for c in range(len(classes))], axis=1) + bias
+            errors = (_softmax(logits) - targets) / n
+            gradient = np.stack([np.bincount(cols, weights=values * errors[rows, c], minlength=len(features))
+                                 for c in range(len(classes))], axis=1)
+            weights -= learning_rate * (gradient + l2 * weights).astype(np.float32)
+            bias -= learning_rate * errors.sum(axis=0).astype(np.float32)
+        return cls(features, idf, weights, bias, classes, dim, examples=n)
+
+    def predict(self, text):
+        """Return (team, probability), or None if the text shares no features with the training data"""
+        counts = hashed_features(text, self.dim)
+        if not counts:
+            return None
+        indexes = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        positions = np.searchsorted(self.features, indexes)
+        positions[positions >= len(self.features)] = 0
+        known = self.features[positions] == indexes
+        if not known.any():
+            return None
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        # Unknown features still count towards the length normalisation
+        values = (1 + np.log(tf)) * np.where(known, self.idf[positions], 1.0)
+        values /= np.linalg.norm(values)
+        logits = values[known] @ self.weights[positions[known]] + self.bias
+        probabilities = _softmax(logits[None, :])[0]
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + ".tmp.npz")
+        np.savez(temporary, features=self.features, idf=self.idf, weights=self.weights, bias=self.bias,
+                 classes=np.asarray(self.classes), dim=self.dim, examples=self.examples)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['features'], data['idf'], data['weights'], data['bias'],
+                       [str(team) for team in data['classes']], int(data['dim']), int(data['examples']))
+
+
+def _tfidf(counts, idf, rows, n):
+    """Sublinear tf * idf, L2-normalised per row"""
+    values = (1 + np.log(counts)) * idf
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n))
+    norms[norms == 0] = 1.0
+    return (values / norms[rows]).astype(np.float32)
+
+
+def _softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class LocalRouter:
+    """Puts the routing classifier in front of the LLM router.
+
+    Tickets the model is confident about are routed locally once its confident answers
+    have matched the LLM's on at least `agreement_checks` of the last AGREEMENT_WINDOW
+    live tickets at a rate of `min_agreement`; until then they still go to the LLM.
+    Every team the LLM returns is logged as a training example (the latest team per
+    ticket text, at most `max_outcomes` of them), and the model is retrained in the
+    background once enough new examples have arrived. A sample of confident tickets
+    keeps going to the LLM so the agreement stays measured.
+    """
+
+    def __init__(self, path=None, threshold=0.85, shadow_rate=0.05, retrain_every=50, min_examples=20,
+                 seed_examples=(), min_agreement=0.9, agreement_checks=50, max_outcomes=5000):
+        self.path = Path(path) if path else None
+        self.threshold = threshold
+        self.shadow_rate = shadow_rate
+        self.retrain_every = retrain_every
+        self.min_examples = min_examples
+        self.seed_examples = list(seed_examples)
+        self.min_agreement = min_agreement
+        self.agreement_checks = min(agreement_checks, AGREEMENT_WINDOW)
+        self.max_outcomes = max_outcomes
+        self.classifier = None
+        # Recorded LLM decisions, text -> team, oldest first
+        self._outcomes = OrderedDict()
+        self._outcome_lines = 0
+        self._new_outcomes = 0
+        self._training = False
+        # Whether each recent confident prediction matched the LLM
+        self._agreement = deque(maxlen=AGREEMENT_WINDOW)
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._random = random.Random()
+        self._stats = {"fast_path": 0, "llm_calls": 0, "cached_answers": 0, "no_prediction": 0,
+                       "low_confidence": 0, "calibrating": 0, "shadow_checks": 0, "shadow_agreements": 0,
+                       "fallback_checks": 0, "fallback_agreements": 0, "trainings": 0}
+        self.last_trained = None
+
+        if self.path:
+            self._outcomes, self._outcome_lines = self._load_outcomes()
+            if self._outcome_lines > len(self._outcomes):
+                self._compact_outcomes()
+            model_path = self.path / "model.npz"
+            if model_path.exists():
+                try:
+                    self.classifier = RoutingClassifier.load(model_path)
+                    self.last_trained = model_path.stat().st_mtime
+                    # Decisions recorded after the model was saved count towards the next retrain
+                    self._new_outcomes = max(0, len(self.seed_examples) + len(self._outcomes)
+                                             - self.classifier.examples)
+                except Exception as e:
+                    logger.warning("Could not load routing model from %s: %s", model_path, e)
+        if self.classifier is None:
+            self.train()
+
+    @classmethod
+    def from_env(cls, data_dir, historical_tickets=()):
+        """Create a router configured by ROUTING_MODEL, ROUTING_MODEL_PATH, ROUTING_CONFIDENCE,
+        ROUTING_SHADOW_RATE, ROUTING_RETRAIN_EVERY, ROUTING_MIN_AGREEMENT, ROUTING_AGREEMENT_CHECKS
+        and ROUTING_MAX_OUTCOMES, or return None if ROUTING_MODEL is 'off'"""
+        if os.environ.get("ROUTING_MODEL", "on").lower() == "off":
+            return None
+        path = os.environ.get("ROUTING_MODEL_PATH", str(Path(data_dir) / "routing"))
+        seeds = [(f"{record.get('Issue Category', '')} {record.get('Solution', '')}",
+                  team_for_category(record.get('Issue Category', '')))
+                 for record in historical_tickets]
+        return cls(path=path or None,
+                   threshold=float(os.environ.get("ROUTING_CONFIDENCE", "0.85")),
+                   shadow_rate=float(os.environ.get("ROUTING_SHADOW_RATE", "0.05")),
+                   retrain_every=int(os.environ.get("ROUTING_RETRAIN_EVERY", "50")),
+                   min_agreement=float(os.environ.get("ROUTING_MIN_AGREEMENT", "0.9")),
+                   agreement_checks=int(os.environ.get("ROUTING_AGREEMENT_CHECKS", "50")),
+                   max_outcomes=int(os.environ.get("ROUTING_MAX_OUTCOMES", "5000")),
+                   seed_examples=seeds)
+
+    def _outcomes_path(self):
+        return self.path / "outcomes.jsonl"
+
+    def _load_outcomes(self):
+        """Return the newest recorded team per ticket text, capped, and the file's line count"""
+        path = self._outcomes_path()
+        outcomes = OrderedDict()
+        if not path.exists():
+            return outcomes, 0
+        lines = 0
+        with open(path, mode='r', encoding='utf-8') as file:
+            for line in file:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                    self._add_outcome(outcomes, record['text'], record['team'])
+                except (json.JSONDecodeError, KeyError):
+                    continue
+        return outcomes, lines
+
+    def _add_outcome(self, outcomes, text, team):
+        outcomes.pop(text, None)
+        outcomes[text] = team
+        while len(outcomes) > self.max_outcomes:
+            outcomes.popitem(last=False)
+
+    def _compact_outcomes(self):
+        """Rewrite outcomes.jsonl with only the decisions still kept in memory"""
+        with self._lock:
+            outcomes = list(self._outcomes.items())
+        path = self._outcomes_path()
+        temporary = path.with_name(path.name + ".tmp")
+        try:
+            with self._file_lock:
+                with open(temporary, mode='w', encoding='utf-8') as file:
+                    for text, team in outcomes:
+                        file.write(json.dumps({"text": text, "team": team}) + "\n")
+                os.replace(temporary, path)
+                self._outcome_lines = len(outcomes)
+        except OSError as e:
+            logger.warning("Could not compact routing outcomes: %s", e)
+
+    def _fast_path_open(self):
+        """Whether the model has agreed with the LLM often enough to answer on its own"""
+        checks = len(self._agreement)
+        return checks >= self.agreement_checks and sum(self._agreement) / checks >= self.min_agreement
+
+    def predict(self, ticket):
+        """Return a routing result if the model is confident, otherwise None.
+
+        The returned dict has the RouterAgent schema plus a 'source' field. When None
+        is returned the caller should ask the LLM and report its answer to record().
+        """
+        classifier = self.classifier
+        prediction = classifier.predict(routing_text(ticket)) if classifier else None
+        with self._lock:
+            if prediction is None:
+                self._stats["no_prediction"] += 1
+                return None
+            team, confidence = prediction
+            if confidence < self.threshold:
+                self._stats["low_confidence"] += 1
+                return None
+            if not self._fast_path_open():
+                # Still measuring agreement, so the LLM answers and record() scores the prediction
+                self._stats["calibrating"] += 1
+                return None
+            if self.shadow_rate and self._random.random() < self.shadow_rate:
+                # Let the LLM answer this one so record() can check the agreement
+                return None
+            self._stats["fast_path"] += 1
+        return {
+            "recommendedTeam": team,
+            "confidence": round(confidence, 3),
+            "reasoning": f"Routed by the local routing model ({classifier.examples} training examples)",
+            "source": "local-model"
+        }
+
+    def record(self, ticket, team, cached=False):
+        """Record the team the LLM chose for a ticket and update agreement counters.
+
+        Pass cached=True when the answer came from the LLM cache; it was recorded
+        when the LLM first gave it and is not counted again.
+        """
+        if team not in TEAMS:
+            return
+        if cached:
+            with self._lock:
+                self._stats["llm_calls"] += 1
+                self._stats["cached_answers"] += 1
+            return
+        text = routing_text(ticket)
+        classifier = self.classifier
+        prediction = classifier.predict(text) if classifier else None
+        with self._lock:
+            self._stats["llm_calls"] += 1
+            if prediction is not None:
+                if prediction[1] >= self.threshold:
+                    self._stats["shadow_checks"] += 1
+                    self._stats["shadow_agreements"] += prediction[0] == team
+                    self._agreement.append(prediction[0] == team)
+                else:
+                    self._stats["fallback_checks"] += 1
+                    self._stats["fallback_agreements"] += prediction[0] == team
+            if self._outcomes.get(text) != team:
+                self._add_outcome(self._outcomes, text, team)
+                self._new_outcomes += 1
+            retrain = self._new_outcomes >= self.retrain_every and not self._training
+            if retrain:
+                self._training = True
+        if self.path:
+            try:
+                self.path.mkdir(parents=True, exist_ok=True)
+                with self._file_lock:
+                    with open(self._outcomes_path(), mode='a', encoding='utf-8') as file:
+                        file.write(json.dumps({"text": text, "team": team}) + "\n")
+                    self._outcome_lines += 1
+                    compact = self._outcome_lines > 2 * self.max_outcomes
+            except OSError as e:
+                logger.warning("Could not record routing outcome: %s", e)
+                compact = False
+            if compact:
+                self._compact_outcomes()
+        if retrain:
+            threading.Thread(target=self.train, name="routing-train", daemon=True).start()
+
+    def train(self):
+        """Retrain the classifier on the seed examples and recorded LLM outcomes"""
+        with self._lock:
+            self._training = True
+            examples = self.seed_examples + list(self._outcomes.items())
+            self._new_outcomes = 0
+        try:
+            if len(examples) < self.min_examples or len({team for _, team in examples}) < 2:
+                logger.info("Routing model needs %d examples over 2+ teams, have %d",
+                            self.min_examples, len(examples))
+                return
+            started = time.perf_counter()
+            texts, labels = zip(*examples)
+            classifier = RoutingClassifier.fit(list(texts), list(labels))
+            self.classifier = classifier
+            self.last_trained = time.time()
+            with self._lock:
+                self._stats["trainings"] += 1
+            logger.info("Trained routing model on %d examples in %.3fs", len(examples),
+                        time.perf_counter() - started)
+            if self.path:
+                classifier.save(self.path / "model.npz")
+        except Exception as e:
+            logger.warning("Routing model training failed: %s", e)
+        finally:
+            with self._lock:
+                self._training = False
+
+    def stats(self):
+        """Return fast-path and agreement counters for the status endpoint"""
+        with self._lock:
+            stats = dict(self._stats)
+            examples = len(self.seed_examples) + len(self._outcomes)
+            agreement_checks = len(self._agreement)
+            agreement = round(sum(self._agreement) / agreement_checks, 4) if agreement_checks else None
+            fast_path_open = self._fast_path_open()
+        routed = stats["fast_path"] + stats["llm_calls"]
+        classifier = self.classifier
+        return {
+            **stats,
+            "fast_path_ratio": round(stats["fast_path"] / routed, 4) if routed else 0.0,
+            "shadow_agreement": (round(stats["shadow_agreements"] / stats["shadow_checks"], 4)
+                                 if stats["shadow_checks"] else None),
+            "fallback_agreement": (round(stats["fallback_agreements"] / stats["fallback_checks"], 4)
+                                   if stats["fallback_checks"] else None),
+            "threshold": self.threshold,
+            "agreement": agreement,
+            "agreement_checks": agreement_checks,
+            "fast_path_open": fast_path_open,
+            "examples": examples,
+            "trained": classifier is not None,
+            "model_examples": classifier.examples if classifier else 0,
+            "model_features": len(classifier.features) if classifier else 0,
+            "last_trained": self.last_trained
+        }
@@ -0,0 +1,289 @@
+"""
+Ticket Database
+---------------
+Durable ticket storage in SQLite, with the same interface as ticket_store.TicketStore.
+Each ticket is stored as a JSON document next to indexed columns for its ID, status,
+priority, category, local sentiment and creation date, so filters, sorts and pages
+are answered by SQLite indexes. The database runs in WAL mode with one connection
+per thread: readers never block on the single writer, and every statement is
+parameterised so sqlite3 reuses its prepared form. Ticket history events and
+analysis results are kept in their own tables.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from ticket_store import INDEXED_FIELDS, PRIORITY_RANKS, MAX_ANALYSES_PER_TICKET, index_value
+
+logger = logging.getLogger(__name__)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteTicketStore:
+    """Ticket collection persisted in a SQLite database file"""
+
+    def __init__(self, path, key='id', indexed_fields=INDEXED_FIELDS, date_field='createdAt', sort_ranks=None):
+        self.path = str(path)
+        self.key = key
+        self.indexed_fields = tuple(indexed_fields)
+        self.date_field = date_field
+        self.sort_ranks = sort_ranks if sort_ranks is not None else {'priority': PRIORITY_RANKS}
+        self._local = threading.local()
+        # SQLite allows one writer at a time; queue writers here instead of on its busy timeout
+        self._write_lock = threading.Lock()
+        self._create_schema()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode; writes open explicit transactions
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=256)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _write(self, statements):
+        """Run (sql, params) pairs in one transaction; params may be a list of rows for executemany"""
+        connection = self._connection()
+        with self._write_lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        connection.executemany(sql, params)
+                    else:
+                        connection.execute(sql, params)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _create_schema(self):
+        columns = "".join(f", {_quote(field)}" for field in self.indexed_fields)
+        statements = [
+            (f"CREATE TABLE IF NOT EXISTS tickets (seq INTEGER PRIMARY KEY, {_quote(self.key)} TEXT NOT NULL UNIQUE, "
+             f"{_quote(self.date_field)} TEXT NOT NULL DEFAULT ''{columns}, data TEXT NOT NULL)", ()),
+            (f"CREATE INDEX IF NOT EXISTS tickets_by_date ON tickets ({_quote(self.date_field)}, seq)", ()),
+            ("CREATE TABLE IF NOT EXISTS ticket_events (id INTEGER PRIMARY KEY, ticket_id TEXT NOT NULL, "
+             "timestamp TEXT NOT NULL, action TEXT NOT NULL, details TEXT)", ()),
+            ("CREATE INDEX IF NOT EXISTS ticket_events_by_ticket ON ticket_events (ticket_id, id)", ()),
+            ("CREATE TABLE IF NOT EXISTS ticket_analyses (id INTEGER PRIMARY KEY, ticket_id TEXT NOT NULL, "
+             "created_at REAL NOT NULL, result TEXT NOT NULL)", ()),
+            ("CREATE INDEX IF NOT EXISTS ticket_analyses_by_ticket ON ticket_analyses (ticket_id, id)", ()),
+        ]
+        self._write(statements)
+
+        # Columns for fields indexed since the database was created are added and backfilled
+        existing = {row[1] for row in self._connection().execute("PRAGMA table_info(tickets)")}
+        missing = [field for field in self.indexed_fields if field not in existing]
+        if missing:
+            logger.info("Adding indexed columns %s to %s", missing, self.path)
+            rows = self._connection().execute("SELECT seq, data FROM tickets").fetchall()
+            statements = [(f"ALTER TABLE tickets ADD COLUMN {_quote(field)}", ()) for field in missing]
+            for field in missing:
+                values = [(index_value(json.loads(data).get(field)), seq) for seq, data in rows]
+                statements.append((f"UPDATE tickets SET {_quote(field)} = ? WHERE seq = ?", values))
+            self._write(statements)
+        self._write([(f"CREATE INDEX IF NOT EXISTS {_quote('tickets_by_' + field)} "
+                      f"ON tickets ({_quote(field)}, seq)", ()) for field in self.indexed_fields])
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM tickets").fetchone()[0]
+
+    def __contains__(self, ticket_id):
+        return self._connection().execute(
+            f"SELECT 1 FROM tickets WHERE {_quote(self.key)} = ?", (ticket_id,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter(self.all())
+
+    @property
+    def sortable_fields(self):
+        return (self.key, self.date_field) + self.indexed_fields
+
+    def _row(self, ticket):
+        return ((ticket[self.key], str(ticket.get(self.date_field) or ''))
+                + tuple(index_value(ticket.get(field)) for field in self.indexed_fields)
+                + (json.dumps(ticket),))
+
+    def _insert_sql(self):
+        columns = [self.key, self.date_field] + list(self.indexed_fields) + ['data']
+        return (f"INSERT INTO tickets ({', '.join(_quote(column) for column in columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})")
+
+    def add(self, ticket):
+        """Add a ticket. Raises ValueError if its ID is missing or already stored."""
+        self.add_many([ticket])
+        return ticket
+
+    def add_many(self, tickets):
+        """Insert many tickets in a single transaction"""
+        tickets = list(tickets)
+        for ticket in tickets:
+            if not ticket.get(self.key):
+                raise ValueError(f"Ticket is missing '{self.key}'")
+        try:
+            self._write([(self._insert_sql(), [self._row(ticket) for ticket in tickets])])
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Ticket already exists: {e}")
+        return tickets
+
+    def update(self, ticket_id, changes):
+        """Apply field changes to a ticket and refresh its indexed columns.
+
+        Returns the updated ticket, or None if the ticket does not exist.
+        """
+        if self.key in changes and changes[self.key] != ticket_id:
+            raise ValueError(f"Cannot change '{self.key}' of ticket {ticket_id}")
+        connection = self._connection()
+        assignments = ", ".join(f"{_quote(column)} = ?" for column in [self.date_field, *self.indexed_fields, 'data'])
+        with self._write_lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(f"SELECT data FROM tickets WHERE {_quote(self.key)} = ?",
+                                         (ticket_id,)).fetchone()
+                if row is None:
+                    connection.execute("ROLLBACK")
+                    return None
+                updated = json.loads(row[0])
+                updated.update(changes)
+                connection.execute(f"UPDATE tickets SET {assignments} WHERE {_quote(self.key)} = ?",
+                                   self._row(updated)[1:] + (ticket_id,))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return updated
+
+    def get(self, ticket_id):
+        """Get a ticket by ID, or None"""
+        row = self._connection().execute(f"SELECT data FROM tickets WHERE {_quote(self.key)} = ?",
+                                         (ticket_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self):
+        """Return every ticket in insertion order"""
+        return [json.loads(row[0]) for row in self._connection().execute("SELECT data FROM tickets ORDER BY seq")]
+
+    def _filter_clause(self, filters):
+        clauses, params = [], []
+        for field, wanted in filters.items():
+            if wanted is None:
+                continue
+            if field not in self.indexed_fields:
+                raise ValueError(f"Field '{field}' is not indexed")
+            values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            values = [index_value(value) for value in values]
+            clauses.append(f"{_quote(field)} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+        return clauses, params
+
+    def find_ids(self, **filters):
+        """Return the IDs of tickets matching every equality filter, in insertion order"""
+        clauses, params = self._filter_clause(filters)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return [row[0] for row in self._connection().execute(
+            f"SELECT {_quote(self.key)} FROM tickets{where} ORDER BY seq", params)]
+
+    def find(self, **filters):
+        """Return the tickets matching every equality filter"""
+        clauses, params = self._filter_clause(filters)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return [json.loads(row[0]) for row in self._connection().execute(
+            f"SELECT data FROM tickets{where} ORDER BY seq", params)]
+
+    def count_by(self, field):
+        """Return {value: number of tickets} for an indexed field"""
+        if field not in self.indexed_fields:
+            raise ValueError(f"Field '{field}' is not indexed")
+        return dict(self._connection().execute(
+            f"SELECT {_quote(field)}, COUNT(*) FROM tickets GROUP BY {_quote(field)}"))
+
+    def _order_clause(self, field, descending):
+        direction = " DESC" if descending else ""
+        if field == self.key:
+            return f"{_quote(field)}{direction}", []
+        ranks = self.sort_ranks.get(field)
+        if ranks:
+            cases = " ".join("WHEN ? THEN ?" for _ in ranks)
+            params = [value for item in ranks.items() for value in item]
+            return f"CASE {_quote(field)} {cases} ELSE -1 END{direction}, seq{direction}", params
+        if field == self.date_field:
+            return f"{_quote(field)}{direction}, seq{direction}", []
+        return f"COALESCE({_quote(field)}, ''){direction}, seq{direction}", []
+
+    def query(self, filters=None, date_from=None, date_to=None, sort=None, offset=0, limit=None):
+        """Filter, sort and page the collection. Returns (tickets, total).
+
+        Same semantics as TicketStore.query.
+        """
+        descending = bool(sort) and sort.startswith('-')
+        sort_field = sort.lstrip('-') if sort else None
+        if sort_field and sort_field not in self.sortable_fields:
+            raise ValueError(f"Cannot sort by '{sort_field}'")
+        clauses, params = self._filter_clause(filters or {})
+        if date_from:
+            clauses.append(f"{_quote(self.date_field)} >= ?")
+            params.append(str(date_from))
+        if date_to:
+            # A high code point makes '2025-03-17' include '2025-03-17T10:00:00'
+            clauses.append(f"{_quote(self.date_field)} < ?")
+            params.append(str(date_to) + '\uffff')
+        if sort_field is None and (date_from or date_to):
+            sort_field = self.date_field
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        if sort_field:
+            order, order_params = self._order_clause(sort_field, descending)
+        else:
+            order, order_params = ("seq DESC" if descending else "seq"), []
+        connection = self._connection()
+        # One read transaction, so the count and the page come from the same WAL snapshot
+        connection.execute("BEGIN")
+        try:
+            total = connection.execute(f"SELECT COUNT(*) FROM tickets{where}", params).fetchone()[0]
+            rows = connection.execute(
+                f"SELECT data FROM tickets{where} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + order_params + [-1 if limit is None else limit, max(0, offset or 0)]).fetchall()
+        finally:
+            connection.execute("COMMIT")
+        return [json.loads(row[0]) for row in rows], total
+
+    def record_event(self, ticket_id, action, details=None, timestamp=None):
+        """Append an entry to a ticket's history"""
+        self._write([("INSERT INTO ticket_events (ticket_id, timestamp, action, details) VALUES (?, ?, ?, ?)",
+                      (ticket_id, timestamp or time.strftime('%Y-%m-%dT%H:%M:%S'), action, details))])
+
+    def events(self, ticket_id):
+        """Return a ticket's history entries, oldest first"""
+        rows = self._connection().execute(
+            "SELECT timestamp, action, details FROM ticket_events WHERE ticket_id = ? ORDER BY id", (ticket_id,))
+        return [{"timestamp": timestamp, "action": action, "details": details} for timestamp, action, details in rows]
+
+    def add_analysis(self, ticket_id, result):
+        """Store an analysis result for a ticket, keeping the most recent ones"""
+        self._write([
+            ("INSERT INTO ticket_analyses (ticket_id, created_at, result) VALUES (?, ?, ?)",
+             (ticket_id, time.time(), json.dumps(result))),
+            ("DELETE FROM ticket_analyses WHERE ticket_id = ? AND id NOT IN "
+             "(SELECT id FROM ticket_analyses WHERE ticket_id = ? ORDER BY id DESC LIMIT ?)",
+             (ticket_id, ticket_id, MAX_ANALYSES_PER_TICKET)),
+        ])
+
+    def analyses(self, ticket_id):
+        """Return a ticket's stored analyses, newest first"""
+        rows = self._connection().execute(
+            "SELECT created_at, result FROM ticket_analyses WHERE ticket_id = ? ORDER BY id DESC", (ticket_id,))
+        return [{"createdAt": created_at, "result": json.loads(result)} for created_at, result in rows]
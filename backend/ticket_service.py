@@ -1,4 +1,5 @@
 from datetime import datetime
+from functools import lru_cache
 
 def get_all_tickets(data_loader):
     """Get all tickets from historical data and add some unresolved ones"""
@@ -36,7 +37,6 @@ def get_all_tickets(data_loader):
                 "sentiment": ticket.get("Sentiment", "neutral").lower(),
                 "resolution": ticket.get("Solution", "").strip(),
             }
-            print(f"Added historical ticket: {ticket_id}")
     
     # Convert dictionary to list
     tickets = list(unique_tickets.values())
@@ -88,6 +88,27 @@ def get_all_tickets(data_loader):
     print(f"Generated {len(tickets)} total tickets ({len(unique_tickets)} historical, {len(ticket_templates)} new)")
     return tickets
 
+def sentiment_fields(analysis):
+    """Ticket fields stored from a SentimentAnalyzerAgent result"""
+    return {
+        "localSentiment": analysis["overall_sentiment"],
+        "sentimentIntensity": round(analysis["intensity"], 3),
+        "emotions": analysis["emotions"]
+    }
+
+def enrich_tickets(tickets, analyzer):
+    """Ingest stage: attach locally computed sentiment to tickets before they are stored.
+    
+    The whole batch is scored in one vectorised pass, so list endpoints and dashboards
+    read the stored fields instead of re-analysing tickets on every request.
+    """
+    for ticket, analysis in zip(tickets, analyzer.analyze_batch(tickets)):
+        ticket.update(sentiment_fields(analysis))
+    return tickets
+
+# Historical exports repeat a handful of category and priority values, so each
+# distinct value is mapped once
+@lru_cache(maxsize=1024)
 def map_issue_category(category):
     """Map historical issue categories to internal categories"""
     category = category.lower()
@@ -106,6 +127,7 @@ def map_issue_category(category):
     else:
         return "general"
 
+@lru_cache(maxsize=1024)
 def map_priority(priority):
     """Map historical priorities to internal priorities"""
     priority = priority.lower()
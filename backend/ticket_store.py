@@ -0,0 +1,363 @@
+"""
+Ticket Store
+------------
+In-memory ticket collection backed by a primary-key dict and secondary indexes.
+Lookups by ID are O(1); equality filters on indexed fields intersect the
+per-value ID sets instead of scanning every ticket, and a sorted date index
+answers date-range queries and date-ordered pages with binary search.
+
+The tickets and indexes are changed in place under a reader-writer lock: reads
+run concurrently with each other, a write waits for the reads in progress and
+holds new ones back while it runs, so readers never see a half-updated index and
+a write costs its own index entries rather than a copy of the store.
+"""
+
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+import threading
+import time
+
+INDEXED_FIELDS = ('status', 'priority', 'category', 'localSentiment')
+
+# Sort order for priority values; unknown values sort first
+PRIORITY_RANKS = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}
+
+# Analyses kept per ticket; older ones are dropped as new ones arrive
+MAX_ANALYSES_PER_TICKET = 20
+
+
+def index_value(value):
+    """Normalise a field value for index lookups (strings are case-insensitive)"""
+    if isinstance(value, str):
+        return value.strip().lower()
+    return value
+
+
+class _ReadWriteLock:
+    """Shared lock for readers, exclusive for writers. Waiting writers go first, so a
+    steady stream of reads cannot starve them; a thread must not nest acquisitions."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class StoreState:
+    """The tickets and their indexes; only changed while holding the store's write lock"""
+
+    def __init__(self, indexed_fields):
+        self.by_id = {}
+        # ticket ID -> insertion sequence number, used to return results in a stable order
+        self.order = {}
+        self.ids = []
+        self.next_seq = 0
+        # Sorted list of (date, sequence, ticket ID)
+        self.date_index = []
+        # field -> value -> ordered set of ticket IDs (dict keys keep insertion order)
+        self.indexes = {field: {} for field in indexed_fields}
+
+    def ids_for(self, field, value):
+        """ID set of an index value, created on first use"""
+        return self.indexes[field].setdefault(value, {})
+
+
+class TicketStore:
+    """Ticket collection with a primary-key index and secondary indexes on selected fields"""
+
+    def __init__(self, tickets=(), key='id', indexed_fields=INDEXED_FIELDS, date_field='createdAt',
+                 sort_ranks=None):
+        self.key = key
+        self.indexed_fields = tuple(indexed_fields)
+        self.date_field = date_field
+        # field -> {value: rank} for fields whose natural order is not alphabetical
+        self.sort_ranks = sort_ranks if sort_ranks is not None else {'priority': PRIORITY_RANKS}
+        self._state = StoreState(self.indexed_fields)
+        self._lock = _ReadWriteLock()
+        # ticket ID -> tuple of history entries / most recent analysis results, replaced on write
+        self._history_lock = threading.Lock()
+        self._events = {}
+        self._analyses = {}
+        self.add_many(tickets)
+
+    def __len__(self):
+        return len(self._state.by_id)
+
+    def __contains__(self, ticket_id):
+        return ticket_id in self._state.by_id
+
+    def __iter__(self):
+        return iter(self.all())
+
+    @property
+    def sortable_fields(self):
+        return (self.key, self.date_field) + self.indexed_fields
+
+    def _date_entry(self, state, ticket):
+        ticket_id = ticket[self.key]
+        return (str(ticket.get(self.date_field) or ''), state.order[ticket_id], ticket_id)
+
+    def _index(self, state, ticket):
+        ticket_id = ticket[self.key]
+        for field in self.indexed_fields:
+            state.ids_for(field, index_value(ticket.get(field)))[ticket_id] = None
+        insort(state.date_index, self._date_entry(state, ticket))
+
+    def _unindex(self, state, ticket):
+        ticket_id = ticket[self.key]
+        entry = self._date_entry(state, ticket)
+        position = bisect_left(state.date_index, entry)
+        if position < len(state.date_index) and state.date_index[position] == entry:
+            del state.date_index[position]
+        for field in self.indexed_fields:
+            value = index_value(ticket.get(field))
+            if value in state.indexes[field]:
+                ids = state.ids_for(field, value)
+                ids.pop(ticket_id, None)
+                if not ids:
+                    del state.indexes[field][value]
+
+    def _write(self, change):
+        """Apply change(state) with readers held off"""
+        with self._lock.write():
+            return change(self._state)
+
+    def _check_new(self, state, tickets):
+        """Raise ValueError unless every ticket has a new, unique ID"""
+        seen = set()
+        for ticket in tickets:
+            ticket_id = ticket.get(self.key)
+            if not ticket_id:
+                raise ValueError(f"Ticket is missing '{self.key}'")
+            if ticket_id in state.by_id or ticket_id in seen:
+                raise ValueError(f"Ticket {ticket_id} already exists")
+            seen.add(ticket_id)
+
+    def _add(self, state, ticket):
+        ticket_id = ticket[self.key]
+        state.by_id[ticket_id] = ticket
+        state.order[ticket_id] = state.next_seq
+        state.next_seq += 1
+        state.ids.append(ticket_id)
+        self._index(state, ticket)
+        return ticket
+
+    def add(self, ticket):
+        """Add a ticket. Raises ValueError if its ID is missing or already stored."""
+        return self.add_many([ticket])[0]
+
+    def add_many(self, tickets):
+        """Add several tickets in one write; none are added if one is invalid"""
+        tickets = list(tickets)
+
+        def change(state):
+            self._check_new(state, tickets)
+            return [self._add(state, ticket) for ticket in tickets]
+
+        return self._write(change)
+
+    def update(self, ticket_id, changes):
+        """Apply field changes to a ticket and refresh its index entries.
+
+        Returns the updated ticket, or None if the ticket does not exist.
+        """
+        if self.key in changes and changes[self.key] != ticket_id:
+            raise ValueError(f"Cannot change '{self.key}' of ticket {ticket_id}")
+        if ticket_id not in self._state.by_id:
+            return None
+
+        def change(state):
+            ticket = state.by_id.get(ticket_id)
+            if ticket is None:
+                return None
+            self._unindex(state, ticket)
+            updated = dict(ticket)
+            updated.update(changes)
+            state.by_id[ticket_id] = updated
+            self._index(state, updated)
+            return updated
+
+        return self._write(change)
+
+    def get(self, ticket_id):
+        """Get a ticket by ID, or None"""
+        return self._state.by_id.get(ticket_id)
+
+    def all(self):
+        """Return every ticket in insertion order"""
+        with self._lock.read():
+            return list(self._state.by_id.values())
+
+    def _find_ids(self, state, filters):
+        candidates = None
+        for field, wanted in filters.items():
+            if wanted is None:
+                continue
+            if field not in state.indexes:
+                raise ValueError(f"Field '{field}' is not indexed")
+            values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            matched = set()
+            for value in values:
+                matched.update(state.indexes[field].get(index_value(value), ()))
+            candidates = matched if candidates is None else candidates & matched
+            if not candidates:
+                return []
+        if candidates is None:
+            return list(state.by_id)
+        # Preserve insertion order without scanning the whole collection
+        return sorted(candidates, key=state.order.__getitem__)
+
+    def find_ids(self, **filters):
+        """Return the IDs of tickets matching every equality filter, in insertion order.
+
+        Filters on indexed fields are resolved from the indexes; filter values may be
+        a single value or a list/tuple/set of accepted values.
+        """
+        with self._lock.read():
+            return self._find_ids(self._state, filters)
+
+    def find(self, **filters):
+        """Return the tickets matching every equality filter"""
+        with self._lock.read():
+            state = self._state
+            return [state.by_id[ticket_id] for ticket_id in self._find_ids(state, filters)]
+
+    def count_by(self, field):
+        """Return {value: number of tickets} for an indexed field"""
+        with self._lock.read():
+            return {value: len(ids) for value, ids in self._state.indexes[field].items()}
+
+    @staticmethod
+    def _date_bounds(state, date_from, date_to):
+        """Positions in the date index covering [date_from, date_to] (inclusive, prefix match on date_to)"""
+        lo = bisect_left(state.date_index, (str(date_from),)) if date_from else 0
+        # Appending a high code point makes '2025-03-17' include '2025-03-17T10:00:00'
+        hi = bisect_left(state.date_index, (str(date_to) + '\uffff',)) if date_to else len(state.date_index)
+        return lo, max(lo, hi)
+
+    def _sort_key(self, state, field):
+        by_id, order = state.by_id, state.order
+        if field == self.key:
+            return lambda ticket_id: ticket_id
+        if field == self.date_field:
+            return lambda ticket_id: (str(by_id[ticket_id].get(field) or ''), order[ticket_id])
+        ranks = self.sort_ranks.get(field)
+        if ranks is not None:
+            return lambda ticket_id: (ranks.get(index_value(by_id[ticket_id].get(field)), -1), order[ticket_id])
+        return lambda ticket_id: (str(index_value(by_id[ticket_id].get(field)) or ''), order[ticket_id])
+
+    def query(self, filters=None, date_from=None, date_to=None, sort=None, offset=0, limit=None):
+        """Filter, sort and page the collection. Returns (tickets, total).
+
+        `filters` are equality filters on indexed fields (see find_ids), `date_from`/`date_to`
+        bound the date field, and `sort` is a sortable field name, prefixed with '-' for
+        descending order. Without a sort, results come back in insertion order, or in date
+        order when a date range is given.
+        """
+        with self._lock.read():
+            return self._query(filters, date_from, date_to, sort, offset, limit)
+
+    def _query(self, filters, date_from, date_to, sort, offset, limit):
+        state = self._state
+        descending = bool(sort) and sort.startswith('-')
+        sort_field = sort.lstrip('-') if sort else None
+        if sort_field and sort_field not in self.sortable_fields:
+            raise ValueError(f"Cannot sort by '{sort_field}'")
+        filters = {field: value for field, value in (filters or {}).items() if value is not None}
+        offset = max(0, offset or 0)
+        has_range = bool(date_from or date_to)
+
+        if not filters and (sort_field is None or sort_field == self.date_field):
+            # Answer directly from an ordered index without touching other tickets
+            if sort_field is None and not has_range:
+                lo, hi = 0, len(state.ids)
+                pick = lambda i: state.ids[i]
+            else:
+                lo, hi = self._date_bounds(state, date_from, date_to)
+                pick = lambda i: state.date_index[i][2]
+            total = hi - lo
+            count = total - offset if limit is None else min(limit, total - offset)
+            if count <= 0:
+                return [], total
+            if descending:
+                positions = range(hi - 1 - offset, hi - 1 - offset - count, -1)
+            else:
+                positions = range(lo + offset, lo + offset + count)
+            return [state.by_id[pick(i)] for i in positions], total
+
+        ids = self._find_ids(state, filters) if filters else None
+        if has_range:
+            lo, hi = self._date_bounds(state, date_from, date_to)
+            if ids is not None and len(ids) < hi - lo:
+                start = str(date_from) if date_from else ''
+                end = str(date_to) + '\uffff' if date_to else None
+                ids = [ticket_id for ticket_id in ids
+                       if start <= str(state.by_id[ticket_id].get(self.date_field) or '')
+                       and (end is None or str(state.by_id[ticket_id].get(self.date_field) or '') < end)]
+            else:
+                wanted = set(ids) if ids is not None else None
+                ids = [entry[2] for entry in state.date_index[lo:hi] if wanted is None or entry[2] in wanted]
+            if sort_field is None:
+                sort_field = self.date_field
+        elif ids is None:
+            ids = list(state.ids)
+
+        if sort_field:
+            ids = sorted(ids, key=self._sort_key(state, sort_field), reverse=descending)
+        elif descending:
+            ids = ids[::-1]
+
+        total = len(ids)
+        end = None if limit is None else offset + limit
+        return [state.by_id[ticket_id] for ticket_id in ids[offset:end]], total
+
+    def record_event(self, ticket_id, action, details=None, timestamp=None):
+        """Append an entry to a ticket's history"""
+        entry = {"timestamp": timestamp or time.strftime('%Y-%m-%dT%H:%M:%S'), "action": action, "details": details}
+        with self._history_lock:
+            self._events[ticket_id] = self._events.get(ticket_id, ()) + (entry,)
+
+    def events(self, ticket_id):
+        """Return a ticket's history entries, oldest first"""
+        return list(self._events.get(ticket_id, ()))
+
+    def add_analysis(self, ticket_id, result):
+        """Store an analysis result for a ticket, keeping the most recent ones"""
+        entry = {"createdAt": time.time(), "result": result}
+        with self._history_lock:
+            previous = self._analyses.get(ticket_id, ())
+            self._analyses[ticket_id] = (entry,) + previous[:MAX_ANALYSES_PER_TICKET - 1]
+
+    def analyses(self, ticket_id):
+        """Return a ticket's stored analyses, newest first"""
+        return list(self._analyses.get(ticket_id, ()))
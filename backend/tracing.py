@@ -0,0 +1,225 @@
+"""
+Tracing
+-------
+Lightweight per-request spans. A route starts a root span with Tracer.trace();
+code below it opens child spans with span() or the @traced decorator, and the
+current span follows the request through threads (AgentGraph copies the context
+into its workers) and asyncio tasks via a ContextVar. Outside a traced request
+span() does nothing, so untraced requests pay a ContextVar lookup per stage.
+
+Finished traces are appended to TRACE_EXPORT_PATH as JSON lines, one span per
+line, using the OTLP/JSON span fields (traceId, spanId, parentSpanId,
+startTimeUnixNano, ...) so the file can be replayed into an OpenTelemetry collector.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+# Request header that asks for the span tree in the response metadata
+DEBUG_HEADER = 'X-Debug-Trace'
+
+_current = ContextVar('current_span', default=None)
+
+# Shared by every exporter so traces from the WSGI and ASGI apps never interleave in one file
+_export_lock = threading.Lock()
+
+
+class Span:
+    """A timed stage of a request; spans form a tree under the request's root span"""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration_ms(self):
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return round((end - self.start_ns) / 1e6, 3)
+
+    def child(self, name, attributes=None, start_ns=None, end_ns=None):
+        """Add a child span; pass start_ns/end_ns to record a stage timed elsewhere"""
+        span = Span(name, self, attributes)
+        if start_ns is not None:
+            span.start_ns = start_ns
+            span.end_ns = end_ns
+        self.children.append(span)
+        return span
+
+    def walk(self):
+        yield self
+        for child in list(self.children):
+            yield from child.walk()
+
+    def tree(self):
+        """The span and its descendants as nested dicts, with times relative to the root"""
+        root_start = self.start_ns
+
+        def build(span):
+            entry = {
+                "name": span.name,
+                "startMs": round((span.start_ns - root_start) / 1e6, 3),
+                "durationMs": span.duration_ms,
+            }
+            if span.attributes:
+                entry["attributes"] = span.attributes
+            if span.error:
+                entry["error"] = span.error
+            if span.children:
+                entry["children"] = [build(child) for child in sorted(span.children, key=lambda c: c.start_ns)]
+            return entry
+
+        return dict(build(self), traceId=self.trace_id)
+
+    def to_otlp(self):
+        """The span in OTLP/JSON form"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent.span_id if self.parent else "",
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL" if self.parent else "SPAN_KIND_SERVER",
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns if self.end_ns is not None else time.time_ns()),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": ({"code": "STATUS_CODE_ERROR", "message": self.error} if self.error
+                       else {"code": "STATUS_CODE_OK"}),
+        }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class JsonlSpanExporter:
+    """Appends finished traces to a file, one OTLP/JSON span per line"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, root):
+        lines = "".join(json.dumps(span.to_otlp(), default=str) + "\n" for span in root.walk())
+        with _export_lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+
+
+class Tracer:
+    """Starts root spans and exports them when they finish"""
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    @classmethod
+    def from_env(cls):
+        """Export to TRACE_EXPORT_PATH when it is set; otherwise only debug requests are traced"""
+        path = os.environ.get("TRACE_EXPORT_PATH", "").strip()
+        return cls(JsonlSpanExporter(path) if path else None)
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    @contextmanager
+    def trace(self, name, force=False, **attributes):
+        """Trace the block as a new request. Yields the root span, or None when tracing is
+        off and `force` (the debug header) is not set."""
+        if not (self.enabled or force):
+            yield None
+            return
+        root = Span(name, attributes=attributes)
+        with _activate(root):
+            yield root
+        if self.exporter is not None:
+            try:
+                self.exporter.export(root)
+            except Exception as e:
+                print(f"Error exporting trace: {str(e)}")
+
+
+@contextmanager
+def _activate(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the block as a child of the current span; a no-op outside a traced request"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(parent.child(name, attributes)) as current:
+        yield current
+
+
+def traced(name):
+    """Decorator form of span(), for functions and coroutine functions"""
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def current_span():
+    """The innermost open span of this request, or None when it is not traced"""
+    return _current.get()
+
+
+def set_attributes(**attributes):
+    """Add attributes to the current span, if any"""
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def debug_requested(value):
+    """Whether an X-Debug-Trace header value asks for the span tree"""
+    return (value or '').strip().lower() not in ('', '0', 'false', 'off', 'no')
+
+
+def tag_response(response, root):
+    """Add an X-Trace-Id header to a Flask response, or to a (response, status) tuple"""
+    if root is not None:
+        (response[0] if isinstance(response, tuple) else response).headers['X-Trace-Id'] = root.trace_id
+    return response
@@ -1,39 +1,24 @@
-import requests
-import json
-import traceback
+from functools import lru_cache
+from ollama_client import OllamaClient, parse_json_response
+
+@lru_cache(maxsize=8)
+def _client(ollama_url):
+    """One pooled, retrying client per Ollama server"""
+    return OllamaClient(ollama_url, "llama3:8b")
 
 def call_ollama_agent(prompt, system="", model="llama3:8b", ollama_url="http://localhost:11434"):
-    """Call Ollama API with the given prompt and system message"""
+    """Call Ollama API with the given prompt and system message.
+
+    Returns the parsed JSON object when the response is JSON, {"text": ...} otherwise,
+    or {"error": ...} if the call failed.
+    """
+    result = _client(ollama_url).generate(prompt, system=system or None, model=model)
+    if result is None:
+        return {"error": "Ollama API call failed"}
     try:
-        print(f"Calling Ollama API with model: {model}")
-        print(f"System prompt: {system}")
-        print(f"User prompt: {prompt[:100]}...")  # Print first 100 chars of prompt
-        
-        response = requests.post(
-            f"{ollama_url}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "system": system,
-                "stream": False
-            },
-            timeout=60  # Add a reasonable timeout
-        )
-        
-        if response.status_code == 200:
-            result = response.json().get("response", "")
-            # Attempt to parse as JSON if it looks like JSON
-            if result.strip().startswith("{") and result.strip().endswith("}"):
-                try:
-                    return json.loads(result)
-                except:
-                    pass
-            return {"text": result}
-        else:
-            error_msg = f"Ollama API returned status code {response.status_code}"
-            print(error_msg)
-            return {"error": error_msg}
-    except Exception as e:
-        print(f"Error calling Ollama API: {str(e)}")
-        print(traceback.format_exc())
-        return {"error": str(e)}
+        parsed = parse_json_response(result)
+        if isinstance(parsed, dict):
+            return parsed
+    except ValueError:
+        pass
+    return {"text": result}